@@ -1,9 +1,14 @@
+import atexit
+import threading
+
 from flask import Flask
 
 from iam.application.services import AuthApplicationService
 from iam.interfaces.services import iam_api
-from shared.infrastructure.database import init_db
-from wellness.interfaces.services import wellness_api
+from shared.infrastructure import config
+from shared.infrastructure.database import init_db, register_connection_hooks
+from wellness.interfaces.services import wellness_api, outbox_forwarder, priority_forwarder, outbox_pruner, \
+    partition_maintainer, record_archiver, trip_closer
 
 app = Flask(__name__)
 
@@ -11,19 +16,45 @@ app.register_blueprint(iam_api)
 app.register_blueprint(wellness_api)
 
 first_request = True
+_setup_lock = threading.Lock()
 
 @app.before_request
 def setup():
     """
-    Initialize the database and create a test device on the first request.
+    Initialize the database, create a test device and start the outbox forwarders, outbox
+    pruning, partition maintenance, archiving and the trip closer on the first request.
+    A request whose initialization fails leaves it to the next one.
     :return: None
     """
     global first_request
-    if first_request:
-        first_request = False
+    if not first_request:
+        return
+    with _setup_lock:
+        if not first_request:
+            return
         init_db()
         auth_application_service = AuthApplicationService()
         auth_application_service.get_or_create_test_device()
+        first_request = False
+        # With a writer process, it runs the forwarders and request workers only read
+        if config.OUTBOX_FORWARDER_ENABLED and not config.METRICS_WRITER_ADDRESS:
+            for forwarder in (priority_forwarder, outbox_forwarder):
+                forwarder.start()
+                atexit.register(forwarder.stop)
+        if config.OUTBOX_RETENTION_DAYS and not config.METRICS_WRITER_ADDRESS:
+            outbox_pruner.start()
+            atexit.register(outbox_pruner.stop)
+        if config.METRICS_PARTITIONING and not config.METRICS_WRITER_ADDRESS:
+            partition_maintainer.start()
+            atexit.register(partition_maintainer.stop)
+        if config.METRICS_ARCHIVE_AFTER_DAYS and not config.METRICS_WRITER_ADDRESS:
+            record_archiver.start()
+            atexit.register(record_archiver.stop)
+        if config.TRIPS_ENABLED and not config.METRICS_WRITER_ADDRESS:
+            trip_closer.start()
+            atexit.register(trip_closer.stop)
+
+register_connection_hooks(app)
 
 @app.route('/')
 def about_edge_service():
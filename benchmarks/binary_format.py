@@ -0,0 +1,79 @@
+"""
+Compare payload size and decode cost of the JSON and binary ingestion formats.
+
+Usage: python -m benchmarks.binary_format [records]
+"""
+import json
+import random
+import sys
+import timeit
+
+from wellness.infrastructure import binary_format
+
+FIELDS = ('vehicle_id', 'latitude', 'longitude', 'CO2Ppm', 'NH3Ppm', 'BenzenePpm',
+          'temperatureCelsius', 'pressureHpa', 'impactDetected', 'recorded_at')
+
+
+def mock_readings(count: int) -> list:
+    """
+    Generate readings shaped like the simulator's.
+    :param count: Number of readings.
+    :return: The readings as dictionaries.
+    """
+    return [{
+        "device_id": "bykerz-iot-001",
+        "vehicle_id": 1,
+        "latitude": -12.046374 + random.uniform(-0.001, 0.001),
+        "longitude": -77.042793 + random.uniform(-0.001, 0.001),
+        "CO2Ppm": round(random.uniform(400, 500), 2),
+        "NH3Ppm": round(random.uniform(20, 35), 2),
+        "BenzenePpm": round(random.uniform(3, 10), 2),
+        "temperatureCelsius": round(random.uniform(20, 30), 2),
+        "pressureHpa": round(random.uniform(1010, 1020), 2),
+        "impactDetected": random.random() < 0.01,
+        "recorded_at": 1760000000000 + index * 1000
+    } for index in range(count)]
+
+
+def decode_json(body: bytes) -> int:
+    """
+    Parse a JSON array and read every field, as the batch endpoint does.
+    :param body: The encoded array.
+    :return: The number of readings.
+    """
+    count = 0
+    for row in json.loads(body):
+        tuple(row[field] for field in FIELDS)
+        count += 1
+    return count
+
+
+def decode_binary(body: bytes) -> int:
+    """
+    Decode a binary frame and read every record.
+    :param body: The encoded frame.
+    :return: The number of readings.
+    """
+    _, _, rows = binary_format.decode_frame(body)
+    return sum(1 for _ in rows)
+
+
+def main(count: int) -> None:
+    readings = mock_readings(count)
+    json_body = json.dumps(readings).encode('utf-8')
+    binary_body = binary_format.encode_frame("bykerz-iot-001", readings)
+    single_json = json.dumps(readings[0]).encode('utf-8')
+    single_binary = binary_format.encode_frame("bykerz-iot-001", readings[:1])
+
+    print(f"records: {count}")
+    print(f"single reading: json {len(single_json)} B, binary {len(single_binary)} B")
+    print(f"payload: json {len(json_body)} B, binary {len(binary_body)} B "
+          f"({len(binary_body) / len(json_body):.1%})")
+    for name, decode, body in (("json", decode_json, json_body), ("binary", decode_binary, binary_body)):
+        runs = 20
+        seconds = min(timeit.repeat(lambda: decode(body), number=runs, repeat=3)) / runs
+        print(f"decode {name}: {seconds * 1e3:.3f} ms per payload, {seconds / count * 1e9:.0f} ns per record")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
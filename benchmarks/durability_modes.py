@@ -0,0 +1,103 @@
+"""
+Measure ingestion throughput and latency of each durability mode of POST /metrics.
+
+Requests go through the Flask test client against a throwaway database, with the
+forwarders posting to a local stand-in for the Bykerz backend.
+
+Usage: python -m benchmarks.durability_modes [requests] [threads]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubBackend(BaseHTTPRequestHandler):
+    """Accepts every upstream batch after a fixed delay."""
+    delay = 0.02
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+backend = ThreadingHTTPServer(('127.0.0.1', 0), StubBackend)
+threading.Thread(target=backend.serve_forever, daemon=True).start()
+os.environ.update(
+    DATABASE_PATH=os.path.join(tempfile.mkdtemp(), 'benchmark.db'),
+    BACKEND_BASE_URL=f"http://127.0.0.1:{backend.server_port}/api/v1",
+    OUTBOX_FORWARDER_ENABLED='1',
+    FORWARDER_BATCHING='1',
+    ADMISSION_ENABLED='1',
+    ADMISSION_DEVICE_LIMITS='default:1000000:1000000',
+    ADMISSION_MAX_IN_FLIGHT='1000'
+)
+
+from app import app  # noqa: E402  (configuration above must be in place first)
+from iam.infrastructure.repositories import DeviceRepository  # noqa: E402
+
+DEVICE_ID = 'bykerz-bench-001'
+API_KEY = 'benchmark-token'
+READING = {
+    "device_id": DEVICE_ID, "vehicle_id": 1, "latitude": -12.046374, "longitude": -77.042793,
+    "CO2Ppm": 451.2, "NH3Ppm": 27.5, "BenzenePpm": 4.1, "temperatureCelsius": 24.3,
+    "pressureHpa": 1015.2, "impactDetected": False
+}
+MODES = (None, 'fire-and-forget', 'local-durable', 'upstream-confirmed')
+
+
+def run(mode, count: int, threads: int) -> tuple:
+    """
+    Post readings from several threads and time each request.
+    :param mode: The durability mode requested, or None for the default full response.
+    :param count: Number of requests.
+    :param threads: Number of concurrent clients.
+    :return: A tuple of the elapsed seconds, the sorted latencies and the status code counts.
+    """
+    headers = {'Authorization': f"Bearer {API_KEY}", 'X-Device-Id': DEVICE_ID}
+    if mode:
+        headers['X-Durability'] = mode
+    local = threading.local()
+
+    def post(_):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        started = time.perf_counter()
+        status = client.post('/api/v1/metrics', json=READING, headers=headers).status_code
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(post, range(count)))
+    elapsed = time.perf_counter() - started
+    statuses = {}
+    for _, status in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return elapsed, sorted(latency for latency, _ in results), statuses
+
+
+def main(count: int, threads: int) -> None:
+    app.test_client().get('/')
+    DeviceRepository.upsert(DEVICE_ID, API_KEY)
+    print(f"requests: {count}, threads: {threads}, backend delay: {StubBackend.delay * 1e3:.0f} ms")
+    for mode in MODES:
+        elapsed, latencies, statuses = run(mode, count, threads)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+        print(f"{mode or 'default'}: {count / elapsed:.0f} req/s, p50 {p50 * 1e3:.2f} ms, "
+              f"p99 {p99 * 1e3:.2f} ms, status {statuses}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 8)
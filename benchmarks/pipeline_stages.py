@@ -0,0 +1,55 @@
+"""
+Measure the time each ingestion pipeline stage spends per record.
+
+Readings of a few simulated vehicles are run through the configured stages against a
+throwaway database, as batch ingestion does; METRICS_PIPELINE_STAGES and the settings of
+each stage are read from the environment as usual, so a deployment's composition can be
+measured before it is rolled out.
+
+Usage: python -m benchmarks.pipeline_stages [records] [requests]
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'benchmark.db'))
+os.environ.setdefault('OUTBOX_FORWARDER_ENABLED', '0')
+
+from shared.infrastructure.database import db, init_db  # noqa: E402  (configuration above must be in place first)
+from wellness.application.services import VehicleMetricRecordApplicationService  # noqa: E402
+from wellness.domain.entities import VehicleMetricRecord  # noqa: E402
+
+VEHICLES = 8
+
+
+def readings(count: int, start: datetime) -> list:
+    """
+    Build readings of vehicles moving slowly, one per second each.
+    :param count: Number of readings.
+    :param start: Time of the first reading.
+    :return: (position, record) tuples, as the ingestion endpoints pass them.
+    """
+    return [(index, VehicleMetricRecord(
+        f"bykerz-bench-{index % VEHICLES:03d}", index % VEHICLES, -12.046374 + index * 1e-6, -77.042793,
+        451.2 + index % 7, 27.5, 4.1, 24.3 + (index % 11) / 10.0, 1015.2, False,
+        recorded_at=start + timedelta(seconds=index // VEHICLES)
+    )) for index in range(count)]
+
+
+def main(count: int, requests: int) -> None:
+    init_db()
+    service = VehicleMetricRecordApplicationService(use_remote_writer=False)
+    start = datetime(2026, 1, 1)
+    with db.connection_context():
+        for request in range(requests):
+            service.pipeline.process(readings(count, start + timedelta(seconds=request * count // VEHICLES)))
+    stats = service.pipeline.stats()
+    print(f"records: {count} per request, requests: {requests}, micro-batch: {stats['batch_size']}")
+    for stage in stats["stages"]:
+        print(f"{stage['name']}: {stage['us_per_record']:.1f} us per record, "
+              f"max {stage['max_batch_ms']:.2f} ms per batch")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, int(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -0,0 +1,48 @@
+"""
+Measure the per-record time and memory of the schema-driven record codec.
+
+Usage: python -m benchmarks.record_codec [records]
+"""
+import sys
+import time
+import tracemalloc
+
+from wellness.domain.schema import METRIC_SCHEMA
+from wellness.domain.services import VehicleMetricRecordService
+
+READING = {
+    "device_id": "bykerz-iot-001", "vehicle_id": 1, "latitude": -12.046374, "longitude": -77.042793,
+    "CO2Ppm": 451.2, "NH3Ppm": 27.5, "BenzenePpm": 4.1, "temperatureCelsius": 24.3,
+    "pressureHpa": 1015.2, "impactDetected": False, "recorded_at": 1760000000000
+}
+
+
+def build(count: int) -> list:
+    """
+    Parse and coerce readings into records, as the ingestion endpoints do.
+    :param count: Number of records.
+    :return: The records.
+    """
+    return [VehicleMetricRecordService.create_record(*METRIC_SCHEMA.extract(READING), READING["recorded_at"])
+            for _ in range(count)]
+
+
+def main(count: int) -> None:
+    tracemalloc.start()
+    records = build(count)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"records: {count}")
+    print(f"retained memory: {retained / count:.0f} B per record")
+
+    for name, step in (("parse+coerce", lambda: build(count)),
+                       ("row mapping", lambda: [METRIC_SCHEMA.to_row(record) for record in records]),
+                       ("upstream payload", lambda: [METRIC_SCHEMA.to_upstream(record) for record in records]),
+                       ("response", lambda: [METRIC_SCHEMA.to_response(record) for record in records])):
+        started = time.perf_counter()
+        step()
+        print(f"{name}: {(time.perf_counter() - started) / count * 1e9:.0f} ns per record")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
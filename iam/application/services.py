@@ -1,8 +1,41 @@
-from typing import Optional
+import base64
+from typing import Optional, Tuple, Union
 
 from iam.domain.services import AuthService
 from iam.infrastructure.models import Device
 from iam.infrastructure.repositories import DeviceRepository
+from shared.infrastructure import config
+from shared.infrastructure.backend_client import BackendClient
+from shared.infrastructure.cache import SingleFlight, TTLCache
+
+# Device credentials shared by every AuthApplicationService in this process.
+# Entries are invalidated when a device's api_key changes; the TTL bounds staleness
+# for changes made by other worker processes.
+device_credential_cache = TTLCache(config.DEVICE_CACHE_MAX_SIZE, config.DEVICE_CACHE_TTL_SECONDS)
+
+# Claims of device tokens already verified locally, each kept until the token expires
+token_claims_cache = TTLCache(config.DEVICE_JWT_CLAIMS_CACHE_SIZE, config.DEVICE_CACHE_TTL_SECONDS)
+
+# Client for the registration and validation calls, sharing the backend circuit breaker
+backend_client = BackendClient()
+
+# Successful backend validation and registration answers, keyed by call, and the calls in
+# flight; a fleet validating at once after a reboot costs one backend call per device.
+token_response_cache = TTLCache(config.DEVICE_CACHE_MAX_SIZE, config.DEVICE_TOKEN_RESPONSE_TTL_SECONDS)
+backend_calls = SingleFlight()
+
+
+def device_jwt_secret() -> Optional[bytes]:
+    """
+    Read the shared secret used to verify device tokens locally.
+    :return: The secret bytes, or None when local verification is disabled.
+    """
+    if not config.DEVICE_JWT_SECRET:
+        return None
+    if config.DEVICE_JWT_SECRET_BASE64:
+        return base64.b64decode(config.DEVICE_JWT_SECRET)
+    return config.DEVICE_JWT_SECRET.encode('utf-8')
+
 
 class AuthApplicationService:
     """
@@ -14,7 +47,15 @@ class AuthApplicationService:
         Initialize the AuthApplicationService with necessary repositories and services.
         """
         self.device_repository = DeviceRepository()
-        self.auth_service = AuthService()
+        self.auth_service = AuthService(
+            jwt_secret=device_jwt_secret(),
+            leeway=config.DEVICE_JWT_LEEWAY_SECONDS,
+            claims_cache=token_claims_cache
+        )
+        self.device_cache = device_credential_cache
+        self.backend_client = backend_client
+        self.token_responses = token_response_cache
+        self.backend_calls = backend_calls
 
     def authenticate(self, device_id: str, api_key: str)->bool:
         """
@@ -54,11 +95,109 @@ class AuthApplicationService:
     def authenticate_device(self, device_id: str, api_key: str) -> bool:
         """
         Authenticate a device using its ID and JWT token.
+
+        When DEVICE_JWT_SECRET is configured the token is verified locally and the database
+        is not consulted. Otherwise the stored device is served from the credential cache,
+        so only the first request of a device within the cache TTL reaches the database.
         :param device_id: The ID of the device.
         :param api_key: The API token of the device.
-        :return:
+        :return: True if the token is valid for the device, False otherwise.
+        """
+        verified = self.auth_service.verify_device_token(device_id, api_key)
+        if verified is not None:
+            return verified
+
+        device = self.device_cache.get(device_id)
+        if device is None:
+            device = self.device_repository.find_by_id(device_id)
+            if device is None:
+                return False
+            self.device_cache.set(device_id, device)
+        return device.api_key == api_key
+
+    def invalidate_device_credentials(self, device_id: str) -> None:
+        """
+        Drop a device from the credential cache after its API key changed.
+        :param device_id: The ID of the device.
+        :return: None
+        """
+        self.device_cache.invalidate(device_id)
+
+    def get_device_cache_stats(self) -> dict:
+        """
+        Report size and hit/miss counters of the device credential cache.
+        :return: A dictionary with the cache statistics.
+        """
+        return self.device_cache.stats()
+
+    def validate_with_backend(self, device_id: str) -> Tuple[int, Union[dict, str]]:
+        """
+        Validate a device with the backend and store the token it returns.
+
+        Concurrent validations of the same device share one backend call, and a
+        successful answer is reused for DEVICE_TOKEN_RESPONSE_TTL_SECONDS.
+        :param device_id: The ID of the device.
+        :return: The backend status code and, on success, its JSON answer, else its body text.
+        :raises requests.RequestException: If the backend could not be reached.
+        """
+        key = ('validate', device_id)
+        cached = self.token_responses.get(key)
+        if cached is not None:
+            return 200, cached
+        return self.backend_calls.do(key, lambda: self._request_token(
+            key, 'validate', config.BACKEND_VALIDATE_PATH, {"deviceId": device_id}, 200, config.BACKEND_RETRIES))
+
+    def register_with_backend(self, device_id: str, vehicle_id) -> Tuple[int, Union[dict, str]]:
+        """
+        Register a device with the backend and store the token it returns.
+
+        Identical concurrent registrations share one backend call, and a successful
+        answer is reused for DEVICE_TOKEN_RESPONSE_TTL_SECONDS. The call is never retried,
+        as registration is not idempotent.
+        :param device_id: The ID of the device.
+        :param vehicle_id: The vehicle the device is mounted on.
+        :return: The backend status code and, on success, its JSON answer, else its body text.
+        :raises requests.RequestException: If the backend could not be reached.
+        """
+        key = ('register', device_id, vehicle_id)
+        cached = self.token_responses.get(key)
+        if cached is not None:
+            return 201, cached
+        return self.backend_calls.do(key, lambda: self._request_token(
+            key, 'register', config.BACKEND_REGISTER_PATH, {"deviceId": device_id, "vehicleId": vehicle_id}, 201))
+
+    def _request_token(self, key: tuple, endpoint: str, path: str, body: dict, success_status: int,
+                       retries: int = 0) -> Tuple[int, Union[dict, str]]:
+        """
+        Make one validation or registration call and store the issued token.
+        :param key: Cache key of the call.
+        :param endpoint: Name of the backend endpoint.
+        :param path: Path of the endpoint under BACKEND_BASE_URL.
+        :param body: The request body.
+        :param success_status: Status code the backend answers on success.
+        :param retries: Extra attempts after a failure.
+        :return: The backend status code and, on success, its JSON answer, else its body text.
+        """
+        response = self.backend_client.post(endpoint, f"{config.BACKEND_BASE_URL}{path}",
+                                            retries=retries, json=body)
+        if response.status_code != success_status:
+            return response.status_code, response.text
+        # Backend returns { "id": 0, "deviceId": "...", "vehicleId": 0, "token": "..." }
+        backend_data = response.json()
+        device_id = body["deviceId"]
+        self.device_repository.upsert(device_id, backend_data["token"])
+        self.invalidate_device_credentials(device_id)
+        if endpoint == 'register':
+            # A newer token replaces whatever a previous validation returned
+            self.token_responses.invalidate(('validate', device_id))
+        self.token_responses.set(key, backend_data)
+        return success_status, backend_data
+
+    def get_backend_stats(self) -> dict:
+        """
+        Report the backend client state, the token answer cache and call coalescing.
+        :return: A dictionary with the backend, token_responses and coalescing statistics.
         """
-        device = self.device_repository.find_by_id(device_id)
-        if device and device.api_key == api_key:
-            return True
-        return False
\ No newline at end of file
+        return dict(self.backend_client.stats(),
+                    token_responses=self.token_responses.stats(),
+                    coalescing=self.backend_calls.stats())
@@ -1,12 +1,35 @@
-from iam.domain.entities import Device
+import base64
+import hashlib
+import hmac
+import json
+import time
 from typing import Optional
 
+from iam.domain.entities import Device
+from shared.infrastructure.cache import TTLCache
+
 class AuthService:
     """
     Constructor for AuthService
     """
-    def __init__(self):
-        pass
+    # HMAC algorithms accepted in device tokens, keyed by JWT "alg" header
+    _ALGORITHMS = {
+        'HS256': hashlib.sha256,
+        'HS384': hashlib.sha384,
+        'HS512': hashlib.sha512,
+    }
+
+    def __init__(self, jwt_secret: Optional[bytes] = None, leeway: float = 0.0,
+                 claims_cache: Optional[TTLCache] = None):
+        """
+        Initialize the service, optionally with local verification of device tokens.
+        :param jwt_secret: Shared HMAC secret used by the backend to sign device tokens.
+        :param leeway: Seconds of clock skew tolerated when checking expiry.
+        :param claims_cache: Cache of verified claims keyed by token.
+        """
+        self.jwt_secret = jwt_secret
+        self.leeway = leeway
+        self.claims_cache = claims_cache
 
     @staticmethod
     def authenticate(device: Optional[Device])->bool:
@@ -15,4 +38,67 @@ class AuthService:
         :param device: Device object or None
         :return: True if the device is valid, False otherwise
         """
-        return device is not None
\ No newline at end of file
+        return device is not None
+
+    @staticmethod
+    def _b64url_decode(segment: str) -> bytes:
+        """
+        Decode an unpadded base64url JWT segment.
+        :param segment: The encoded segment.
+        :return: The decoded bytes.
+        """
+        return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+    def _decode_verified_claims(self, token: str) -> Optional[dict]:
+        """
+        Check a token's signature and return its claims.
+        :param token: The compact JWT.
+        :return: The claims if the signature is valid, None otherwise.
+        """
+        try:
+            header_segment, payload_segment, signature_segment = token.split('.')
+            header = json.loads(self._b64url_decode(header_segment))
+            digest = self._ALGORITHMS.get(header.get('alg'))
+            if digest is None:
+                return None
+            expected = hmac.new(self.jwt_secret, f"{header_segment}.{payload_segment}".encode('ascii'),
+                                digest).digest()
+            if not hmac.compare_digest(expected, self._b64url_decode(signature_segment)):
+                return None
+            claims = json.loads(self._b64url_decode(payload_segment))
+            return claims if isinstance(claims, dict) else None
+        except (ValueError, UnicodeError, AttributeError):
+            return None
+
+    def verify_device_token(self, device_id: str, token: str) -> Optional[bool]:
+        """
+        Verify a device token locally, without looking the device up.
+
+        The token must carry a valid HMAC signature, a "sub" claim equal to the device ID
+        and an "exp" claim in the future. Verified claims are cached until the token expires.
+        :param device_id: The ID of the device presenting the token.
+        :param token: The device's JWT.
+        :return: True or False when a secret is configured, None when the caller must fall back
+            to comparing against the stored device.
+        """
+        if not self.jwt_secret:
+            return None
+
+        claims = self.claims_cache.get(token) if self.claims_cache is not None else None
+        now = time.time()
+        if claims is None:
+            claims = self._decode_verified_claims(token)
+            if claims is None:
+                return False
+            exp = claims.get('exp')
+            if not isinstance(exp, (int, float)) or exp + self.leeway <= now:
+                return False
+            if self.claims_cache is not None:
+                self.claims_cache.set(token, claims, ttl=exp + self.leeway - now)
+
+        if claims['exp'] + self.leeway <= now:
+            return False
+        subject = claims.get('sub')
+        if not isinstance(subject, str):
+            return False
+        return hmac.compare_digest(subject.encode('utf-8'), device_id.encode('utf-8'))
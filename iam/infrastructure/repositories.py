@@ -1,4 +1,5 @@
 
+from datetime import datetime
 from typing import Optional
 
 import peewee
@@ -40,6 +41,19 @@ class DeviceRepository:
             return None
 
 
+    @staticmethod
+    def upsert(device_id: str, api_key: str) -> None:
+        """
+        Stores a device, or replaces the API key of an existing one, in a single statement.
+        :param device_id: The ID of the device.
+        :param api_key: The API key issued by the backend.
+        :return: None
+        """
+        DeviceModel.insert(device_id=device_id, api_key=api_key, created_at=datetime.now()).on_conflict(
+            conflict_target=[DeviceModel.device_id],
+            update={DeviceModel.api_key: api_key}
+        ).execute()
+
     @staticmethod
     def get_or_create_test_device()->Device:
         device, _ = DeviceModel.get_or_create(
@@ -1,7 +1,10 @@
+import math
+
 import requests
 from flask import Blueprint, request, jsonify
 
 from iam.application.services import AuthApplicationService
+from shared.infrastructure.backend_client import BackendUnavailable
 
 iam_api = Blueprint('iam_api', __name__, url_prefix='/api/v1')
 
@@ -24,6 +27,18 @@ def authenticate_request():
     return None
 
 
+def backend_unavailable_response(error: BackendUnavailable):
+    """
+    Build the immediate answer given while the backend circuit breaker is open.
+    :param error: The fast-fail error.
+    :return: A 503 JSON response with a Retry-After header.
+    """
+    retry_after = max(1, math.ceil(error.retry_after))
+    response = jsonify({"error": "Backend unavailable", "retry_after_seconds": retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
+
 @iam_api.route('/devices/authentication/register', methods=['POST'])
 def register_device():
     """
@@ -46,45 +61,26 @@ def register_device():
     Returns:
     - 201: Device registered successfully with token
     - 400: Missing required fields
-    - 503: Backend connection error
+    - 503: Backend connection error, or backend unavailable (with Retry-After)
+    - 504: Backend connection timeout
     """
     try:
         data = request.json
         device_id = data["deviceId"]
         vehicle_id = data["vehicleId"]
 
-        # Forward registration to Bykerz backend
-        backend_url = "https://bykerz-backend.onrender.com/api/v1/devices/authentication/register"
-        #backend_url = "http://localhost:8080/api/v1/devices/authentication/register"
-        response = requests.post(
-            backend_url,
-            json={"deviceId": device_id, "vehicleId": vehicle_id},
-            timeout=10
-        )
-
-        if response.status_code == 201:
-            # Backend returns { "id": 0, "deviceId": "...", "vehicleId": 0, "token": "..." }
-            backend_data = response.json()
-            api_key = backend_data["token"]  # Extract token from response
-
-            # Store device locally in edge database
-            from iam.infrastructure.models import Device as DeviceModel
-            from datetime import datetime
-
-            DeviceModel.get_or_create(
-                device_id=device_id,
-                defaults={
-                    'api_key': api_key,
-                    'created_at': datetime.now()
-                }
-            )
+        # Forward registration to Bykerz backend and store the issued token locally
+        status_code, backend_data = auth_service.register_with_backend(device_id, vehicle_id)
 
+        if status_code == 201:
             return jsonify(backend_data), 201
         else:
-            return jsonify({"error": "Backend registration failed", "details": response.text}), response.status_code
+            return jsonify({"error": "Backend registration failed", "details": backend_data}), status_code
 
     except KeyError as e:
         return jsonify({"error": f"Missing field: {str(e)}"}), 400
+    except BackendUnavailable as e:
+        return backend_unavailable_response(e)
     except requests.Timeout:
         return jsonify({"error": "Backend connection timeout"}), 504
     except requests.RequestException as e:
@@ -113,53 +109,51 @@ def validate_device():
     - 200: Device validated successfully with token
     - 404: Device not found in backend
     - 400: Missing required fields
-    - 503: Backend connection error
+    - 503: Backend connection error, or backend unavailable (with Retry-After)
+    - 504: Backend connection timeout
     """
     try:
         data = request.json
         device_id = data["deviceId"]
 
-        # Call backend validation endpoint
-        #backend_url = "http://localhost:8080/api/v1/devices/authentication/validate"
-        backend_url = "https://bykerz-backend.onrender.com/api/v1/devices/authentication/validate"
-        response = requests.post(
-            backend_url,
-            json={"deviceId": device_id},
-            timeout=10
-        )
-
-        if response.status_code == 200:
-            # Backend returns { "id": 0, "deviceId": "...", "vehicleId": 0, "token": "..." }
-            backend_data = response.json()
-            api_key = backend_data["token"]
-
-            # Store or update device locally in edge database
-            from iam.infrastructure.models import Device as DeviceModel
-            from datetime import datetime
-
-            device, created = DeviceModel.get_or_create(
-                device_id=device_id,
-                defaults={
-                    'api_key': api_key,
-                    'created_at': datetime.now()
-                }
-            )
-
-            # Update api_key if device already exists
-            if not created:
-                device.api_key = api_key
-                device.save()
+        # Call backend validation endpoint and store or update the token locally
+        status_code, backend_data = auth_service.validate_with_backend(device_id)
 
+        if status_code == 200:
             return jsonify(backend_data), 200
-
-        elif response.status_code == 404:
+        elif status_code == 404:
             return jsonify({"error": "Device not found in backend"}), 404
         else:
-            return jsonify({"error": "Backend validation failed", "details": response.text}), response.status_code
+            return jsonify({"error": "Backend validation failed", "details": backend_data}), status_code
 
     except KeyError as e:
         return jsonify({"error": f"Missing field: {str(e)}"}), 400
+    except BackendUnavailable as e:
+        return backend_unavailable_response(e)
     except requests.Timeout:
         return jsonify({"error": "Backend connection timeout"}), 504
     except requests.RequestException as e:
         return jsonify({"error": f"Backend connection error: {str(e)}"}), 503
+
+
+@iam_api.route('/devices/authentication/cache', methods=['GET'])
+def get_device_cache_stats():
+    """
+    Report the state of the device credential cache.
+
+    Returns:
+    - 200: Cache size, capacity, TTL and hit/miss counters
+    """
+    return jsonify(auth_service.get_device_cache_stats()), 200
+
+
+@iam_api.route('/backend/status', methods=['GET'])
+def get_backend_status():
+    """
+    Report the state of the backend circuit breaker, the adaptive timeout of each endpoint,
+    the cache of validation and registration answers and how many calls were coalesced.
+
+    Returns:
+    - 200: Breaker state, per-endpoint latency estimates, token answer cache and coalescing counters
+    """
+    return jsonify(auth_service.get_backend_stats()), 200
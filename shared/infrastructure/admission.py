@@ -0,0 +1,176 @@
+"""
+Admission control for ingestion: per-device rate limits and global load shedding.
+"""
+import fnmatch
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class DeviceRateLimiter:
+    """
+    Token-bucket rate limiter keyed by device ID.
+
+    Each device class has a refill rate (requests per second) and a burst size; a device's
+    class is the first pattern its ID matches, or default_class. Buckets start full, are
+    refilled lazily on use, and are kept for at most max_devices devices, least recently
+    seen first out, so every decision is O(1) in time and memory stays bounded.
+    """
+    def __init__(self, limits: Dict[str, Tuple[float, float]], class_patterns: List[Tuple[str, str]],
+                 default_class: str = 'default', max_devices: int = 10000):
+        """
+        Initialize the limiter.
+        :param limits: (rate, burst) of each device class.
+        :param class_patterns: (fnmatch pattern, class) pairs tried in order against device IDs.
+        :param default_class: Class of devices matching no pattern.
+        :param max_devices: Number of device buckets kept.
+        """
+        self.limits = limits
+        self.class_patterns = class_patterns
+        self.default_class = default_class
+        self.max_devices = max_devices
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+
+    @staticmethod
+    def parse_limits(limits: str) -> Dict[str, Tuple[float, float]]:
+        """
+        Parse class limits written as 'class:rate:burst,...'.
+        :param limits: The limits, e.g. 'default:10:30,gateway:100:300'.
+        :return: The (rate, burst) of each class.
+        """
+        parsed = {}
+        for rule in filter(None, (part.strip() for part in limits.split(','))):
+            device_class, rate, burst = rule.split(':')
+            parsed[device_class] = (float(rate), float(burst))
+        return parsed
+
+    @staticmethod
+    def parse_patterns(patterns: str) -> List[Tuple[str, str]]:
+        """
+        Parse device class patterns written as 'pattern:class,...'.
+        :param patterns: The patterns, e.g. 'bykerz-gw-*:gateway'.
+        :return: The (pattern, class) pairs in order.
+        """
+        return [tuple(rule.rsplit(':', 1)) for rule in filter(None, (part.strip() for part in patterns.split(',')))]
+
+    def device_class(self, device_id: str) -> str:
+        """
+        Resolve the class of a device.
+        :param device_id: The ID of the device.
+        :return: The class of the first matching pattern, or the default class.
+        """
+        for pattern, device_class in self.class_patterns:
+            if fnmatch.fnmatchcase(device_id, pattern):
+                return device_class
+        return self.default_class
+
+    def acquire(self, device_id: str) -> float:
+        """
+        Take one token from a device's bucket.
+        :param device_id: The ID of the device.
+        :return: 0 if the request is admitted, else the seconds until a token is available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(device_id)
+            if bucket is None:
+                rate, burst = self.limits.get(self.device_class(device_id), self.limits[self.default_class])
+                bucket = self._buckets[device_id] = [burst, now, rate, burst]
+                if len(self._buckets) > self.max_devices:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(device_id)
+            tokens, updated_at, rate, burst = bucket
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                self.admitted += 1
+                return 0.0
+            bucket[0] = tokens
+            self.rejected += 1
+            return (1 - tokens) / rate if rate > 0 else float('inf')
+
+    def stats(self) -> dict:
+        """
+        Report the limits and counters.
+        :return: A dictionary with the class limits, tracked_devices, admitted and rejected.
+        """
+        with self._lock:
+            return {
+                "classes": {name: {"rate_per_second": rate, "burst": burst}
+                            for name, (rate, burst) in self.limits.items()},
+                "tracked_devices": len(self._buckets),
+                "admitted": self.admitted,
+                "rejected": self.rejected
+            }
+
+
+class LoadShedder:
+    """
+    Global ingestion gate that rejects work the single database writer cannot absorb.
+
+    A request is shed when max_in_flight requests are already being served, or when the
+    write queue reported by queue_depth holds max_queue_depth items or more. Shedding is
+    immediate, so an overloaded writer never makes clients queue behind it.
+    """
+    def __init__(self, max_in_flight: int, max_queue_depth: int = None,
+                 queue_depth: Callable[[], int] = None, retry_after: float = 1.0):
+        """
+        Initialize the gate.
+        :param max_in_flight: Requests served concurrently.
+        :param max_queue_depth: Write queue depth at which requests are shed; None disables the check.
+        :param queue_depth: Returns the current write queue depth.
+        :param retry_after: Seconds suggested to shed clients.
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.shed = 0
+
+    def enter(self) -> Optional[str]:
+        """
+        Try to start serving a request; every admitted request must call leave().
+        :return: None if admitted, else why the request was shed.
+        """
+        depth = self.queue_depth() if self.queue_depth is not None else 0
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                reason = "in_flight"
+            elif self.max_queue_depth is not None and depth >= self.max_queue_depth:
+                reason = "write_queue"
+            else:
+                self._in_flight += 1
+                return None
+            self.shed += 1
+            return reason
+
+    def leave(self) -> None:
+        """
+        Finish serving an admitted request.
+        :return: None
+        """
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self) -> dict:
+        """
+        Report the gate's limits, load and counters.
+        :return: A dictionary with in_flight, max_in_flight, queue_depth, max_queue_depth and shed.
+        """
+        depth = self.queue_depth() if self.queue_depth is not None else None
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "queue_depth": depth,
+                "max_queue_depth": self.max_queue_depth,
+                "shed": self.shed
+            }
@@ -0,0 +1,345 @@
+"""
+Resilient HTTP client for calls to the Bykerz backend.
+
+Every backend call made by the edge (device registration and validation, and the
+outbox forwarders) goes through a BackendClient. A circuit breaker shared by all
+clients stops calling the backend after consecutive failures and answers immediately
+with BackendUnavailable until a probe succeeds, and each endpoint's timeout follows
+its observed latency instead of a fixed ceiling.
+"""
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from shared.infrastructure import config
+
+
+class BackendUnavailable(requests.RequestException):
+    """
+    Raised without contacting the backend while the circuit breaker is open.
+    """
+    def __init__(self, retry_after: float):
+        """
+        Initialize the error.
+        :param retry_after: Seconds until the backend will be tried again.
+        """
+        super().__init__(f"Backend unavailable, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def create_pooled_session(pool_size: int) -> requests.Session:
+    """
+    Create an HTTP session that keeps a bounded pool of keep-alive connections.
+    :param pool_size: Maximum number of connections kept open per host.
+    :return: The configured session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def jittered_backoff(attempt: int, base: float, cap: float) -> float:
+    """
+    Exponential backoff with equal jitter, so callers that failed together do not retry together.
+    :param attempt: Number of consecutive failures, starting at 1.
+    :param base: Delay in seconds after the first failure, before jitter.
+    :param cap: Upper bound in seconds for the delay.
+    :return: A delay between half and all of min(cap, base * 2 ** (attempt - 1)).
+    """
+    delay = min(cap, base * 2 ** max(attempt - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker.
+
+    Closed: calls go through and consecutive failures are counted. After failure_threshold
+    of them the breaker opens: calls fail fast for a jittered, exponentially growing
+    period. When it elapses the breaker is half-open and lets up to half_open_probes calls
+    through; a success closes it, a failure opens it again for longer.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, open_seconds: float, max_open_seconds: float,
+                 half_open_probes: int = 1):
+        """
+        Initialize the breaker in the closed state.
+        :param failure_threshold: Consecutive failures that open the breaker.
+        :param open_seconds: Base time the breaker stays open after the first trip.
+        :param max_open_seconds: Upper bound for the open period.
+        :param half_open_probes: Calls let through concurrently while half-open.
+        """
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_probes = half_open_probes
+        self._state = self.CLOSED
+        self._failures = 0
+        self._trips = 0
+        self._probes = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        """
+        Current state, reporting an open breaker whose period has elapsed as half-open.
+        :return: 'closed', 'open' or 'half_open'.
+        """
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() >= self._open_until:
+                return self.HALF_OPEN
+            return self._state
+
+    def retry_after(self) -> float:
+        """
+        Seconds until calls are let through again.
+        :return: The remaining open period, 0 when the breaker is not open.
+        """
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(self._open_until - time.monotonic(), 0.0)
+
+    def before_call(self) -> None:
+        """
+        Reserve a call, failing fast while the breaker is open or its probes are taken.
+        :return: None
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                remaining = self._open_until - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise BackendUnavailable(remaining)
+                self._state = self.HALF_OPEN
+                self._probes = 0
+            if self._state == self.HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self.rejected += 1
+                    raise BackendUnavailable(self.open_seconds)
+                self._probes += 1
+
+    def release(self) -> None:
+        """
+        Give back a reserved call that ended without reaching the backend or failing there,
+        such as a request that could not be built, so a half-open probe slot is not lost.
+        :return: None
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_success(self) -> None:
+        """
+        Record a call that reached the backend and got a non-server-error answer.
+        :return: None
+        """
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trips = 0
+            self._probes = 0
+
+    def record_failure(self) -> None:
+        """
+        Record a call that failed to connect, timed out or got a server error.
+        :return: None
+        """
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._trips += 1
+                self._state = self.OPEN
+                self._open_until = time.monotonic() + jittered_backoff(
+                    self._trips, self.open_seconds, self.max_open_seconds)
+                self._failures = 0
+                self._probes = 0
+                self.opened += 1
+
+    def stats(self) -> dict:
+        """
+        Report the breaker state and counters.
+        :return: A dictionary with state, retry_after_seconds, consecutive_failures, trips, opened and rejected.
+        """
+        state, retry_after = self.state, self.retry_after()
+        with self._lock:
+            return {
+                "state": state,
+                "retry_after_seconds": retry_after,
+                "consecutive_failures": self._failures,
+                "failure_threshold": self.failure_threshold,
+                "trips": self._trips,
+                "opened": self.opened,
+                "rejected": self.rejected
+            }
+
+
+class AdaptiveTimeouts:
+    """
+    Per-endpoint request timeouts derived from observed latency.
+
+    Each endpoint keeps a smoothed latency and mean deviation, updated as TCP does for its
+    retransmission timer, and its timeout is the smoothed latency plus deviation_factor
+    deviations, clamped to [min_seconds, max_seconds]. Endpoints without samples use the
+    ceiling. Timed-out calls are recorded at the timeout used, which widens the estimate.
+    """
+    def __init__(self, min_seconds: float, max_seconds: float, deviation_factor: float = 4.0,
+                 gain: float = 0.125, deviation_gain: float = 0.25):
+        """
+        Initialize the estimator.
+        :param min_seconds: Shortest timeout ever used.
+        :param max_seconds: Longest timeout ever used.
+        :param deviation_factor: Deviations added to the smoothed latency.
+        :param gain: Weight of a new sample in the smoothed latency.
+        :param deviation_gain: Weight of a new sample in the mean deviation.
+        """
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.deviation_factor = deviation_factor
+        self.gain = gain
+        self.deviation_gain = deviation_gain
+        self._estimates: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def timeout(self, endpoint: str, ceiling: Optional[float] = None) -> float:
+        """
+        Timeout for the next call to an endpoint.
+        :param endpoint: Name of the endpoint.
+        :param ceiling: Caller's own upper bound, used instead of max_seconds if lower.
+        :return: The timeout in seconds.
+        """
+        upper = min(ceiling, self.max_seconds) if ceiling else self.max_seconds
+        with self._lock:
+            estimate = self._estimates.get(endpoint)
+            if estimate is None:
+                return upper
+            smoothed, deviation, _ = estimate
+        return max(self.min_seconds, min(upper, smoothed + self.deviation_factor * deviation))
+
+    def record(self, endpoint: str, seconds: float) -> None:
+        """
+        Record the latency of one call.
+        :param endpoint: Name of the endpoint.
+        :param seconds: Time until the answer arrived, or the timeout if none did.
+        :return: None
+        """
+        with self._lock:
+            estimate = self._estimates.get(endpoint)
+            if estimate is None:
+                self._estimates[endpoint] = [seconds, seconds / 2, 1]
+                return
+            smoothed, deviation, samples = estimate
+            deviation += self.deviation_gain * (abs(seconds - smoothed) - deviation)
+            smoothed += self.gain * (seconds - smoothed)
+            self._estimates[endpoint] = [smoothed, deviation, samples + 1]
+
+    def stats(self) -> dict:
+        """
+        Report the estimate of every endpoint.
+        :return: A dictionary keyed by endpoint with latency, deviation, timeout and samples.
+        """
+        with self._lock:
+            estimates = {endpoint: list(estimate) for endpoint, estimate in self._estimates.items()}
+        return {
+            endpoint: {
+                "latency_seconds": smoothed,
+                "deviation_seconds": deviation,
+                "timeout_seconds": self.timeout(endpoint),
+                "samples": samples
+            }
+            for endpoint, (smoothed, deviation, samples) in estimates.items()
+        }
+
+
+# Breaker and timeout estimates shared by every client in this process: all of them
+# talk to the same backend, so an outage seen by one is an outage for all.
+backend_breaker = CircuitBreaker(
+    config.BACKEND_BREAKER_FAILURE_THRESHOLD,
+    config.BACKEND_BREAKER_OPEN_SECONDS,
+    config.BACKEND_BREAKER_MAX_OPEN_SECONDS
+)
+backend_timeouts = AdaptiveTimeouts(config.BACKEND_MIN_TIMEOUT_SECONDS, config.BACKEND_TIMEOUT_SECONDS)
+
+
+class BackendClient:
+    """
+    HTTP client for the Bykerz backend guarded by the circuit breaker and adaptive timeouts.
+    """
+    def __init__(self, session: requests.Session = None, breaker: CircuitBreaker = None,
+                 timeouts: AdaptiveTimeouts = None):
+        """
+        Initialize the client.
+        :param session: HTTP session used for the calls.
+        :param breaker: Circuit breaker guarding the calls; defaults to the shared one.
+        :param timeouts: Timeout estimator; defaults to the shared one.
+        """
+        self.session = session or requests.Session()
+        self.breaker = breaker or backend_breaker
+        self.timeouts = timeouts or backend_timeouts
+
+    def post(self, endpoint: str, url: str, retries: int = 0, timeout: float = None,
+             **kwargs) -> requests.Response:
+        """
+        POST to the backend.
+
+        Connection errors, timeouts and 5xx answers count as breaker failures and are
+        retried up to retries times after a jittered backoff; only idempotent calls should
+        ask for retries. Any other answer is returned as is. Other errors, such as a body
+        that cannot be encoded, are raised after giving back the call reserved on the breaker.
+        :param endpoint: Name of the endpoint, which keys its latency estimate.
+        :param url: The full URL.
+        :param retries: Extra attempts after a failure.
+        :param timeout: Upper bound for the adaptive timeout of this call.
+        :param kwargs: Passed to requests.Session.post.
+        :return: The backend response.
+        :raises BackendUnavailable: If the breaker is open.
+        :raises requests.RequestException: If the last attempt failed without a response.
+        """
+        for attempt in range(retries + 1):
+            call_timeout = self.timeouts.timeout(endpoint, timeout)
+            self.breaker.before_call()
+            started = time.perf_counter()
+            try:
+                response = self.session.post(url, timeout=call_timeout, **kwargs)
+            except requests.Timeout:
+                self.timeouts.record(endpoint, call_timeout)
+                self.breaker.record_failure()
+                if attempt == retries:
+                    raise
+            except requests.RequestException:
+                self.breaker.record_failure()
+                if attempt == retries:
+                    raise
+            except BaseException:
+                # Not an outcome of the backend: free the reserved call and let the error through
+                self.breaker.release()
+                raise
+            else:
+                self.timeouts.record(endpoint, time.perf_counter() - started)
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if attempt == retries:
+                    return response
+            time.sleep(jittered_backoff(attempt + 1, config.BACKEND_RETRY_BASE_SECONDS,
+                                        config.BACKEND_RETRY_MAX_SECONDS))
+
+    def stats(self) -> dict:
+        """
+        Report the breaker and per-endpoint timeout state.
+        :return: A dictionary with the breaker and endpoints statistics.
+        """
+        return {"breaker": self.breaker.stats(), "endpoints": self.timeouts.stats()}
@@ -0,0 +1,157 @@
+"""
+Bounded in-memory caching with per-entry expiry, and coalescing of concurrent identical calls.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after a time-to-live.
+
+    When full, the least recently used entry is evicted. Hit and miss counters are kept
+    so the cache's effectiveness can be monitored.
+    """
+    _MISSING = object()
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Initialize the cache.
+        :param max_size: Maximum number of entries kept.
+        :param ttl: Default seconds an entry stays valid.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Look up a live entry and mark it as recently used.
+        :param key: The cache key.
+        :param default: Value returned when the key is missing or expired.
+        :return: The cached value, or default.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, self._MISSING)
+            if entry is self._MISSING or entry[1] <= now:
+                if entry is not self._MISSING:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store an entry, evicting the least recently used one if the cache is full.
+        :param key: The cache key.
+        :param value: The value to store.
+        :param ttl: Seconds the entry stays valid; defaults to the cache TTL.
+        :return: None
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Remove an entry if present.
+        :param key: The cache key.
+        :return: None
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Remove every entry.
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Report the cache size and counters.
+        :return: A dictionary with size, max_size, ttl, hits, misses, evictions and hit_ratio.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0
+            }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it runs wait
+    for it and receive the same result, or the same exception. Nothing is kept once the
+    call finishes, so later callers run the function again.
+    """
+    def __init__(self):
+        """
+        Initialize with no calls in flight.
+        """
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """
+        Run a function, or join the run already in flight for the same key.
+        :param key: Identifies calls that can share a result.
+        :param function: The call to make, without arguments.
+        :return: The function's result.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+        try:
+            call[1] = function()
+            return call[1]
+        except BaseException as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+
+    def stats(self) -> dict:
+        """
+        Report how many calls ran and how many joined a call in flight.
+        :return: A dictionary with in_flight, executed and coalesced.
+        """
+        with self._lock:
+            return {"in_flight": len(self._calls), "executed": self.executed, "coalesced": self.coalesced}
@@ -0,0 +1,237 @@
+"""
+Runtime configuration for the edge service.
+
+Every setting can be overridden through an environment variable of the same name.
+"""
+import os
+
+
+def _env_str(name: str, default: str) -> str:
+    """
+    Read a string setting from the environment.
+    :param name: The environment variable name.
+    :param default: The value used when the variable is not set.
+    :return: The configured value.
+    """
+    return os.environ.get(name, default)
+
+
+def _env_int(name: str, default: int) -> int:
+    """
+    Read an integer setting from the environment.
+    :param name: The environment variable name.
+    :param default: The value used when the variable is not set.
+    :return: The configured value.
+    """
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    """
+    Read a float setting from the environment.
+    :param name: The environment variable name.
+    :param default: The value used when the variable is not set.
+    :return: The configured value.
+    """
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """
+    Read a boolean setting from the environment.
+    :param name: The environment variable name.
+    :param default: The value used when the variable is not set.
+    :return: The configured value.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# Bykerz backend
+BACKEND_BASE_URL = _env_str('BACKEND_BASE_URL', 'https://bykerz-backend.onrender.com/api/v1')
+BACKEND_TIMEOUT_SECONDS = _env_float('BACKEND_TIMEOUT_SECONDS', 10.0)
+BACKEND_MIN_TIMEOUT_SECONDS = _env_float('BACKEND_MIN_TIMEOUT_SECONDS', 1.0)
+BACKEND_REGISTER_PATH = _env_str('BACKEND_REGISTER_PATH', '/devices/authentication/register')
+BACKEND_VALIDATE_PATH = _env_str('BACKEND_VALIDATE_PATH', '/devices/authentication/validate')
+BACKEND_RETRIES = _env_int('BACKEND_RETRIES', 1)
+BACKEND_RETRY_BASE_SECONDS = _env_float('BACKEND_RETRY_BASE_SECONDS', 0.2)
+BACKEND_RETRY_MAX_SECONDS = _env_float('BACKEND_RETRY_MAX_SECONDS', 2.0)
+
+# Circuit breaker guarding every backend call
+BACKEND_BREAKER_FAILURE_THRESHOLD = _env_int('BACKEND_BREAKER_FAILURE_THRESHOLD', 5)
+BACKEND_BREAKER_OPEN_SECONDS = _env_float('BACKEND_BREAKER_OPEN_SECONDS', 5.0)
+BACKEND_BREAKER_MAX_OPEN_SECONDS = _env_float('BACKEND_BREAKER_MAX_OPEN_SECONDS', 120.0)
+
+# Metric outbox forwarding
+OUTBOX_FORWARDER_ENABLED = _env_bool('OUTBOX_FORWARDER_ENABLED', True)
+OUTBOX_POLL_INTERVAL_SECONDS = _env_float('OUTBOX_POLL_INTERVAL_SECONDS', 1.0)
+OUTBOX_CLAIM_SIZE = _env_int('OUTBOX_CLAIM_SIZE', 500)
+OUTBOX_LEASE_SECONDS = _env_float('OUTBOX_LEASE_SECONDS', 60.0)
+OUTBOX_MAX_ATTEMPTS = _env_int('OUTBOX_MAX_ATTEMPTS', 20)
+OUTBOX_RETRY_BASE_SECONDS = _env_float('OUTBOX_RETRY_BASE_SECONDS', 2.0)
+OUTBOX_RETRY_MAX_SECONDS = _env_float('OUTBOX_RETRY_MAX_SECONDS', 600.0)
+# Sent, failed and superseded outbox entries are deleted this many days after they were
+# queued; 0 keeps them
+OUTBOX_RETENTION_DAYS = _env_float('OUTBOX_RETENTION_DAYS', 7.0)
+OUTBOX_PRUNE_INTERVAL_SECONDS = _env_float('OUTBOX_PRUNE_INTERVAL_SECONDS', 3600.0)
+
+# Upstream forwarding: one JSON object per request to the metrics endpoint, or, once the
+# backend accepts them, JSON arrays to the batch endpoint (optionally gzip-compressed)
+FORWARDER_METRICS_PATH = _env_str('FORWARDER_METRICS_PATH', '/metrics')
+FORWARDER_BATCHING = _env_bool('FORWARDER_BATCHING', False)
+FORWARDER_BATCH_PATH = _env_str('FORWARDER_BATCH_PATH', '/metrics/batch')
+FORWARDER_BATCH_SIZE = _env_int('FORWARDER_BATCH_SIZE', 100)
+FORWARDER_BATCH_MAX_AGE_SECONDS = _env_float('FORWARDER_BATCH_MAX_AGE_SECONDS', 5.0)
+FORWARDER_POOL_SIZE = _env_int('FORWARDER_POOL_SIZE', 4)
+FORWARDER_GZIP = _env_bool('FORWARDER_GZIP', False)
+
+# Group-commit write-behind for metric ingestion
+METRICS_WRITE_BEHIND_ENABLED = _env_bool('METRICS_WRITE_BEHIND_ENABLED', False)
+METRICS_WRITE_BEHIND_MAX_ROWS = _env_int('METRICS_WRITE_BEHIND_MAX_ROWS', 200)
+METRICS_WRITE_BEHIND_MAX_DELAY_MS = _env_float('METRICS_WRITE_BEHIND_MAX_DELAY_MS', 20.0)
+METRICS_WRITE_BEHIND_MAX_QUEUE = _env_int('METRICS_WRITE_BEHIND_MAX_QUEUE', 10000)
+
+# Single writer process for multi-worker deployments (see writer.py); empty writes in-process
+# 'host:port' on a loopback interface or a Unix socket path
+METRICS_WRITER_ADDRESS = _env_str('METRICS_WRITER_ADDRESS', '')
+# Required with a writer address: whoever holds it can run code in the writer
+METRICS_WRITER_AUTHKEY = _env_str('METRICS_WRITER_AUTHKEY', '')
+# Accept writer addresses off the loopback interface (only on a trusted private network)
+METRICS_WRITER_ALLOW_REMOTE = _env_bool('METRICS_WRITER_ALLOW_REMOTE', False)
+# Group commit delay of the writer process; concurrent workers fill a group within milliseconds
+METRICS_WRITER_MAX_DELAY_MS = _env_float('METRICS_WRITER_MAX_DELAY_MS', 2.0)
+
+# SQLite database
+DATABASE_PATH = _env_str('DATABASE_PATH', 'bykerz_iot.db')
+DATABASE_POOLED = _env_bool('DATABASE_POOLED', False)
+DATABASE_MAX_CONNECTIONS = _env_int('DATABASE_MAX_CONNECTIONS', 8)
+DATABASE_STALE_TIMEOUT_SECONDS = _env_float('DATABASE_STALE_TIMEOUT_SECONDS', 300.0)
+DATABASE_JOURNAL_MODE = _env_str('DATABASE_JOURNAL_MODE', 'wal')
+DATABASE_SYNCHRONOUS = _env_str('DATABASE_SYNCHRONOUS', 'normal')
+DATABASE_CACHE_SIZE_KIB = _env_int('DATABASE_CACHE_SIZE_KIB', 16000)
+DATABASE_MMAP_SIZE_BYTES = _env_int('DATABASE_MMAP_SIZE_BYTES', 64 * 1024 * 1024)
+DATABASE_BUSY_TIMEOUT_MS = _env_int('DATABASE_BUSY_TIMEOUT_MS', 5000)
+
+# Device credential cache
+DEVICE_CACHE_MAX_SIZE = _env_int('DEVICE_CACHE_MAX_SIZE', 1024)
+DEVICE_CACHE_TTL_SECONDS = _env_float('DEVICE_CACHE_TTL_SECONDS', 300.0)
+
+# Backend validation and registration answers
+DEVICE_TOKEN_RESPONSE_TTL_SECONDS = _env_float('DEVICE_TOKEN_RESPONSE_TTL_SECONDS', 60.0)
+
+# Stateless device token verification
+DEVICE_JWT_SECRET = _env_str('DEVICE_JWT_SECRET', '')
+DEVICE_JWT_SECRET_BASE64 = _env_bool('DEVICE_JWT_SECRET_BASE64', False)
+DEVICE_JWT_LEEWAY_SECONDS = _env_float('DEVICE_JWT_LEEWAY_SECONDS', 30.0)
+DEVICE_JWT_CLAIMS_CACHE_SIZE = _env_int('DEVICE_JWT_CLAIMS_CACHE_SIZE', 4096)
+
+# Metric queries
+METRICS_QUERY_DEFAULT_LIMIT = _env_int('METRICS_QUERY_DEFAULT_LIMIT', 1000)
+METRICS_QUERY_MAX_LIMIT = _env_int('METRICS_QUERY_MAX_LIMIT', 100000)
+
+# Incremental rollups
+METRICS_ROLLUPS_ENABLED = _env_bool('METRICS_ROLLUPS_ENABLED', True)
+
+# Edge alert rules
+ALERT_ON_IMPACT = _env_bool('ALERT_ON_IMPACT', True)
+ALERT_CO2_PPM = _env_float('ALERT_CO2_PPM', 5000.0)
+ALERT_NH3_PPM = _env_float('ALERT_NH3_PPM', 35.0)
+ALERT_BENZENE_PPM = _env_float('ALERT_BENZENE_PPM', 10.0)
+
+# Priority forwarding lane for critical events
+PRIORITY_FORWARDER_POLL_INTERVAL_SECONDS = _env_float('PRIORITY_FORWARDER_POLL_INTERVAL_SECONDS', 0.5)
+PRIORITY_FORWARDER_BATCH_SIZE = _env_int('PRIORITY_FORWARDER_BATCH_SIZE', 10)
+PRIORITY_FORWARDER_TIMEOUT_SECONDS = _env_float('PRIORITY_FORWARDER_TIMEOUT_SECONDS', 5.0)
+PRIORITY_RETRY_BASE_SECONDS = _env_float('PRIORITY_RETRY_BASE_SECONDS', 0.5)
+PRIORITY_RETRY_MAX_SECONDS = _env_float('PRIORITY_RETRY_MAX_SECONDS', 30.0)
+PRIORITY_FORWARDING_SLO_SECONDS = _env_float('PRIORITY_FORWARDING_SLO_SECONDS', 2.0)
+
+# Deadband change-detection filter
+DEADBAND_ENABLED = _env_bool('DEADBAND_ENABLED', False)
+# Comma-separated field:mode:band rules, mode being 'abs' (absolute units) or 'pct' (percent of last value)
+DEADBAND_RULES = _env_str(
+    'DEADBAND_RULES',
+    'latitude:abs:0.0001,longitude:abs:0.0001,CO2Ppm:abs:10,NH3Ppm:abs:1,BenzenePpm:abs:0.5,'
+    'temperatureCelsius:abs:0.5,pressureHpa:pct:0.1'
+)
+DEADBAND_MAX_SILENCE_SECONDS = _env_float('DEADBAND_MAX_SILENCE_SECONDS', 60.0)
+
+# Plausibility validation of incoming readings
+METRICS_VALIDATION_ENABLED = _env_bool('METRICS_VALIDATION_ENABLED', True)
+METRICS_VALIDATION_MAX_SPEED_KMH = _env_float('METRICS_VALIDATION_MAX_SPEED_KMH', 300.0)
+# Comma-separated field:max_change_per_second limits
+METRICS_VALIDATION_MAX_RATES = _env_str(
+    'METRICS_VALIDATION_MAX_RATES',
+    'CO2Ppm:2000,NH3Ppm:100,BenzenePpm:50,temperatureCelsius:5,pressureHpa:10'
+)
+
+# Trip segmentation and GPS track simplification
+TRIPS_ENABLED = _env_bool('TRIPS_ENABLED', True)
+TRIPS_IDLE_GAP_SECONDS = _env_float('TRIPS_IDLE_GAP_SECONDS', 300.0)
+TRIPS_MIN_MOVE_METRES = _env_float('TRIPS_MIN_MOVE_METRES', 25.0)
+TRIPS_SIMPLIFY_TOLERANCE_METRES = _env_float('TRIPS_SIMPLIFY_TOLERANCE_METRES', 10.0)
+TRIPS_GEOHASH_PRECISION = _env_int('TRIPS_GEOHASH_PRECISION', 7)
+# Forward closed trips instead of the routine readings they cover: those readings are held in
+# the outbox while their trip is open and never sent; alerting readings are always sent raw
+TRIPS_REPLACE_RAW_FORWARDING = _env_bool('TRIPS_REPLACE_RAW_FORWARDING', False)
+# How often trips of vehicles that stopped reporting are closed
+TRIPS_CLOSE_INTERVAL_SECONDS = _env_float('TRIPS_CLOSE_INTERVAL_SECONDS', 30.0)
+# Backend endpoint closed trips are forwarded to; empty forwards them only in replace-raw
+# mode, to /trips
+FORWARDER_TRIPS_PATH = _env_str('FORWARDER_TRIPS_PATH', '')
+
+# Ingestion admission control: per-device rate limits and load shedding, off by default
+ADMISSION_ENABLED = _env_bool('ADMISSION_ENABLED', False)
+# Comma-separated class:requests_per_second:burst limits; 'default' applies to unmatched devices
+ADMISSION_DEVICE_LIMITS = _env_str('ADMISSION_DEVICE_LIMITS', 'default:10:30')
+# Comma-separated device_id_pattern:class assignments, e.g. 'bykerz-gw-*:gateway'
+ADMISSION_DEVICE_CLASSES = _env_str('ADMISSION_DEVICE_CLASSES', '')
+ADMISSION_MAX_DEVICES = _env_int('ADMISSION_MAX_DEVICES', 10000)
+ADMISSION_MAX_IN_FLIGHT = _env_int('ADMISSION_MAX_IN_FLIGHT', 64)
+# Fraction of METRICS_WRITE_BEHIND_MAX_QUEUE at which ingestion is shed
+ADMISSION_MAX_QUEUE_FRACTION = _env_float('ADMISSION_MAX_QUEUE_FRACTION', 0.8)
+ADMISSION_SHED_RETRY_AFTER_SECONDS = _env_float('ADMISSION_SHED_RETRY_AFTER_SECONDS', 1.0)
+
+# Ingestion durability modes: fire-and-forget, local-durable or upstream-confirmed
+# Mode of readings that neither request one nor match INGEST_DEVICE_DURABILITY; empty keeps
+# the full record response of local-durable ingestion
+INGEST_DEFAULT_DURABILITY = _env_str('INGEST_DEFAULT_DURABILITY', '')
+# Comma-separated device_id_pattern:mode assignments, e.g. 'bykerz-env-*:fire-and-forget'
+INGEST_DEVICE_DURABILITY = _env_str('INGEST_DEVICE_DURABILITY', '')
+INGEST_UPSTREAM_ACK_TIMEOUT_SECONDS = _env_float('INGEST_UPSTREAM_ACK_TIMEOUT_SECONDS', 5.0)
+
+# Time-partitioned metric storage
+# 'day' or 'week' stores records in one table per period; empty keeps the single table.
+# Once partitions exist, switching back to the single table is not supported
+METRICS_PARTITIONING = _env_str('METRICS_PARTITIONING', '')
+# Partitions whose period ended this many days ago are dropped; 0 keeps them
+METRICS_RETENTION_DAYS = _env_float('METRICS_RETENTION_DAYS', 0.0)
+# Space stored records (partitions and archived segments) may take before the oldest partitions
+# are dropped, forwarded ones first; 0 disables it
+METRICS_DISK_BUDGET_MB = _env_float('METRICS_DISK_BUDGET_MB', 0.0)
+METRICS_PARTITION_MAINTENANCE_INTERVAL_SECONDS = _env_float('METRICS_PARTITION_MAINTENANCE_INTERVAL_SECONDS', 300.0)
+
+# Compressed columnar archive of cold telemetry
+# Forwarded records older than this many days are moved into compressed column segments; 0 disables it
+METRICS_ARCHIVE_AFTER_DAYS = _env_float('METRICS_ARCHIVE_AFTER_DAYS', 0.0)
+METRICS_ARCHIVE_SEGMENT_ROWS = _env_int('METRICS_ARCHIVE_SEGMENT_ROWS', 1024)
+METRICS_ARCHIVE_INTERVAL_SECONDS = _env_float('METRICS_ARCHIVE_INTERVAL_SECONDS', 600.0)
+
+# In-memory latest readings per vehicle and live streams
+LIVE_HISTORY_SIZE = _env_int('LIVE_HISTORY_SIZE', 64)
+LIVE_MAX_VEHICLES = _env_int('LIVE_MAX_VEHICLES', 10000)
+LIVE_MAX_STREAMS = _env_int('LIVE_MAX_STREAMS', 32)
+LIVE_KEEPALIVE_SECONDS = _env_float('LIVE_KEEPALIVE_SECONDS', 15.0)
+
+# Ingestion pipeline: ordered stages readings go through, in micro-batches
+# (enrich, validate, filter, smooth, persist, aggregate, forward); aggregate and forward
+# run inside the transaction of persist, so they must follow it
+METRICS_PIPELINE_STAGES = _env_str('METRICS_PIPELINE_STAGES', 'enrich,validate,filter,smooth,persist,aggregate,forward')
+METRICS_PIPELINE_BATCH_SIZE = _env_int('METRICS_PIPELINE_BATCH_SIZE', 500)
+# Comma-separated field:weight rules of the smooth stage, weight in (0, 1] being the share of
+# each new reading in the stored moving average; empty disables smoothing
+METRICS_SMOOTHING_RULES = _env_str('METRICS_SMOOTHING_RULES', '')
@@ -1,19 +1,126 @@
 """
 Database initialization and connection management for the Smart Band application.
 """
+import sqlite3
+from typing import List
+
+from flask import request
 from peewee import SqliteDatabase
+from playhouse.pool import PooledSqliteDatabase
+
+from shared.infrastructure import config
+
+
+def database_pragmas() -> tuple:
+    """
+    Build the pragmas applied to every new SQLite connection.
+
+    WAL lets readers proceed while a write is in progress, synchronous=NORMAL only syncs
+    at checkpoints in WAL mode, and busy_timeout makes a writer wait for the lock instead
+    of failing immediately with "database is locked".
+    :return: A tuple of (pragma, value) pairs.
+    """
+    return (
+        ('journal_mode', config.DATABASE_JOURNAL_MODE),
+        ('synchronous', config.DATABASE_SYNCHRONOUS),
+        ('cache_size', -config.DATABASE_CACHE_SIZE_KIB),
+        ('mmap_size', config.DATABASE_MMAP_SIZE_BYTES),
+        ('busy_timeout', config.DATABASE_BUSY_TIMEOUT_MS),
+    )
+
+
+def create_database(path: str = None) -> SqliteDatabase:
+    """
+    Create the SQLite database handle described by the configuration.
+    :param path: Database file; defaults to DATABASE_PATH.
+    :return: A plain or pooled SQLite database.
+    """
+    path = path or config.DATABASE_PATH
+    timeout = config.DATABASE_BUSY_TIMEOUT_MS / 1000.0
+    if config.DATABASE_POOLED:
+        return PooledSqliteDatabase(
+            path,
+            pragmas=database_pragmas(),
+            timeout=timeout,
+            max_connections=config.DATABASE_MAX_CONNECTIONS,
+            stale_timeout=config.DATABASE_STALE_TIMEOUT_SECONDS,
+            check_same_thread=False
+        )
+    return SqliteDatabase(path, pragmas=database_pragmas(), timeout=timeout)
+
 
 # Initialize the SQLite database
-db = SqliteDatabase('bykerz_iot.db')
+db = create_database()
+
+# Maximum rows per multi-row INSERT, kept well below SQLite's bound-parameter limit
+INSERT_CHUNK_SIZE = 500
 
 def init_db()->None:
     """
-    Initialize the database and create tables if they do not exist.
+    Initialize the database, upgrade the schema of an existing database and create
+    tables if they do not exist.
 
     """
-    db.connect()
+    opened = db.connect(reuse_if_open=True)
+    from shared.infrastructure.migrations import migrate_db
+    migrate_db()
     from iam.infrastructure.models import Device
-    from wellness.infrastructure.models import VehicleMetricRecord
-    db.create_tables([Device, VehicleMetricRecord], safe=True)
-    db.close()
+    from wellness.infrastructure.models import VehicleMetricRecord, MetricOutbox, MetricRollup, Trip, TripPoint, \
+        TripCell, VehicleTrack, MetricPartition, MetricRecordSequence, MetricSegment
+    db.create_tables([Device, VehicleMetricRecord, MetricOutbox, MetricRollup, Trip, TripPoint, TripCell,
+                      VehicleTrack, MetricPartition, MetricRecordSequence, MetricSegment], safe=True)
+    if opened:
+        db.close()
+
 
+def without_database(view):
+    """
+    Mark a view that never reads the database, so no connection is opened for its requests.
+    :param view: The view function.
+    :return: The same view function.
+    """
+    view.without_database = True
+    return view
+
+
+def register_connection_hooks(app) -> None:
+    """
+    Open a database connection for each request and release it when the request ends.
+
+    With a pooled database, closing returns the connection to the pool. Views marked with
+    without_database get no connection.
+    :param app: The Flask application.
+    :return: None
+    """
+    @app.before_request
+    def _open_database_connection():
+        view = app.view_functions.get(request.endpoint)
+        if getattr(view, 'without_database', False):
+            return
+        db.connect(reuse_if_open=True)
+
+    @app.teardown_request
+    def _close_database_connection(exc):
+        if not db.is_closed():
+            db.close()
+
+
+
+def insert_many_returning_ids(model, rows: List[dict]) -> List[int]:
+    """
+    Insert rows with a single multi-row INSERT and return their primary keys in order.
+
+    Must be called inside a transaction. On SQLite builds without RETURNING support the
+    IDs are derived from the last inserted rowid, which is safe because a single INSERT
+    statement inside a write transaction assigns consecutive rowids.
+    :param model: The peewee model to insert into.
+    :param rows: The rows to insert, at most INSERT_CHUNK_SIZE of them.
+    :return: The primary keys of the inserted rows.
+    """
+    if not rows:
+        return []
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        query = model.insert_many(rows).returning(model._meta.primary_key).tuples()
+        return [row[0] for row in query.execute()]
+    last_id = model.insert_many(rows).execute()
+    return list(range(last_id - len(rows) + 1, last_id + 1))
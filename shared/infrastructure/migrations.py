@@ -0,0 +1,195 @@
+"""
+Versioned schema migrations for existing edge databases.
+
+The applied version is tracked in SQLite's user_version pragma. Every migration only
+uses operations that do not rebuild existing tables (CREATE TABLE, ADD COLUMN,
+CREATE INDEX and batched UPDATEs). Each one runs with its version bump in a single
+write transaction, so when several workers start together exactly one of them applies
+it while the others wait for the lock.
+"""
+import logging
+import time
+from datetime import datetime, timezone
+
+from peewee import DateTimeField
+from playhouse.migrate import SqliteMigrator, migrate
+
+from shared.infrastructure.database import db
+
+logger = logging.getLogger(__name__)
+
+# Rows updated per transaction when backfilling columns
+BACKFILL_BATCH_SIZE = 5000
+
+
+def _column_names(table: str) -> set:
+    """
+    List the columns of a table.
+    :param table: The table name.
+    :return: The set of column names, empty if the table does not exist.
+    """
+    return {column.name for column in db.get_columns(table)}
+
+
+def _add_metric_recorded_at() -> None:
+    """
+    Version 1: timestamp and index vehicle metric records.
+
+    Adds the nullable recorded_at column, backfills legacy rows in batches with the
+    time of the migration and creates the (vehicle_id, recorded_at) and
+    (device_id, recorded_at) indexes. Legacy vehicle_id values keep the REAL column
+    affinity they were created with; the model reads them back as integers, and SQLite
+    compares 1 and 1.0 as equal, so the column is not rebuilt.
+    :return: None
+    """
+    from wellness.infrastructure.models import VehicleMetricRecord, utc_now
+
+    table = VehicleMetricRecord._meta.table_name
+    if not db.table_exists(table):
+        return
+    if 'recorded_at' not in _column_names(table):
+        migrate(SqliteMigrator(db).add_column(table, 'recorded_at', DateTimeField(null=True)))
+
+    migrated_at = utc_now()
+    last_id = 0
+    while True:
+        with db.atomic():
+            ids = [row.id for row in (VehicleMetricRecord
+                                      .select(VehicleMetricRecord.id)
+                                      .where(VehicleMetricRecord.id > last_id)
+                                      .order_by(VehicleMetricRecord.id)
+                                      .limit(BACKFILL_BATCH_SIZE))]
+            if not ids:
+                break
+            (VehicleMetricRecord
+             .update(recorded_at=migrated_at)
+             .where(VehicleMetricRecord.id.between(ids[0], ids[-1]) &
+                    VehicleMetricRecord.recorded_at.is_null())
+             .execute())
+        last_id = ids[-1]
+
+    VehicleMetricRecord._schema.create_indexes(safe=True)
+
+
+def _add_outbox_priority() -> None:
+    """
+    Version 2: forwarding priority lanes for the metric outbox.
+
+    The column is added with a constant default, which SQLite records in the schema
+    without touching existing rows.
+    :return: None
+    """
+    from wellness.infrastructure.models import MetricOutbox
+
+    table = MetricOutbox._meta.table_name
+    if not db.table_exists(table):
+        return
+    if 'priority' not in _column_names(table):
+        db.execute_sql(f'ALTER TABLE "{table}" ADD COLUMN "priority" INTEGER NOT NULL DEFAULT 0')
+    MetricOutbox._schema.create_indexes(safe=True)
+
+
+def _add_outbox_topic() -> None:
+    """
+    Version 3: outbox topics, so completed trips are forwarded through the same outbox.
+    :return: None
+    """
+    from wellness.infrastructure.models import MetricOutbox
+
+    table = MetricOutbox._meta.table_name
+    if not db.table_exists(table):
+        return
+    if 'topic' not in _column_names(table):
+        db.execute_sql(f'ALTER TABLE "{table}" ADD COLUMN "topic" VARCHAR(255) NOT NULL DEFAULT \'metrics\'')
+
+
+def _add_vehicle_tracks() -> None:
+    """
+    Version 4: segmentation state shared between processes.
+
+    Every vehicle with an open trip gets its state from the trip, with the time of the
+    migration as the trip's last activity, so it is still closed once its vehicle stays idle.
+    :return: None
+    """
+    from wellness.infrastructure.models import Trip, VehicleTrack
+
+    if not db.table_exists(Trip._meta.table_name):
+        return
+    VehicleTrack.create_table(safe=True)
+    migrated_at = time.time()
+    with db.atomic():
+        for trip in Trip.select().where(Trip.status == 'open'):
+            (VehicleTrack
+             .insert(vehicle_id=trip.vehicle_id, device_id=trip.device_id, latitude=trip.last_latitude,
+                     longitude=trip.last_longitude, recorded_at=trip.last_at, trip_id=trip.id,
+                     observed_at=migrated_at)
+             .on_conflict_ignore()
+             .execute())
+
+
+def _add_outbox_trip() -> None:
+    """
+    Version 5: link held outbox entries to the trip that replaces them.
+    :return: None
+    """
+    from wellness.infrastructure.models import MetricOutbox
+
+    table = MetricOutbox._meta.table_name
+    if not db.table_exists(table):
+        return
+    if 'trip_id' not in _column_names(table):
+        db.execute_sql(f'ALTER TABLE "{table}" ADD COLUMN "trip_id" INTEGER')
+    MetricOutbox._schema.create_indexes(safe=True)
+
+
+def _outbox_timestamps_to_utc() -> None:
+    """
+    Version 6: store outbox timestamps in UTC, as every other table does.
+
+    Rows written before were stamped with the host's local time; they are shifted by the
+    host's current UTC offset.
+    :return: None
+    """
+    from wellness.infrastructure.models import MetricOutbox
+
+    table = MetricOutbox._meta.table_name
+    if not db.table_exists(table):
+        return
+    offset = round((datetime.now() - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds() / 60) * 60
+    if not offset:
+        return
+    for column in ('next_attempt_at', 'created_at', 'forwarded_at'):
+        db.execute_sql(f'UPDATE "{table}" SET "{column}" = '
+                       f'strftime(\'%Y-%m-%d %H:%M:%f\', "{column}", \'{-offset:+d} seconds\') '
+                       f'WHERE "{column}" IS NOT NULL')
+
+
+# Ordered migrations; the migration at position i upgrades the schema to version i + 1
+MIGRATIONS = [
+    _add_metric_recorded_at,
+    _add_outbox_priority,
+    _add_outbox_topic,
+    _add_vehicle_tracks,
+    _add_outbox_trip,
+    _outbox_timestamps_to_utc,
+]
+
+
+def migrate_db() -> None:
+    """
+    Apply every migration newer than the database's recorded schema version.
+
+    Each migration and its version bump run in one IMMEDIATE transaction, and the version
+    is read again once the write lock is held, so a migration another worker applied in
+    the meantime is skipped instead of failing on a duplicate column.
+    :return: None
+    """
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if db.pragma('user_version') >= version:
+            continue
+        with db.atomic('IMMEDIATE'):
+            if db.pragma('user_version') >= version:
+                continue
+            logger.info("Migrating database schema to version %s", version)
+            migration()
+            db.pragma('user_version', version)
@@ -0,0 +1,61 @@
+"""
+Background thread running a maintenance task at a fixed interval.
+"""
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """
+    Runs a callable in a daemon thread, once at start and then every interval seconds.
+
+    A failing run is logged and does not stop later runs.
+    """
+    def __init__(self, task: Callable[[], object], interval: float, name: str):
+        """
+        Initialize the task; the thread is started by start().
+        :param task: The callable to run.
+        :param interval: Seconds between the end of one run and the start of the next.
+        :param name: Name of the thread, used in logs.
+        """
+        self.task = task
+        self.interval = interval
+        self.name = name
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Start the background thread if it is not already running.
+        :return: None
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Signal the thread to stop and wait for its current run to finish.
+        :param timeout: Seconds to wait for the thread to exit.
+        :return: None
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        """
+        Thread loop: run the task, then sleep until the next run.
+        :return: None
+        """
+        while not self._stop_event.is_set():
+            try:
+                self.task()
+            except Exception:
+                logger.exception("Periodic task %s failed", self.name)
+            self._stop_event.wait(self.interval)
@@ -0,0 +1,141 @@
+"""
+Write-behind buffering with group commits on a single writer thread.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueueFull(RuntimeError):
+    """Raised when the write-behind buffer stays full for longer than the submit timeout."""
+
+
+class WriteBehindBuffer:
+    """
+    Buffers items in memory and hands them to a flush function in groups.
+
+    A single writer thread flushes once max_rows items are waiting or the oldest item has
+    waited max_delay seconds, whichever comes first. Each submitted item gets a Future
+    that resolves to the flush function's result for that item once the group is durable,
+    or to the exception raised while flushing it. Pending items are flushed on close and
+    at interpreter exit.
+    """
+    def __init__(self, flush_fn: Callable[[List], List], max_rows: int, max_delay: float,
+                 max_queue: int, name: str = 'write-behind'):
+        """
+        Initialize the buffer.
+        :param flush_fn: Persists a list of items and returns one result per item, in order.
+        :param max_rows: Group size that triggers an immediate flush.
+        :param max_delay: Seconds the oldest buffered item may wait before a flush.
+        :param max_queue: Maximum number of buffered items; submitters block beyond it.
+        :param name: Name of the writer thread.
+        """
+        self.flush_fn = flush_fn
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.name = name
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def depth(self) -> int:
+        """
+        Number of items waiting to be flushed.
+        :return: The current queue depth.
+        """
+        return len(self._queue)
+
+    def start(self) -> None:
+        """
+        Start the writer thread if it is not already running.
+        :return: None
+        """
+        with self._condition:
+            if self._thread and self._thread.is_alive():
+                return
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, item, timeout: float = None) -> Future:
+        """
+        Buffer an item for the next group commit.
+        :param item: The item to persist.
+        :param timeout: Seconds to wait for room in a full buffer; None waits indefinitely.
+        :return: A Future resolved with the item's flush result once it is durable.
+        """
+        if self._thread is None:
+            self.start()
+        future = Future()
+        with self._condition:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while len(self._queue) >= self.max_queue and not self._closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise WriteBehindQueueFull(f"{self.name} buffer is full")
+                self._condition.wait(remaining)
+            if self._closed:
+                raise RuntimeError(f"{self.name} buffer is closed")
+            self._queue.append((item, future, time.monotonic()))
+            self._condition.notify_all()
+        return future
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Flush every buffered item and stop the writer thread.
+        :param timeout: Seconds to wait for the final flush.
+        :return: None
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _next_group(self) -> List[tuple]:
+        """
+        Wait until a group is ready to flush and take it from the queue.
+        :return: The group of (item, future, enqueued_at) tuples, or an empty list on shutdown.
+        """
+        with self._condition:
+            while not self._queue and not self._closed:
+                self._condition.wait()
+            while self._queue and len(self._queue) < self.max_rows and not self._closed:
+                remaining = self._queue[0][2] + self.max_delay - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            group = [self._queue.popleft() for _ in range(min(self.max_rows, len(self._queue)))]
+            self._condition.notify_all()
+        return group
+
+    def _run(self) -> None:
+        """
+        Writer loop: flush groups until the buffer is closed and drained.
+        :return: None
+        """
+        while True:
+            group = self._next_group()
+            if not group:
+                if self._closed:
+                    return
+                continue
+            try:
+                results = self.flush_fn([item for item, _, _ in group])
+            except Exception as e:
+                logger.exception("%s group commit of %s items failed", self.name, len(group))
+                for _, future, _ in group:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(group, results):
+                future.set_result(result)
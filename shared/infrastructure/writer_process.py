@@ -0,0 +1,266 @@
+"""
+Hand-off of database writes from request workers to one dedicated writer process.
+
+Workers send payloads over a local socket (multiprocessing.connection, authenticated
+with a shared key). Messages are pickled, so anyone holding the key can run code in the
+writer: the key has no default, Unix sockets are created private to their owner, and TCP
+addresses must be on a loopback interface unless remote hosts are explicitly allowed. The writer buffers what every worker sends and commits it in groups
+on a single thread, so SQLite never sees more than one writer however many workers run.
+Workers can also query state only the writer holds, such as its latest readings; queries
+are answered right away on the connection's thread.
+"""
+import ipaddress
+import logging
+import os
+import threading
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Callable, List, Optional, Union
+
+from shared.infrastructure.write_behind import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class WriterUnavailable(ConnectionError):
+    """Raised when the writer process cannot be reached."""
+
+
+def _is_loopback(host: str) -> bool:
+    """
+    Check whether a host names a loopback interface.
+    :param host: Host name or IP address.
+    :return: True for 'localhost' and loopback addresses.
+    """
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host.strip('[]')).is_loopback
+    except ValueError:
+        return False
+
+
+def parse_address(address: str, allow_remote: bool = False) -> Union[tuple, str]:
+    """
+    Parse a writer address.
+    :param address: 'host:port' for TCP on a loopback interface, or a Unix socket path.
+    :param allow_remote: Accept TCP hosts other than loopback ones.
+    :return: A (host, port) tuple, or the path.
+    :raises ValueError: If the host is not a loopback one and remote hosts are not allowed.
+    """
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        if not allow_remote and not _is_loopback(host):
+            raise ValueError(f"Writer address {address} is not on a loopback interface")
+        return host.strip('[]'), int(port)
+    return address
+
+
+def _check_authkey(authkey: bytes) -> bytes:
+    """
+    Refuse an empty writer key.
+    :param authkey: Key shared by the writer and its workers.
+    :return: The key.
+    :raises ValueError: If the key is empty.
+    """
+    if not authkey:
+        raise ValueError("A writer key (METRICS_WRITER_AUTHKEY) must be set")
+    return authkey
+
+
+class WriterClient:
+    """
+    Worker-side connection to the writer process.
+
+    Each thread keeps its own connection, so concurrent requests never interleave
+    messages; a connection found broken when sending is reopened once.
+    """
+    def __init__(self, address: str, authkey: bytes, allow_remote: bool = False):
+        """
+        Initialize the client; connections are opened on first use.
+        :param address: The writer address, see parse_address.
+        :param authkey: Key shared with the writer; must not be empty.
+        :param allow_remote: Accept a writer address off the loopback interface.
+        """
+        self.address = parse_address(address, allow_remote)
+        self.authkey = _check_authkey(authkey)
+        self._local = threading.local()
+
+    def _connection(self) -> Connection:
+        """
+        Return this thread's connection, opening it if needed.
+        :return: The connection.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            try:
+                connection = self._local.connection = Client(self.address, authkey=self.authkey)
+            except OSError as e:
+                raise WriterUnavailable(f"Writer process unreachable: {e}") from e
+        return connection
+
+    def _drop(self) -> None:
+        """
+        Close and forget this thread's connection.
+        :return: None
+        """
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except OSError:
+                pass
+
+    def call(self, payload: Any, wait: bool = True) -> Any:
+        """
+        Send a payload to the writer.
+        :param payload: A picklable payload for the writer's handler.
+        :param wait: Wait for the payload to be committed and return the handler's result.
+        :return: The handler's result for the payload, or None when not waiting.
+        :raises WriterUnavailable: If the writer cannot be reached or drops the connection.
+        :raises RuntimeError: If the writer failed to commit the payload.
+        """
+        connection = self._send(('write', payload, wait))
+        if not wait:
+            return None
+        # The payload may or may not have been committed if the reply is lost; never resend it
+        return self._receive(connection)
+
+    def query(self, request: tuple) -> Any:
+        """
+        Ask the writer's query handler for state only the writer holds.
+        :param request: A picklable request for the writer's query handler.
+        :return: The handler's answer.
+        :raises WriterUnavailable: If the writer cannot be reached or drops the connection.
+        :raises RuntimeError: If the writer failed to answer the request.
+        """
+        return self._receive(self._send(('query', request)))
+
+    def _send(self, message: tuple) -> Connection:
+        """
+        Send a message on this thread's connection, reopening it once if found broken.
+        :param message: The message.
+        :return: The connection the message was sent on.
+        :raises WriterUnavailable: If the writer cannot be reached.
+        """
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.send(message)
+                return connection
+            except OSError as e:
+                self._drop()
+                if attempt:
+                    raise WriterUnavailable(f"Writer process unreachable: {e}") from e
+
+    def _receive(self, connection: Connection) -> Any:
+        """
+        Receive the writer's reply to the last message.
+        :param connection: The connection the message was sent on.
+        :return: The result in the reply.
+        :raises WriterUnavailable: If the writer drops the connection.
+        :raises RuntimeError: If the reply is an error.
+        """
+        try:
+            status, result = connection.recv()
+        except (EOFError, OSError) as e:
+            self._drop()
+            raise WriterUnavailable(f"Writer process closed the connection: {e}") from e
+        if status == 'error':
+            raise RuntimeError(result)
+        return result
+
+
+class WriterServer:
+    """
+    The writer process's listener.
+
+    Every worker connection is served by its own thread, which submits each received
+    payload to a WriteBehindBuffer and, when asked to, answers with the handler's result
+    once the group containing it is committed. Queries are passed to the query handler
+    and answered at once.
+    """
+    def __init__(self, address: str, authkey: bytes, handler: Callable[[List], List], max_rows: int,
+                 max_delay: float, max_queue: int, allow_remote: bool = False,
+                 query_handler: Optional[Callable[[tuple], Any]] = None):
+        """
+        Initialize the server.
+        :param address: Address to listen on, see parse_address.
+        :param authkey: Key workers must present; must not be empty.
+        :param handler: Commits a list of payloads and returns one result per payload, in order.
+        :param max_rows: Payloads per group commit.
+        :param max_delay: Seconds the oldest payload may wait for its group.
+        :param max_queue: Payloads buffered before connections stop being read.
+        :param allow_remote: Listen on an address off the loopback interface.
+        :param query_handler: Answers worker queries; without one, queries are refused.
+        """
+        self.address = parse_address(address, allow_remote)
+        self.authkey = _check_authkey(authkey)
+        self.query_handler = query_handler
+        self.buffer = WriteBehindBuffer(handler, max_rows, max_delay, max_queue, name='metric-writer')
+
+    def serve_forever(self) -> None:
+        """
+        Accept worker connections until the process is stopped.
+        :return: None
+        """
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        self.buffer.start()
+        # The socket file is created accessible to the writer's user only
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        with listener:
+            logger.info("Metric writer listening on %s", listener.address)
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception:
+                    logger.exception("Rejected writer connection")
+                    continue
+                threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection: Connection) -> None:
+        """
+        Serve one worker connection until it is closed.
+        :param connection: The accepted connection.
+        :return: None
+        """
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    return
+                if message[0] == 'query':
+                    reply = self._answer(message[1])
+                else:
+                    _, payload, wait = message
+                    future = self.buffer.submit(payload)
+                    if not wait:
+                        continue
+                    try:
+                        reply = ('ok', future.result())
+                    except Exception as e:
+                        reply = ('error', str(e))
+                try:
+                    connection.send(reply)
+                except OSError:
+                    return
+
+    def _answer(self, request: tuple) -> tuple:
+        """
+        Answer a worker query.
+        :param request: The request.
+        :return: An ('ok', answer) or ('error', message) reply.
+        """
+        if self.query_handler is None:
+            return 'error', "The writer answers no queries"
+        try:
+            return 'ok', self.query_handler(request)
+        except Exception as e:
+            logger.exception("Writer query %r failed", request[:1])
+            return 'error', str(e)
@@ -0,0 +1,52 @@
+"""
+Round-trip checks of the binary metrics frame encoding.
+
+Usage: python -m unittest test_binary_format
+"""
+import unittest
+
+from wellness.infrastructure.binary_format import BinaryFormatError, HEADER, RECORD_FIELDS, decode_frame, \
+    encode_frame
+
+
+def reading(index: int, **overrides) -> dict:
+    """A reading of vehicle 7 whose float32 fields are exactly representable."""
+    values = {
+        'recorded_at': 1767225600000 + index * 1000, 'vehicle_id': 7,
+        'latitude': -12.046374 + index * 1e-4, 'longitude': -77.042793,
+        'CO2Ppm': 450.5, 'NH3Ppm': 25.25, 'BenzenePpm': 5.0,
+        'temperatureCelsius': 24.0 + index, 'pressureHpa': 1015.0, 'impactDetected': index % 2 == 1
+    }
+    values.update(overrides)
+    return values
+
+
+class BinaryFrameTest(unittest.TestCase):
+    def test_readings_round_trip(self):
+        readings = [reading(index) for index in range(3)]
+        device_id, count, records = decode_frame(encode_frame('bykerz-test-001', readings))
+        self.assertEqual((device_id, count), ('bykerz-test-001', 3))
+        for expected, record in zip(readings, records):
+            decoded = dict(zip(RECORD_FIELDS, record))
+            self.assertEqual(decoded.pop('flags') & 1, int(expected['impactDetected']))
+            for field, value in decoded.items():
+                self.assertEqual(value, expected[field], field)
+
+    def test_missing_time_is_encoded_as_zero(self):
+        _, _, records = decode_frame(encode_frame('dev', [reading(0, recorded_at=None)]))
+        self.assertEqual(next(records)[0], 0)
+
+    def test_empty_frame_and_unicode_device(self):
+        device_id, count, records = decode_frame(encode_frame('bykerz-ñandú', []))
+        self.assertEqual((device_id, count, list(records)), ('bykerz-ñandú', 0, []))
+
+    def test_malformed_frames_are_rejected(self):
+        frame = encode_frame('dev', [reading(0)])
+        for body in (frame[:HEADER.size], b'XXXX' + frame[4:], frame[:4] + bytes([99]) + frame[5:],
+                     frame[:-1], frame + b'\0'):
+            with self.assertRaises(BinaryFormatError):
+                decode_frame(body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+State-transition checks of the backend circuit breaker.
+
+Usage: python -m unittest test_circuit_breaker
+"""
+import unittest
+from unittest import mock
+
+import requests
+
+from shared.infrastructure.backend_client import AdaptiveTimeouts, BackendClient, BackendUnavailable, \
+    CircuitBreaker
+
+
+class Clock:
+    """Stand-in for time.monotonic that only moves when told to."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('shared.infrastructure.backend_client.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, open_seconds=10.0, max_open_seconds=60.0)
+
+    def fail(self, times: int = 1) -> None:
+        for _ in range(times):
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+    def open_period_elapses(self) -> None:
+        self.clock.now += self.breaker.max_open_seconds
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(BackendUnavailable) as raised:
+            self.breaker.before_call()
+        self.assertGreater(raised.exception.retry_after, 0)
+        self.assertEqual((self.breaker.opened, self.breaker.rejected), (1, 1))
+
+    def test_success_resets_the_failure_count(self):
+        self.fail(2)
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_probe_closes_on_success(self):
+        self.fail(3)
+        self.open_period_elapses()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.before_call()
+        # The only probe is taken
+        with self.assertRaises(BackendUnavailable):
+            self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.before_call()
+
+    def test_half_open_probe_reopens_on_failure(self):
+        self.fail(3)
+        self.open_period_elapses()
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.stats()["trips"], 2)
+
+    def test_released_probe_can_be_taken_again(self):
+        self.fail(3)
+        self.open_period_elapses()
+        self.breaker.before_call()
+        self.breaker.release()
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+    def test_client_releases_the_probe_on_errors_outside_the_backend(self):
+        session = mock.Mock()
+        client = BackendClient(session, self.breaker, AdaptiveTimeouts(0.1, 1.0))
+        self.fail(3)
+        self.open_period_elapses()
+        session.post.side_effect = TypeError("Body cannot be encoded")
+        with self.assertRaises(TypeError):
+            client.post('metrics', 'http://backend/metrics')
+        session.post.side_effect = requests.ConnectionError()
+        with self.assertRaises(requests.ConnectionError):
+            client.post('metrics', 'http://backend/metrics')
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+
+if __name__ == '__main__':
+    unittest.main()
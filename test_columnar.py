@@ -0,0 +1,60 @@
+"""
+Round-trip checks of the column encoding of archived segments.
+
+Usage: python -m unittest test_columnar
+"""
+import math
+import unittest
+from datetime import datetime, timedelta
+
+from wellness.infrastructure.columnar import BOOL, DELTA, DICT, XOR, decode_column, decode_segment, \
+    encode_column, encode_segment, encoding_for, from_micros, to_micros
+
+
+class ColumnTest(unittest.TestCase):
+    def assertRoundTrip(self, values, encoding):
+        self.assertEqual(decode_column(encode_column(values, encoding), encoding), values)
+
+    def test_integers(self):
+        self.assertRoundTrip([], DELTA)
+        self.assertRoundTrip([5], DELTA)
+        self.assertRoundTrip([1767225600000000 + index * 1000000 for index in range(500)], DELTA)
+        self.assertRoundTrip([3, -2, 2 ** 62, -2 ** 62, 0], DELTA)
+
+    def test_floats(self):
+        self.assertRoundTrip([24.0 + math.sin(index / 10.0) for index in range(500)], XOR)
+        self.assertRoundTrip([0.0, -0.0, 1e-300, -1e300, math.inf, -math.inf], XOR)
+        decoded = decode_column(encode_column([1.0, math.nan, 2.0], XOR), XOR)
+        self.assertTrue(math.isnan(decoded[1]))
+
+    def test_booleans_and_strings(self):
+        self.assertRoundTrip([True, False, False, True], BOOL)
+        self.assertRoundTrip(['bykerz-001', 'bykerz-002', 'bykerz-001', 'ñandú'], DICT)
+        self.assertRoundTrip([], DICT)
+
+    def test_timestamps(self):
+        timestamp = datetime(2026, 1, 1, 12, 30, 15, 123456)
+        self.assertEqual(from_micros(to_micros(timestamp)), timestamp)
+        self.assertEqual(from_micros(to_micros(datetime(1969, 12, 31, 23, 59, 59))), datetime(1969, 12, 31, 23, 59, 59))
+
+
+class SegmentTest(unittest.TestCase):
+    def test_selected_columns_round_trip(self):
+        start = datetime(2026, 1, 1)
+        columns = {
+            'id': [100 + index for index in range(50)],
+            'recorded_at': [to_micros(start + timedelta(seconds=index * 5)) for index in range(50)],
+            'temperatureCelsius': [24.0 + index / 4.0 for index in range(50)],
+            'impactDetected': [index == 10 for index in range(50)],
+            'device_id': ['bykerz-test-001'] * 50,
+        }
+        layout, ranges, data = encode_segment(
+            {name: (encoding_for(type(values[0])), values) for name, values in columns.items()})
+        self.assertEqual(ranges['id'], [100, 149])
+        self.assertNotIn('device_id', ranges)
+        names = ['device_id', 'temperatureCelsius', 'id']
+        self.assertEqual(decode_segment(layout, data, names), [columns[name] for name in names])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,15 @@
+import json
 import requests
 import time
 import random
 from iam.application.services import AuthApplicationService
+from wellness.infrastructure import binary_format
 
 # Configuración
 DEVICE_ID = "bykerz-iot-001"
 EDGE_API_URL = "http://localhost:5000/api/v1/metrics"
+# Enviar tramas binarias compactas en lugar de JSON
+BINARY_FORMAT = False
 
 
 def get_jwt_token():
@@ -43,11 +47,15 @@ def send_metric(jwt_token):
     data = generate_mock_data()
     headers = {
         "Authorization": f"Bearer {jwt_token}",
-        "Content-Type": "application/json"
+        "Content-Type": binary_format.CONTENT_TYPE if BINARY_FORMAT else "application/json"
     }
+    if BINARY_FORMAT:
+        body = binary_format.encode_frame(DEVICE_ID, [data])
+    else:
+        body = json.dumps(data)
 
     try:
-        response = requests.post(EDGE_API_URL, json=data, headers=headers, timeout=5)
+        response = requests.post(EDGE_API_URL, data=body, headers=headers, timeout=5)
         print(f"✓ Enviado - Status: {response.status_code}")
         print(f"  Datos: CO2={data['CO2Ppm']:.1f}ppm, Temp={data['temperatureCelsius']:.1f}°C, "
               f"Impact={data['impactDetected']}")
@@ -0,0 +1,71 @@
+"""
+Upgrade check of a database created by the first release of the edge service.
+
+Usage: python -m unittest test_migrations
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from shared.infrastructure.database import db, init_db
+from shared.infrastructure.migrations import MIGRATIONS
+
+# Schema of the first release, before any migration
+BASELINE_SCHEMA = (
+    'CREATE TABLE "devices" ("device_id" VARCHAR(255) NOT NULL PRIMARY KEY, "api_key" VARCHAR(255) NOT NULL, '
+    '"created_at" DATETIME NOT NULL)',
+    'CREATE TABLE "vehicle_metric_records" ("id" INTEGER NOT NULL PRIMARY KEY, "device_id" VARCHAR(255) NOT NULL, '
+    '"vehicle_id" REAL NOT NULL, "latitude" REAL NOT NULL, "longitude" REAL NOT NULL, "CO2Ppm" REAL NOT NULL, '
+    '"NH3Ppm" REAL NOT NULL, "BenzenePpm" REAL NOT NULL, "temperatureCelsius" REAL NOT NULL, '
+    '"pressureHpa" REAL NOT NULL, "impactDetected" INTEGER NOT NULL)',
+)
+
+
+class BaselineMigrationTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'baseline.db')
+        with sqlite3.connect(self.path) as connection:
+            for statement in BASELINE_SCHEMA:
+                connection.execute(statement)
+            connection.executemany(
+                'INSERT INTO vehicle_metric_records VALUES (NULL, ?, ?, -12.04, -77.04, 450, 25, 5, 24, 1015, 0)',
+                [('bykerz-test-001', 1.0)] * 3
+            )
+        original = db.database
+        db.init(self.path)
+        self.addCleanup(db.init, original)
+
+    def query(self, sql: str) -> list:
+        with sqlite3.connect(self.path) as connection:
+            return connection.execute(sql).fetchall()
+
+    def test_upgrades_to_the_latest_version(self):
+        init_db()
+        self.assertEqual(self.query('PRAGMA user_version'), [(len(MIGRATIONS),)])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM vehicle_metric_records WHERE recorded_at IS NULL'), [(0,)])
+        tables = {name for (name,) in self.query("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertTrue({'metric_outbox', 'metric_rollups', 'trips', 'vehicle_tracks'} <= tables, tables)
+        outbox_columns = {row[1] for row in self.query('PRAGMA table_info(metric_outbox)')}
+        self.assertTrue({'priority', 'topic', 'trip_id'} <= outbox_columns, outbox_columns)
+
+    def test_legacy_records_are_readable(self):
+        init_db()
+        from wellness.infrastructure.models import VehicleMetricRecord
+        with db.connection_context():
+            records = list(VehicleMetricRecord.select().order_by(VehicleMetricRecord.id))
+        self.assertEqual([record.vehicle_id for record in records], [1, 1, 1])
+        self.assertTrue(all(record.recorded_at is not None for record in records))
+
+    def test_running_again_changes_nothing(self):
+        init_db()
+        schema = self.query('SELECT sql FROM sqlite_master ORDER BY name')
+        init_db()
+        self.assertEqual(self.query('SELECT sql FROM sqlite_master ORDER BY name'), schema)
+        self.assertEqual(self.query('PRAGMA user_version'), [(len(MIGRATIONS),)])
+
+
+if __name__ == '__main__':
+    unittest.main()
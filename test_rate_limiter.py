@@ -0,0 +1,56 @@
+"""
+Token-bucket checks of the per-device rate limiter.
+
+Usage: python -m unittest test_rate_limiter
+"""
+import unittest
+from unittest import mock
+
+from shared.infrastructure.admission import DeviceRateLimiter
+
+
+class DeviceRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('shared.infrastructure.admission.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = DeviceRateLimiter(
+            DeviceRateLimiter.parse_limits('default:2:3,gateway:10:20'),
+            DeviceRateLimiter.parse_patterns('bykerz-gw-*:gateway'),
+            max_devices=2
+        )
+
+    def test_burst_then_reject_until_refilled(self):
+        self.assertEqual([self.limiter.acquire('dev-1') for _ in range(3)], [0.0] * 3)
+        self.assertAlmostEqual(self.limiter.acquire('dev-1'), 0.5)
+        self.now += 0.5
+        self.assertEqual(self.limiter.acquire('dev-1'), 0.0)
+        self.assertGreater(self.limiter.acquire('dev-1'), 0.0)
+        self.assertEqual((self.limiter.admitted, self.limiter.rejected), (4, 2))
+
+    def test_refill_is_capped_at_the_burst(self):
+        self.limiter.acquire('dev-1')
+        self.now += 3600
+        self.assertEqual([self.limiter.acquire('dev-1') for _ in range(3)], [0.0] * 3)
+        self.assertGreater(self.limiter.acquire('dev-1'), 0.0)
+
+    def test_devices_have_their_own_buckets_and_classes(self):
+        for _ in range(3):
+            self.limiter.acquire('dev-1')
+        self.assertEqual(self.limiter.acquire('dev-2'), 0.0)
+        self.assertEqual(self.limiter.device_class('bykerz-gw-01'), 'gateway')
+        self.assertEqual([self.limiter.acquire('bykerz-gw-01') for _ in range(20)], [0.0] * 20)
+
+    def test_least_recently_seen_device_is_forgotten(self):
+        for _ in range(3):
+            self.limiter.acquire('dev-1')
+        self.limiter.acquire('dev-2')
+        self.limiter.acquire('dev-3')
+        self.assertEqual(self.limiter.stats()["tracked_devices"], 2)
+        # dev-1 was evicted, so it starts again with a full bucket
+        self.assertEqual(self.limiter.acquire('dev-1'), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+Regression checks of the plausibility validation of readings without a device timestamp.
+
+Usage: python -m unittest test_validation
+"""
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from wellness.application.pipeline import EnrichStage, MetricBatch, ValidateStage
+from wellness.domain.entities import VehicleMetricRecord
+from wellness.domain.services import MetricRuleEvaluator
+from wellness.domain.validation import MetricPlausibilityValidator
+
+# About 11 m of latitude
+STEP_DEGREES = 1e-4
+
+
+def reading(index: int, recorded_at=None, latitude_offset: float = 0.0) -> VehicleMetricRecord:
+    """Build a reading of vehicle 1, index steps north of the start."""
+    return VehicleMetricRecord('bykerz-test-001', 1, -12.046374 + index * STEP_DEGREES + latitude_offset,
+                               -77.042793, 450.0, 25.0, 5.0, 24.0, 1015.0, False, recorded_at=recorded_at)
+
+
+class UntimedReadingsTest(unittest.TestCase):
+    def validators(self):
+        """A validator of each implementation, sequential and vectorized."""
+        for use_numpy in (False, True):
+            validator = MetricPlausibilityValidator(300.0, {'temperatureCelsius': 5.0}, use_numpy=use_numpy)
+            if use_numpy:
+                # Take the vectorized path even with single readings
+                validator.VECTORIZE_MIN_ROWS = 1
+            yield validator
+
+    def test_untimed_readings_skip_the_jump_check(self):
+        for validator in self.validators():
+            for index in range(3):
+                _, reasons = validator.validate([reading(index)])
+                self.assertEqual(reasons, [None])
+            _, reasons = validator.validate([reading(index) for index in range(3, 6)])
+            self.assertEqual(reasons, [None, None, None])
+
+    def test_untimed_readings_never_become_the_reference(self):
+        start = datetime(2026, 1, 1)
+        for validator in self.validators():
+            self.assertEqual(validator.validate([reading(0, start)])[1], [None])
+            # Far away but untimed: accepted, and later readings still compare with the first one
+            self.assertEqual(validator.validate([reading(0, latitude_offset=0.5)])[1], [None])
+            self.assertEqual(validator.validate([reading(1, start + timedelta(seconds=5))])[1], [None])
+            _, reasons = validator.validate([reading(0, start + timedelta(seconds=10), latitude_offset=0.5)])
+            self.assertIsNotNone(reasons[0])
+
+    def test_pipeline_leaves_untimed_readings_untimed_before_validation(self):
+        service = SimpleNamespace(rule_evaluator=MetricRuleEvaluator(),
+                                  validator=MetricPlausibilityValidator(300.0, {}))
+        stages = [EnrichStage(service), ValidateStage(service)]
+        for index in range(3):
+            batch = MetricBatch([reading(index)])
+            for stage in stages:
+                stage.run(batch)
+            self.assertEqual(batch.rejections, [])
+            self.assertIsNone(batch.records[0].recorded_at)
+
+
+if __name__ == '__main__':
+    unittest.main()
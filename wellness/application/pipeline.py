@@ -0,0 +1,438 @@
+"""
+Ingestion pipeline between the endpoints and the vehicle metric application service.
+
+Readings go through an ordered list of stages, a micro-batch at a time:
+
+    enrich      classify the readings' alert priority
+    validate    reject implausible readings (METRICS_VALIDATION_ENABLED)
+    filter      drop readings inside the deadband of the device's last stored one (DEADBAND_ENABLED)
+    smooth      replace noisy fields by their moving average (METRICS_SMOOTHING_RULES)
+    persist     store the readings as durably as requested
+    aggregate   fold stored readings into rollups and trips
+    forward     queue stored readings for the Bykerz backend, or hold the routine ones a
+                trip will replace (TRIPS_REPLACE_RAW_FORWARDING)
+
+Every stage runs on one micro-batch at a time, persist included, so a request's memory is
+bounded by the micro-batch size however many readings it carries. Stages before persist
+run on the request thread. Stages after it run inside the transaction that stores the
+readings, on whichever thread or process commits it, so a record, its aggregates and its
+outbox entry are committed together. Stages whose feature is disabled are left out.
+
+validate, filter and smooth compare readings with the last stored ones. What they learn
+from a request stays pending on its batches, where its later micro-batches see it, and the
+process that commits the readings applies it once they are committed.
+"""
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from shared.infrastructure import config
+from wellness.domain.entities import VehicleMetricRecord, Trip
+from wellness.domain.services import MetricRuleEvaluator
+
+
+class MetricBatch:
+    """
+    Micro-batch of readings moving through the pipeline.
+
+    Attributes:
+        records (List[VehicleMetricRecord]): The readings still in the batch.
+        positions (List[int]): Position of each reading in the request, for error reporting.
+        critical (Optional[List[bool]]): Whether each reading triggers an alert rule, once classified.
+        durability (Optional[str]): Durability mode the readings are stored with; None stores
+            them all in one transaction.
+        rejections (List[Tuple[int, str]]): (position, reason) of every implausible reading.
+        suppressed (int): Number of readings dropped by the deadband filter.
+        trips (Optional[List[Optional[Trip]]]): The trip each stored reading was folded into,
+            once tracked.
+        ids (List[int]): IDs of the stored readings, collected on the pipeline's result.
+        state (Dict[str, dict]): Pending state of the stages before persist, by stage name,
+            shared by the micro-batches of a request.
+    """
+    __slots__ = ('records', 'positions', 'critical', 'durability', 'rejections', 'suppressed', 'trips', 'ids',
+                 'state')
+
+    def __init__(self, records: List[VehicleMetricRecord], positions: Optional[List[int]] = None,
+                 critical: Optional[List[bool]] = None, durability: Optional[str] = None,
+                 state: Optional[Dict[str, dict]] = None):
+        """
+        Initialize the batch.
+
+        Args:
+            records (List[VehicleMetricRecord]): The readings.
+            positions (List[int], optional): Their positions in the request. Defaults to 0, 1, 2...
+            critical (List[bool], optional): Their alert classification, if already known.
+            durability (str, optional): One of IngestDurabilityPolicy.MODES, or None.
+            state (Dict[str, dict], optional): Pending state of the request's earlier micro-batches.
+        """
+        self.records = records
+        self.positions = positions if positions is not None else list(range(len(records)))
+        self.critical = critical
+        self.durability = durability
+        self.rejections: List[Tuple[int, str]] = []
+        self.suppressed = 0
+        self.trips: Optional[List[Optional[Trip]]] = None
+        self.ids: List[int] = []
+        self.state = state if state is not None else {}
+
+    def pending(self, stage: str) -> dict:
+        """
+        Pending state of a stage, created empty on first use.
+
+        Args:
+            stage (str): Name of the stage.
+
+        Returns:
+            dict: The state, updated in place by the stage.
+        """
+        return self.state.setdefault(stage, {})
+
+    def classify(self, evaluator: MetricRuleEvaluator) -> List[bool]:
+        """
+        Classify the readings against the alert rules, unless the enrich stage already did.
+
+        Args:
+            evaluator (MetricRuleEvaluator): The alert rules.
+
+        Returns:
+            List[bool]: Whether each reading triggers an alert rule.
+        """
+        if self.critical is None:
+            self.critical = [evaluator.priority(record) == MetricRuleEvaluator.PRIORITY_CRITICAL
+                             for record in self.records]
+        return self.critical
+
+    def keep(self, mask: Sequence[bool]) -> None:
+        """
+        Drop the readings whose mask entry is False.
+
+        Args:
+            mask (Sequence[bool]): One entry per reading.
+        """
+        self.records = [record for record, kept in zip(self.records, mask) if kept]
+        self.positions = [position for position, kept in zip(self.positions, mask) if kept]
+        if self.critical is not None:
+            self.critical = [critical for critical, kept in zip(self.critical, mask) if kept]
+
+
+class PipelineStage:
+    """
+    One step of the ingestion pipeline, timed on every micro-batch it processes.
+
+    Subclasses implement process(); run() wraps it with the timing counters.
+    """
+    # Name of the stage in METRICS_PIPELINE_STAGES
+    name = ''
+    # Whether the stage runs inside the transaction that stores the readings
+    in_transaction = False
+
+    def __init__(self, service):
+        """
+        Initialize the stage.
+
+        Args:
+            service (VehicleMetricRecordApplicationService): The service whose components the stage uses.
+        """
+        self.service = service
+        self.batches = 0
+        self.records = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def enabled(service) -> bool:
+        """
+        Check whether the stage has anything to do under the service's configuration.
+
+        Args:
+            service (VehicleMetricRecordApplicationService): The service.
+
+        Returns:
+            bool: False to leave the stage out of the pipeline.
+        """
+        return True
+
+    def run(self, batch: MetricBatch) -> None:
+        """
+        Process a micro-batch and record how long it took.
+
+        Args:
+            batch (MetricBatch): The micro-batch, updated in place.
+        """
+        count = len(batch.records)
+        started = time.perf_counter()
+        self.process(batch)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.batches += 1
+            self.records += count
+            self.seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    def process(self, batch: MetricBatch) -> None:
+        """
+        Apply the stage to a micro-batch.
+
+        Args:
+            batch (MetricBatch): The micro-batch, updated in place.
+        """
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """
+        Report the stage's timing counters.
+
+        Returns:
+            dict: name, batches, records, total_ms, us_per_record and max_batch_ms.
+        """
+        with self._lock:
+            return {
+                "name": self.name,
+                "batches": self.batches,
+                "records": self.records,
+                "total_ms": self.seconds * 1000.0,
+                "us_per_record": self.seconds * 1e6 / self.records if self.records else 0.0,
+                "max_batch_ms": self.max_seconds * 1000.0
+            }
+
+
+class EnrichStage(PipelineStage):
+    """
+    Classifies the readings against the alert rules.
+
+    Readings without a device timestamp are left without one until they are stored, so the
+    validator and the deadband treat them as untimed rather than as taken on arrival.
+    """
+    name = 'enrich'
+
+    def process(self, batch: MetricBatch) -> None:
+        batch.classify(self.service.rule_evaluator)
+
+
+class ValidateStage(PipelineStage):
+    """Rejects readings failing the plausibility checks."""
+    name = 'validate'
+
+    @staticmethod
+    def enabled(service) -> bool:
+        return service.validator is not None
+
+    def process(self, batch: MetricBatch) -> None:
+        _, reasons = self.service.validator.validate(batch.records, batch.pending(self.name))
+        if any(reason is not None for reason in reasons):
+            batch.rejections.extend((position, reason) for position, reason in zip(batch.positions, reasons)
+                                    if reason is not None)
+            batch.keep([reason is None for reason in reasons])
+
+
+class FilterStage(PipelineStage):
+    """Drops readings that did not change meaningfully since the device's last stored one."""
+    name = 'filter'
+
+    @staticmethod
+    def enabled(service) -> bool:
+        return service.deadband is not None
+
+    def process(self, batch: MetricBatch) -> None:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        critical = batch.classify(self.service.rule_evaluator)
+        mask = self.service.deadband.admit_many(batch.records, now, critical, batch.pending(self.name))
+        batch.suppressed += mask.count(False)
+        batch.keep(mask)
+
+
+class SmoothStage(PipelineStage):
+    """Replaces noisy fields by their moving average; alerting readings are stored raw."""
+    name = 'smooth'
+
+    @staticmethod
+    def enabled(service) -> bool:
+        return service.smoother is not None
+
+    def process(self, batch: MetricBatch) -> None:
+        critical = batch.classify(self.service.rule_evaluator)
+        self.service.smoother.smooth_many(batch.records, critical, batch.pending(self.name))
+
+
+class PersistStage(PipelineStage):
+    """Stores the readings as durably as requested, running the in-transaction stages."""
+    name = 'persist'
+
+    def process(self, batch: MetricBatch) -> None:
+        batch.records = self.service.store_records(batch.records, batch.durability, batch.state)
+
+    def stats(self) -> dict:
+        """
+        Report the stage's timing counters, which include the in-transaction stages of
+        direct commits, and the background write buffer that bounds queued readings.
+
+        Returns:
+            dict: The PipelineStage counters plus queued and queue_capacity.
+        """
+        stats = super().stats()
+        stats["queued"] = self.service.background_writes.depth
+        stats["queue_capacity"] = self.service.background_writes.max_queue
+        return stats
+
+
+class AggregateStage(PipelineStage):
+    """Folds stored readings into the per-vehicle rollups and trips."""
+    name = 'aggregate'
+    in_transaction = True
+
+    @staticmethod
+    def enabled(service) -> bool:
+        return config.METRICS_ROLLUPS_ENABLED or service.trip_segmenter is not None
+
+    def process(self, batch: MetricBatch) -> None:
+        self.service.update_rollups(batch.records)
+        batch.trips = self.service.track_trips(batch.records)
+
+
+class ForwardStage(PipelineStage):
+    """
+    Queues stored readings for the Bykerz backend, alerting ones in the critical lane.
+
+    With TRIPS_REPLACE_RAW_FORWARDING, routine readings folded into a trip are held instead
+    and never sent: the trip's simplified track is forwarded for them once it closes.
+    """
+    name = 'forward'
+    in_transaction = True
+
+    def process(self, batch: MetricBatch) -> None:
+        critical = batch.classify(self.service.rule_evaluator)
+        priorities = [MetricRuleEvaluator.PRIORITY_CRITICAL if alert else MetricRuleEvaluator.PRIORITY_ROUTINE
+                      for alert in critical]
+        trips = None
+        if config.TRIPS_REPLACE_RAW_FORWARDING and batch.trips is not None:
+            trips = [None if alert else trip for trip, alert in zip(batch.trips, critical)]
+        payload = self.service.vehicle_metric_service.to_upstream_payload
+        self.service.outbox_repository.enqueue_many(batch.records, [payload(record) for record in batch.records],
+                                                    priorities, trips)
+
+
+class MetricPipeline:
+    """
+    Ordered stages readings go through from the ingestion endpoints to storage.
+
+    Readings are cut into micro-batches of batch_size that go through every stage one after
+    the other. Without a durability mode the micro-batches are stored in one request
+    transaction, so a request is still committed, or rolled back, as a whole; with a writer
+    process each micro-batch is one writer call, committed on its own. Backpressure comes
+    from the persist stage: fire-and-forget and write-behind readings wait in a bounded
+    buffer, whose depth the load shedder watches.
+    """
+    STAGES: Dict[str, type] = {stage.name: stage for stage in (
+        EnrichStage, ValidateStage, FilterStage, SmoothStage, PersistStage, AggregateStage, ForwardStage
+    )}
+
+    def __init__(self, service, names: Sequence[str], batch_size: int):
+        """
+        Build the pipeline.
+
+        Args:
+            service (VehicleMetricRecordApplicationService): The service the stages work with.
+            names (Sequence[str]): Stage names, in order.
+            batch_size (int): Readings per micro-batch.
+
+        Raises:
+            ValueError: If a stage is unknown or repeated, persist is missing, or a stage
+                is on the wrong side of persist.
+        """
+        if 'persist' not in names:
+            raise ValueError("The pipeline needs a persist stage")
+        if len(set(names)) != len(names):
+            raise ValueError("Pipeline stages must not repeat")
+        boundary = list(names).index('persist')
+        self.service = service
+        self.batch_size = batch_size
+        self.stages: List[PipelineStage] = []
+        self.transaction_stages: List[PipelineStage] = []
+        for position, name in enumerate(names):
+            stage_type = self.STAGES.get(name)
+            if stage_type is None:
+                raise ValueError(f"Unknown pipeline stage: {name}")
+            if position != boundary and stage_type.in_transaction != (position > boundary):
+                side = 'after' if stage_type.in_transaction else 'before'
+                raise ValueError(f"Pipeline stage {name} must come {side} persist")
+            if not stage_type.enabled(service):
+                continue
+            stage = stage_type(service)
+            if stage.in_transaction:
+                self.transaction_stages.append(stage)
+            elif name == 'persist':
+                self.persist = stage
+            else:
+                self.stages.append(stage)
+
+    @staticmethod
+    def parse_stages(stages: str) -> List[str]:
+        """
+        Parse a comma-separated list of stage names.
+
+        Args:
+            stages (str): The list, e.g. 'enrich,validate,persist,forward'.
+
+        Returns:
+            List[str]: The stage names, in order.
+        """
+        return [name.strip() for name in stages.split(',') if name.strip()]
+
+    def process(self, records: Iterable[Tuple[int, VehicleMetricRecord]],
+                durability: Optional[str] = None, keep_records: bool = True) -> MetricBatch:
+        """
+        Run readings through the stages.
+
+        Args:
+            records (Iterable[Tuple[int, VehicleMetricRecord]]): (position, reading) tuples,
+                position being the reading's index in the request; consumed lazily.
+            durability (str, optional): One of IngestDurabilityPolicy.MODES, or None to store
+                every reading in one transaction. Defaults to None.
+            keep_records (bool, optional): Return the stored readings; otherwise only their
+                IDs are collected, and memory stays bounded by the micro-batch size. Defaults to True.
+
+        Returns:
+            MetricBatch: The stored readings, if kept, and their IDs, with the rejections and
+                the suppressed count of all of them.
+
+        Raises:
+            WriteBehindQueueFull: If a fire-and-forget reading finds the background buffer full.
+            WriterUnavailable: If the writer process cannot be reached.
+        """
+        result = MetricBatch([], [], durability=durability)
+        one_transaction = durability is None and self.service.remote_writer is None
+        with self.service.request_transaction() if one_transaction else nullcontext():
+            iterator = iter(records)
+            while True:
+                chunk = list(islice(iterator, self.batch_size))
+                if not chunk:
+                    break
+                batch = MetricBatch([record for _, record in chunk], [position for position, _ in chunk],
+                                    durability=durability, state=result.state)
+                for stage in self.stages + [self.persist]:
+                    if not batch.records:
+                        break
+                    stage.run(batch)
+                result.ids.extend(record.id for record in batch.records)
+                if keep_records:
+                    result.records.extend(batch.records)
+                    result.positions.extend(batch.positions)
+                result.rejections.extend(batch.rejections)
+                result.suppressed += batch.suppressed
+        return result
+
+    def stats(self) -> dict:
+        """
+        Report the stages and their timing counters.
+
+        Returns:
+            dict: batch_size and, per stage in order, its counters.
+        """
+        return {
+            "batch_size": self.batch_size,
+            "stages": [stage.stats() for stage in self.stages + [self.persist] + self.transaction_stages]
+        }
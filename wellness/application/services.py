@@ -1,13 +1,152 @@
+import base64
+import logging
+import math
+import random
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import chain, islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
 from iam.application.services import AuthApplicationService
-from wellness.domain.services import VehicleMetricRecordService
-from wellness.infrastructure.repositories import VehicleMetricRepository
-from wellness.domain.entities import VehicleMetricRecord
+from shared.infrastructure import config
+from shared.infrastructure.database import db, INSERT_CHUNK_SIZE
+from shared.infrastructure.write_behind import WriteBehindBuffer
+from shared.infrastructure.writer_process import WriterClient
+from wellness.application.pipeline import MetricBatch, MetricPipeline
+from wellness.domain import geo
+from wellness.domain.services import VehicleMetricRecordService, MetricRollupService, MetricRuleEvaluator, \
+    DeadbandFilter, TripSegmenter, IngestDurabilityPolicy, MetricPartitionPolicy, ReadingSmoother
+from wellness.domain.validation import MetricPlausibilityValidator
+from wellness.infrastructure.live import LatestReadingsCache, PendingReadings, WriterReadingsCache
+from wellness.infrastructure.reading_state import WriterPlausibilityValidator, WriterDeadbandFilter, \
+    WriterReadingSmoother, to_writer_rows, from_writer_rows
+from wellness.infrastructure.repositories import VehicleMetricRepository, MetricOutboxRepository, \
+    MetricRollupRepository, TripRepository, MetricPartitionRepository, MetricSegmentRepository
+from wellness.domain.entities import VehicleMetricRecord, MetricForwardingState, MetricAggregate, Trip
+
+logger = logging.getLogger(__name__)
+
 
 class VehicleMetricRecordApplicationService:
-    def __init__(self):
-        self.vehicle_metric_repository = VehicleMetricRepository()
+    # Interval at which upstream acknowledgements are polled while waiting for one
+    ACK_POLL_SECONDS = 0.1
+    # Archived segments deleted at a time while the database exceeds the disk budget
+    SEGMENT_EVICTION_BATCH = 16
+
+    def __init__(self, use_remote_writer: bool = True):
+        """
+        Build the service and its collaborators from the configuration.
+
+        Args:
+            use_remote_writer (bool, optional): Hand records to the writer process when
+                METRICS_WRITER_ADDRESS is set. The writer process itself passes False. Defaults to True.
+        """
+        self.partition_policy: Optional[MetricPartitionPolicy] = None
+        if config.METRICS_PARTITIONING:
+            self.partition_policy = MetricPartitionPolicy(
+                config.METRICS_PARTITIONING,
+                retention_days=config.METRICS_RETENTION_DAYS,
+                disk_budget_bytes=int(config.METRICS_DISK_BUDGET_MB * 1024 * 1024)
+            )
+        self.partition_repository = MetricPartitionRepository(self.partition_policy)
+        self.partitions_dropped = {'retention': 0, 'disk_budget': 0}
+        self.segment_repository = MetricSegmentRepository()
+        self.records_archived = 0
+        self.vehicle_metric_repository = VehicleMetricRepository(self.partition_repository, self.segment_repository)
+        self.outbox_repository = MetricOutboxRepository()
+        self.rollup_repository = MetricRollupRepository()
+        self.trip_repository = TripRepository()
         self.vehicle_metric_service = VehicleMetricRecordService()
+        self.rollup_service = MetricRollupService()
+        self.rule_evaluator = MetricRuleEvaluator(
+            alert_on_impact=config.ALERT_ON_IMPACT,
+            co2_ppm=config.ALERT_CO2_PPM,
+            nh3_ppm=config.ALERT_NH3_PPM,
+            benzene_ppm=config.ALERT_BENZENE_PPM
+        )
+        self.validator: Optional[MetricPlausibilityValidator] = None
+        if config.METRICS_VALIDATION_ENABLED:
+            self.validator = MetricPlausibilityValidator(
+                config.METRICS_VALIDATION_MAX_SPEED_KMH,
+                MetricPlausibilityValidator.parse_rates(config.METRICS_VALIDATION_MAX_RATES)
+            )
+        self.deadband: Optional[DeadbandFilter] = None
+        if config.DEADBAND_ENABLED:
+            self.deadband = DeadbandFilter(
+                DeadbandFilter.parse_rules(config.DEADBAND_RULES),
+                config.DEADBAND_MAX_SILENCE_SECONDS
+            )
+        self.smoother: Optional[ReadingSmoother] = None
+        if config.METRICS_SMOOTHING_RULES:
+            self.smoother = ReadingSmoother(ReadingSmoother.parse_rules(config.METRICS_SMOOTHING_RULES))
+        self.trip_segmenter: Optional[TripSegmenter] = None
+        if config.TRIPS_ENABLED:
+            self.trip_segmenter = TripSegmenter(
+                idle_gap_seconds=config.TRIPS_IDLE_GAP_SECONDS,
+                min_move_m=config.TRIPS_MIN_MOVE_METRES,
+                tolerance_m=config.TRIPS_SIMPLIFY_TOLERANCE_METRES,
+                geohash_precision=config.TRIPS_GEOHASH_PRECISION
+            )
+        # Closed trips go upstream when they replace raw readings or have an endpoint configured
+        self.forward_trips = config.TRIPS_REPLACE_RAW_FORWARDING or bool(config.FORWARDER_TRIPS_PATH)
+        self._trip_lock = threading.Lock()
+        # Stored version of each vehicle's segmentation state this process's segmenter holds
+        self._trip_versions: Dict[int, int] = {}
+        self.critical_listeners: List[Callable[[], None]] = []
         self.iam_service = AuthApplicationService()
+        self.write_behind: Optional[WriteBehindBuffer] = None
+        if config.METRICS_WRITE_BEHIND_ENABLED:
+            self.write_behind = WriteBehindBuffer(
+                self._flush_write_behind,
+                max_rows=config.METRICS_WRITE_BEHIND_MAX_ROWS,
+                max_delay=config.METRICS_WRITE_BEHIND_MAX_DELAY_MS / 1000.0,
+                max_queue=config.METRICS_WRITE_BEHIND_MAX_QUEUE,
+                name='metric-write-behind'
+            )
+        # Fire-and-forget readings are acknowledged once queued here; without write-behind
+        # mode a buffer is kept for them alone, its writer thread started on first use
+        self.background_writes: WriteBehindBuffer = self.write_behind or WriteBehindBuffer(
+            self._flush_write_behind,
+            max_rows=config.METRICS_WRITE_BEHIND_MAX_ROWS,
+            max_delay=config.METRICS_WRITE_BEHIND_MAX_DELAY_MS / 1000.0,
+            max_queue=config.METRICS_WRITE_BEHIND_MAX_QUEUE,
+            name='metric-fire-and-forget'
+        )
+        self.durability_policy = IngestDurabilityPolicy(
+            IngestDurabilityPolicy.parse_device_modes(config.INGEST_DEVICE_DURABILITY),
+            config.INGEST_DEFAULT_DURABILITY or None
+        )
+        # In single-writer deployments, records are committed by the writer process instead
+        self.remote_writer: Optional[WriterClient] = None
+        if use_remote_writer and config.METRICS_WRITER_ADDRESS:
+            self.remote_writer = WriterClient(config.METRICS_WRITER_ADDRESS, config.METRICS_WRITER_AUTHKEY.encode(),
+                                              config.METRICS_WRITER_ALLOW_REMOTE)
+        self._delivery_waiters: Dict[int, threading.Event] = {}
+        # Current state of each vehicle, updated after every commit and read without the database;
+        # the process that commits readings holds it
+        self.live_readings = LatestReadingsCache(config.LIVE_HISTORY_SIZE, config.LIVE_MAX_VEHICLES)
+        if self.remote_writer is not None:
+            self.live_readings = WriterReadingsCache(self.remote_writer)
+        # Like the live readings, the state the validator, deadband filter and smoother compare
+        # readings with is updated after each commit by the process that commits them
+        if self.remote_writer is not None:
+            if self.validator is not None:
+                self.validator = WriterPlausibilityValidator(self.remote_writer)
+            if self.deadband is not None:
+                self.deadband = WriterDeadbandFilter(self.remote_writer)
+            if self.smoother is not None:
+                self.smoother = WriterReadingSmoother(self.remote_writer)
+        # Records stored by the request transaction open on each thread, published once it
+        # commits, and the validator, deadband and smoother state pending with them
+        self._request_local = threading.local()
+        self._waiters_lock = threading.Lock()
+        # Stages readings go through from the endpoints to storage, built last as they use the above
+        self.pipeline = MetricPipeline(
+            self, MetricPipeline.parse_stages(config.METRICS_PIPELINE_STAGES), config.METRICS_PIPELINE_BATCH_SIZE
+        )
 
     # def create_vehicle_metric_record(self, device_id: str, vehicle_id: int, latitude: float, longitude: float,
     #                                  CO2Ppm: float, NH3Ppm: float, BenzenePpm: float, temperatureCelsius: float,
@@ -15,10 +154,17 @@ class VehicleMetricRecordApplicationService:
     #                                  api_key: str) -> VehicleMetricRecord:
     def create_vehicle_metric_record(self, device_id: str, vehicle_id: int, latitude: float, longitude: float,
                                      CO2Ppm: float, NH3Ppm: float, BenzenePpm: float, temperatureCelsius: float,
-                                     pressureHpa: float, impactDetected: bool) -> VehicleMetricRecord:
+                                     pressureHpa: float, impactDetected: bool,
+                                     recorded_at=None) -> Optional[VehicleMetricRecord]:
         """
         Create a vehicle metric record submitted by a device.
 
+        The record and its upstream delivery are committed together; forwarding to the
+        Bykerz backend happens afterwards in the background. With write-behind enabled the
+        record joins the next group commit and this call returns once that commit is durable.
+        With the deadband filter enabled, readings that did not change meaningfully since the
+        device's last stored one are dropped before any write.
+
         Args:
             device_id (str): Unique identifier of the device sending the metric.
             vehicle_id (int): Identifier of the vehicle associated with the device.
@@ -30,13 +176,16 @@ class VehicleMetricRecordApplicationService:
             temperatureCelsius (float): Temperature in degrees Celsius.
             pressureHpa (float): Atmospheric pressure in hectopascals (hPa).
             impactDetected (bool): Whether an impact was detected (True/False).
+            recorded_at (optional): Device-supplied reading time; the server time is used when omitted.
             api_key (str): API key used to authenticate the device.
 
         Returns:
-            VehicleMetricRecord: The created record instance persisted in the repository.
+            Optional[VehicleMetricRecord]: The created record instance persisted in the repository,
+                or None if the deadband filter suppressed it.
 
         Raises:
-            ValueError: If the device does not exist or the api_key is invalid.
+            ValueError: If the device does not exist or the api_key is invalid, or the
+                reading fails the plausibility checks.
         """
 
         # if not self.iam_service.get_device_by_id_and_api_key(device_id, api_key):
@@ -44,6 +193,900 @@ class VehicleMetricRecordApplicationService:
         record = self.vehicle_metric_service.create_record(
             device_id, vehicle_id, latitude, longitude,
             CO2Ppm, NH3Ppm, BenzenePpm, temperatureCelsius,
-            pressureHpa, impactDetected
+            pressureHpa, impactDetected, recorded_at
         )
-        return self.vehicle_metric_repository.save(record)
\ No newline at end of file
+        return self.ingest_vehicle_metric_record(record)
+
+    def resolve_durability(self, record: VehicleMetricRecord, requested: Optional[str] = None) -> Optional[str]:
+        """
+        Choose how durably a reading is stored before it is acknowledged.
+
+        Args:
+            record (VehicleMetricRecord): The reading, built by build_vehicle_metric_record.
+            requested (str, optional): Mode asked for by the request, overriding the device's configured one.
+
+        Returns:
+            Optional[str]: One of IngestDurabilityPolicy.MODES, or None if none is requested or configured.
+
+        Raises:
+            ValueError: If the requested mode is unknown.
+        """
+        critical = self.rule_evaluator.priority(record) == MetricRuleEvaluator.PRIORITY_CRITICAL
+        return self.durability_policy.resolve(record.device_id, requested, critical)
+
+    def ingest_vehicle_metric_record(self, record: VehicleMetricRecord,
+                                     durability: str = IngestDurabilityPolicy.LOCAL_DURABLE
+                                     ) -> Optional[VehicleMetricRecord]:
+        """
+        Run a single reading through the ingestion pipeline and store it as durably as its
+        mode requires.
+
+        fire-and-forget queues the record for the next background group commit and returns
+        at once, without an ID. local-durable returns once the record and its outbox entry
+        are committed, through the write-behind buffer when that mode is enabled.
+        upstream-confirmed commits the record directly and queues it in the critical
+        forwarding lane, so wait_for_upstream_ack is answered as fast as possible.
+
+        Args:
+            record (VehicleMetricRecord): The reading, built by build_vehicle_metric_record.
+            durability (str, optional): One of IngestDurabilityPolicy.MODES. Defaults to local-durable.
+
+        Returns:
+            Optional[VehicleMetricRecord]: The record, or None if the deadband filter suppressed it.
+
+        With a writer process configured, the record is handed to it instead, waiting for
+        its commit unless the mode is fire-and-forget.
+
+        Raises:
+            ValueError: If the reading fails the plausibility checks.
+            WriteBehindQueueFull: If a fire-and-forget reading finds the background buffer full.
+            WriterUnavailable: If the writer process cannot be reached.
+        """
+        result = self.pipeline.process([(0, record)], durability)
+        if result.rejections:
+            raise ValueError(result.rejections[0][1])
+        return result.records[0] if result.records else None
+
+    def store_records(self, records: List[VehicleMetricRecord], durability: Optional[str] = None,
+                      state: Optional[Dict[str, dict]] = None) -> List[VehicleMetricRecord]:
+        """
+        Store readings that went through the pipeline stages before persist.
+
+        Without a durability mode, the readings are committed together in one transaction, the
+        request transaction if one is open. Otherwise each is stored as
+        ingest_vehicle_metric_record describes. The state the stages left pending is committed
+        once the readings are, by the process that commits them.
+
+        Args:
+            records (List[VehicleMetricRecord]): The readings.
+            durability (str, optional): One of IngestDurabilityPolicy.MODES, or None. Defaults to None.
+            state (Dict[str, dict], optional): Pending state of the stages before persist, see
+                commit_reading_state. Defaults to None.
+
+        Returns:
+            List[VehicleMetricRecord]: The records, with their IDs unless stored fire-and-forget.
+
+        Raises:
+            WriteBehindQueueFull: If a fire-and-forget reading finds the background buffer full.
+            WriterUnavailable: If the writer process cannot be reached.
+        """
+        if self.remote_writer is not None:
+            wait = durability != IngestDurabilityPolicy.FIRE_AND_FORGET
+            return self._write_remote(records, critical=durability == IngestDurabilityPolicy.UPSTREAM_CONFIRMED,
+                                      wait=wait, state=state)
+        if durability == IngestDurabilityPolicy.FIRE_AND_FORGET:
+            futures = [self.background_writes.submit(record, timeout=0) for record in records]
+            if state:
+                # Later micro-batches of the request keep updating state: commit it as it is now
+                self._commit_when_stored(futures[-1], {name: dict(pending) for name, pending in state.items()})
+            return records
+        if durability == IngestDurabilityPolicy.LOCAL_DURABLE and self.write_behind is not None:
+            stored = [future.result() for future in [self.write_behind.submit(record) for record in records]]
+            self.commit_reading_state(state)
+            return stored
+        return self._persist_records(records, critical=durability == IngestDurabilityPolicy.UPSTREAM_CONFIRMED,
+                                     state=state)
+
+    def _commit_when_stored(self, future: Future, state: Dict[str, dict]) -> None:
+        """Commit pending state once the background write of a request's last reading succeeds."""
+        def committed(done: Future) -> None:
+            if done.exception() is None:
+                self.commit_reading_state(state)
+        future.add_done_callback(committed)
+
+    def commit_reading_state(self, state: Optional[Dict[str, dict]]) -> None:
+        """
+        Apply the state the validate, filter and smooth stages left pending, once the
+        readings it comes from are committed.
+
+        Args:
+            state (Dict[str, dict], optional): Pending state keyed by stage name, as kept on
+                MetricBatch.state.
+        """
+        if not state:
+            return
+        for name, component in (('validate', self.validator), ('filter', self.deadband),
+                                ('smooth', self.smoother)):
+            pending = state.get(name)
+            if pending and component is not None:
+                component.commit(pending)
+
+    def submit_vehicle_metric_record(self, record: VehicleMetricRecord) -> Future:
+        """
+        Queue a validated vehicle metric record for the next group commit.
+
+        Args:
+            record (VehicleMetricRecord): A record built by build_vehicle_metric_record.
+
+        Returns:
+            Future: Resolves to the persisted record, with its ID, once the group commit is durable.
+
+        Raises:
+            RuntimeError: If write-behind mode is not enabled.
+        """
+        if self.write_behind is None:
+            raise RuntimeError("Write-behind mode is not enabled")
+        return self.write_behind.submit(record)
+
+    def _flush_write_behind(self, records: List[VehicleMetricRecord]) -> List[VehicleMetricRecord]:
+        """
+        Group-commit callback run on the write-behind writer thread.
+
+        Args:
+            records (List[VehicleMetricRecord]): The buffered records.
+
+        Returns:
+            List[VehicleMetricRecord]: The persisted records, in the same order.
+        """
+        with db.connection_context():
+            return self._persist_records(records)
+
+    def build_vehicle_metric_record(self, device_id: str, vehicle_id: int, latitude: float, longitude: float,
+                                    CO2Ppm: float, NH3Ppm: float, BenzenePpm: float, temperatureCelsius: float,
+                                    pressureHpa: float, impactDetected: bool, recorded_at=None) -> VehicleMetricRecord:
+        """
+        Validate device-submitted values and build an unsaved vehicle metric record.
+
+        Args:
+            device_id (str): Unique identifier of the device sending the metric.
+            vehicle_id (int): Identifier of the vehicle associated with the device.
+            latitude (float): GPS latitude in decimal degrees.
+            longitude (float): GPS longitude in decimal degrees.
+            CO2Ppm (float): CO2 concentration in parts per million (ppm).
+            NH3Ppm (float): Ammonia (NH3) concentration in ppm.
+            BenzenePpm (float): Benzene concentration in ppm.
+            temperatureCelsius (float): Temperature in degrees Celsius.
+            pressureHpa (float): Atmospheric pressure in hectopascals (hPa).
+            impactDetected (bool): Whether an impact was detected (True/False).
+            recorded_at (optional): Device-supplied reading time; the server time is used when omitted.
+
+        Returns:
+            VehicleMetricRecord: The validated record, without an ID.
+
+        Raises:
+            ValueError: If any of the values cannot be coerced.
+        """
+        return self.vehicle_metric_service.create_record(
+            device_id, vehicle_id, latitude, longitude,
+            CO2Ppm, NH3Ppm, BenzenePpm, temperatureCelsius,
+            pressureHpa, impactDetected, recorded_at
+        )
+
+    def get_deadband_stats(self) -> Optional[dict]:
+        """
+        Report the deadband filter's pass and suppression counters.
+
+        Returns:
+            Optional[dict]: The counters, or None if the filter is disabled.
+        """
+        return self.deadband.stats() if self.deadband is not None else None
+
+    def create_vehicle_metric_records(self, records: Iterable[VehicleMetricRecord],
+                                      rejections: Optional[list] = None) -> List[VehicleMetricRecord]:
+        """
+        Persist a batch of validated vehicle metric records in a single transaction.
+
+        Records go through the ingestion pipeline in micro-batches and the ones left are
+        inserted in multi-row chunks together with their outbox entries, so large replays
+        cost one commit instead of one per record. Implausible readings are rejected and
+        readings suppressed by the deadband filter are skipped.
+
+        Args:
+            records (Iterable[VehicleMetricRecord]): Validated records, e.g. from build_vehicle_metric_record.
+            rejections (list, optional): Receives a (position, reason) tuple for every record
+                that failed the plausibility checks, position being its index in records.
+
+        Returns:
+            List[VehicleMetricRecord]: The persisted records with their IDs.
+        """
+        result = self.pipeline.process(enumerate(records))
+        if rejections is not None:
+            rejections.extend(result.rejections)
+        return result.records
+
+    def _write_remote(self, records: List[VehicleMetricRecord], critical: bool = False,
+                      wait: bool = True, state: Optional[Dict[str, dict]] = None) -> List[VehicleMetricRecord]:
+        """
+        Hand records to the writer process, which commits them in one transaction.
+
+        Args:
+            records (List[VehicleMetricRecord]): Records that already passed filtering.
+            critical (bool, optional): Queue them in the critical forwarding lane. Defaults to False.
+            wait (bool, optional): Wait for the commit and fill in IDs and server times. Defaults to True.
+            state (Dict[str, dict], optional): Pending state for the writer to commit with them.
+
+        Returns:
+            List[VehicleMetricRecord]: The records.
+        """
+        if not records:
+            return records
+        stored = self.remote_writer.call((to_writer_rows(records), critical, state), wait=wait)
+        for record, (record_id, recorded_at) in zip(records, stored or ()):
+            record.id, record.recorded_at = record_id, recorded_at
+        return records
+
+    def persist_writer_batches(self, batches: List[Tuple[list, bool, Optional[dict]]]) -> List[List[tuple]]:
+        """
+        Group-commit callback of the writer process: store the records sent by workers.
+
+        Routine and critical batches are each inserted in one transaction, after which the
+        pending state sent with each batch is committed.
+
+        Args:
+            batches (List[Tuple[list, bool, Optional[dict]]]): (rows, critical, state) payloads
+                from WriterClient calls, each row encoded by to_writer_rows.
+
+        Returns:
+            List[List[tuple]]: Per batch, the (id, recorded_at) of each stored record.
+        """
+        records = [from_writer_rows(rows) for rows, _, _ in batches]
+        with db.connection_context():
+            for critical in (False, True):
+                self._persist_records(chain.from_iterable(
+                    batch for batch, (_, is_critical, _) in zip(records, batches) if is_critical == critical
+                ), critical)
+        for _, _, state in batches:
+            self.commit_reading_state(state)
+        return [[(record.id, record.recorded_at) for record in batch] for batch in records]
+
+    def answer_query(self, request: tuple) -> Any:
+        """
+        Answer a request worker's query, in the writer process: a check of the validate,
+        filter or smooth stage against the state this process holds, the deadband counters,
+        or a live readings query.
+
+        Args:
+            request (tuple): 'validate', 'filter', 'smooth' or 'deadband_stats' followed by
+                the arguments the Writer* views of wellness.infrastructure.reading_state send,
+                or a LatestReadingsCache query.
+
+        Returns:
+            Any: The check's result and the updated pending state, the counters, or the
+                live readings answer.
+        """
+        name, arguments = request[0], request[1:]
+        if name == 'validate':
+            rows, pending = arguments
+            _, reasons = self.validator.validate(from_writer_rows(rows), pending)
+            return reasons, pending
+        if name == 'filter':
+            rows, now, forced, pending = arguments
+            return self.deadband.admit_many(from_writer_rows(rows), now, forced, pending), pending
+        if name == 'smooth':
+            rows, keep_raw, pending = arguments
+            records = from_writer_rows(rows)
+            self.smoother.smooth_many(records, keep_raw, pending)
+            return [{field: getattr(record, field) for field in self.smoother.weights} for record in records], pending
+        if name == 'deadband_stats':
+            return self.get_deadband_stats()
+        return self.live_readings.answer(request)
+
+    def _persist_records(self, records: Iterable[VehicleMetricRecord], critical: bool = False,
+                         state: Optional[Dict[str, dict]] = None) -> List[VehicleMetricRecord]:
+        """
+        Insert records in chunks within one transaction, running the pipeline's in-transaction
+        stages (outbox entries, rollups and trips) on each chunk.
+
+        Args:
+            records (Iterable[VehicleMetricRecord]): Records that already passed filtering.
+            critical (bool, optional): Queue every record in the critical forwarding lane,
+                whatever the alert rules say. Defaults to False.
+            state (Dict[str, dict], optional): Pending state to commit with the records, see
+                commit_reading_state. Defaults to None.
+
+        Returns:
+            List[VehicleMetricRecord]: The persisted records with their IDs.
+        """
+        saved: List[VehicleMetricRecord] = []
+        iterator = iter(records)
+        alerting = False
+        # Inside a request transaction this is a savepoint; the commit is the request's
+        with db.atomic():
+            while True:
+                chunk = list(islice(iterator, INSERT_CHUNK_SIZE))
+                if not chunk:
+                    break
+                batch = MetricBatch(self.vehicle_metric_repository.save_many(chunk),
+                                    critical=[True] * len(chunk) if critical else None)
+                for stage in self.pipeline.transaction_stages:
+                    stage.run(batch)
+                alerting = alerting or any(batch.classify(self.rule_evaluator))
+                saved.extend(batch.records)
+        pending = getattr(self._request_local, 'pending', None)
+        if pending is not None:
+            pending.add(saved)
+            self._request_local.alerting = self._request_local.alerting or alerting
+            self._request_local.state = state or self._request_local.state
+            return saved
+        self.live_readings.publish(saved)
+        self.commit_reading_state(state)
+        if alerting:
+            self._notify_critical()
+        return saved
+
+    @contextmanager
+    def request_transaction(self) -> Iterator[None]:
+        """
+        Commit every record stored in the block on this thread in one transaction.
+
+        Records are published to the live readings, the pending state of the stages before
+        persist is committed and the critical lane is woken only once the transaction commits;
+        until then only what the live readings keep is retained.
+        """
+        pending = self._request_local.pending = PendingReadings(config.LIVE_HISTORY_SIZE)
+        self._request_local.alerting = False
+        self._request_local.state = None
+        try:
+            with db.atomic():
+                yield
+        finally:
+            self._request_local.pending = None
+        self.live_readings.publish(pending.records(), pending.count)
+        self.commit_reading_state(self._request_local.state)
+        if self._request_local.alerting:
+            self._notify_critical()
+
+    def add_critical_listener(self, listener: Callable[[], None]) -> None:
+        """
+        Register a callback run after records that trigger an alert rule are committed,
+        e.g. to wake the critical-lane forwarder.
+
+        Args:
+            listener (Callable[[], None]): The callback.
+        """
+        self.critical_listeners.append(listener)
+
+    def _notify_critical(self) -> None:
+        """
+        Run the critical listeners after a commit containing alerting records.
+        """
+        for listener in self.critical_listeners:
+            listener()
+
+    def notify_delivered(self, record_ids: List[int]) -> None:
+        """
+        Wake requests waiting for the upstream acknowledgement of delivered records.
+
+        Registered as a delivery listener of the outbox forwarders.
+
+        Args:
+            record_ids (List[int]): IDs of the records the backend accepted.
+        """
+        with self._waiters_lock:
+            for record_id in record_ids:
+                waiter = self._delivery_waiters.get(record_id)
+                if waiter is not None:
+                    waiter.set()
+
+    def wait_for_upstream_ack(self, record_id: int, timeout: float) -> bool:
+        """
+        Wait until the backend accepted a stored record.
+
+        Args:
+            record_id (int): ID of the record.
+            timeout (float): Seconds to wait.
+
+        Returns:
+            bool: True if the record was delivered within the timeout.
+        """
+        waiter = threading.Event()
+        with self._waiters_lock:
+            self._delivery_waiters[record_id] = waiter
+        try:
+            # The delivery may have finished before the waiter was registered, and
+            # deliveries made by another process are only seen by polling
+            deadline = time.monotonic() + timeout
+            while True:
+                state = self.outbox_repository.find_by_record_id(record_id)
+                if state is not None and state.status == 'sent':
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                if waiter.wait(min(remaining, self.ACK_POLL_SECONDS)):
+                    return True
+        finally:
+            with self._waiters_lock:
+                self._delivery_waiters.pop(record_id, None)
+
+    def evaluate_alerts(self, record: VehicleMetricRecord) -> List[str]:
+        """
+        List the edge alert rules a record triggers.
+
+        Args:
+            record (VehicleMetricRecord): The record to evaluate.
+
+        Returns:
+            List[str]: Names of the triggered rules; empty for routine telemetry.
+        """
+        return self.rule_evaluator.evaluate(record)
+
+    def update_rollups(self, records: List[VehicleMetricRecord]) -> None:
+        """
+        Fold newly saved records into the stored per-vehicle aggregates.
+
+        Args:
+            records (List[VehicleMetricRecord]): Records saved in the current transaction.
+        """
+        if config.METRICS_ROLLUPS_ENABLED:
+            self.rollup_repository.merge(self.rollup_service.aggregate(records))
+
+    def track_trips(self, records: List[VehicleMetricRecord]) -> Optional[List[Optional[Trip]]]:
+        """
+        Fold newly saved records into the vehicles' trips and persist the trips' progress.
+        Must run inside the transaction that saved the records, which holds the database's
+        write lock, so several processes committing readings of a vehicle extend one trip.
+
+        Args:
+            records (List[VehicleMetricRecord]): Records saved in the current transaction.
+
+        Returns:
+            Optional[List[Optional[Trip]]]: The saved trip each record was folded into, if
+                any, or None when trip tracking is disabled.
+        """
+        if self.trip_segmenter is None:
+            return None
+        vehicle_ids = {record.vehicle_id for record in records}
+        with self._trip_lock:
+            self._sync_trips(vehicle_ids)
+            trips = [self.trip_segmenter.observe(record) for record in records]
+            self._save_trip_progress(vehicle_ids)
+        return trips
+
+    def _sync_trips(self, vehicle_ids: Iterable[int]) -> None:
+        """
+        Reload the stored state of the vehicles whose state another process (or an earlier
+        run) changed since this segmenter last saved it. The caller holds the trip lock inside
+        a write transaction.
+        """
+        tracks = self.trip_repository.find_tracks(vehicle_ids)
+        for vehicle_id in vehicle_ids:
+            version, device_id, last_point, open_trip = tracks.get(vehicle_id, (0, None, None, None))
+            if self._trip_versions.get(vehicle_id) != version:
+                self.trip_segmenter.restore(vehicle_id, device_id, last_point, open_trip)
+                self._trip_versions[vehicle_id] = version
+
+    def _save_trip_progress(self, vehicle_ids: Iterable[int]) -> None:
+        """
+        Persist trip changes and the vehicles' segmentation state, and queue each closed trip's
+        compact track for upstream delivery when trips are forwarded. The caller holds the trip lock.
+        """
+        for trip, new_vertices, new_cells, last_point, last_moved in self.trip_segmenter.drain():
+            self.trip_repository.save_progress(trip, new_vertices, new_cells, last_point, last_moved)
+            if trip.status == 'closed' and self.forward_trips:
+                self.outbox_repository.supersede_held(trip.id)
+                trip.vertices = self.trip_repository.find_vertices([trip.id])[trip.id]
+                self.outbox_repository.enqueue_trip(
+                    trip, self.trip_segmenter.to_upstream_payload(trip, self.trip_segmenter.tolerance_m)
+                )
+        # A fresh version per save: after a rollback the stored version no longer matches ours
+        version = random.getrandbits(62)
+        tracks = []
+        for vehicle_id in vehicle_ids:
+            track = self.trip_segmenter.track_of(vehicle_id)
+            if track is not None:
+                tracks.append((vehicle_id,) + track)
+                self._trip_versions[vehicle_id] = version
+        self.trip_repository.save_tracks(tracks, version)
+
+    def close_idle_trips(self) -> None:
+        """
+        Close the trips of vehicles that stopped moving or reporting for the idle gap.
+
+        Run periodically by the process that commits metric records (the writer process, when
+        there is one). Candidates are read from the stored segmentation state, then confirmed
+        under the write lock, so a trip another process just extended or closed is left alone.
+        """
+        if self.trip_segmenter is None:
+            return
+        if not self.trip_repository.find_idle_tracks(time.time() - self.trip_segmenter.idle_gap_seconds):
+            return
+        with self._trip_lock, db.atomic('IMMEDIATE'):
+            vehicle_ids = self.trip_repository.find_idle_tracks(time.time() - self.trip_segmenter.idle_gap_seconds)
+            self._sync_trips(vehicle_ids)
+            self.trip_segmenter.close_idle(vehicle_ids)
+            self._save_trip_progress(vehicle_ids)
+
+    def get_vehicle_trips(self, vehicle_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                          limit: int = 100) -> List[Trip]:
+        """
+        Retrieve a vehicle's trips that overlap a time window.
+
+        Args:
+            vehicle_id (int): Identifier of the vehicle.
+            start (datetime, optional): Only trips still going at or after this time (UTC).
+            end (datetime, optional): Only trips started before this time (UTC).
+            limit (int, optional): Maximum number of trips, most recent first. Defaults to 100.
+
+        Returns:
+            List[Trip]: The trips with their simplified tracks; a trip stays open until the
+                periodic closer notices its vehicle went idle.
+        """
+        return self.trip_repository.find_by_vehicle(vehicle_id, start, end, limit)
+
+    def find_trips_in_area(self, min_latitude: float, min_longitude: float, max_latitude: float,
+                           max_longitude: float, start: Optional[datetime] = None,
+                           end: Optional[datetime] = None) -> List[Trip]:
+        """
+        Find the trips that passed through a bounding box.
+
+        Candidate trips come from the geohash cell index; each is then confirmed against its
+        simplified track, with the box widened by the simplification tolerance.
+
+        Args:
+            min_latitude (float): Southern edge.
+            min_longitude (float): Western edge.
+            max_latitude (float): Northern edge.
+            max_longitude (float): Eastern edge.
+            start (datetime, optional): Only trips still going at or after this time (UTC).
+            end (datetime, optional): Only trips started before this time (UTC).
+
+        Returns:
+            List[Trip]: The matching trips, ordered by vehicle and start time.
+
+        Raises:
+            ValueError: If the box is empty or trip tracking is disabled.
+        """
+        if self.trip_segmenter is None:
+            raise ValueError("Trip tracking is disabled")
+        if not (-90 <= min_latitude <= max_latitude <= 90 and -180 <= min_longitude <= max_longitude <= 180):
+            raise ValueError("Invalid bounding box")
+        prefixes = geo.geohash_cover(min_latitude, min_longitude, max_latitude, max_longitude,
+                                     self.trip_segmenter.geohash_precision)
+        margin = self.trip_segmenter.tolerance_m / geo.EARTH_RADIUS_M
+        latitude_margin = math.degrees(margin)
+        longitude_margin = math.degrees(margin / max(math.cos(math.radians(max(abs(min_latitude),
+                                                                                abs(max_latitude)))), 1e-6))
+        box = (min_latitude - latitude_margin, min_longitude - longitude_margin,
+               max_latitude + latitude_margin, max_longitude + longitude_margin)
+        matches = []
+        for trip in self.trip_repository.find_in_cells(prefixes, start, end):
+            vertices = trip.vertices or []
+            segments = zip(vertices, vertices[1:]) if len(vertices) > 1 else ((vertex, vertex) for vertex in vertices)
+            if any(geo.segment_intersects_box(a, b, *box) for a, b in segments):
+                matches.append(trip)
+        return matches
+
+    def get_vehicle_rollups(self, vehicle_id: int, resolution: str, start: Optional[datetime] = None,
+                            end: Optional[datetime] = None,
+                            fields: Optional[Sequence[str]] = None) -> List[MetricAggregate]:
+        """
+        Retrieve a vehicle's aggregated sensor statistics for a time window.
+
+        Args:
+            vehicle_id (int): Identifier of the vehicle.
+            resolution (str): Bucket width: '1m', '1h' or '1d'.
+            start (datetime, optional): Inclusive lower bound on the bucket start (UTC).
+            end (datetime, optional): Exclusive upper bound on the bucket start (UTC).
+            fields (Sequence[str], optional): Aggregated fields to return. Defaults to all of them.
+
+        Returns:
+            List[MetricAggregate]: The aggregates ordered by bucket start.
+
+        Raises:
+            ValueError: If the resolution or a field is not supported.
+        """
+        if resolution not in self.rollup_service.RESOLUTIONS:
+            raise ValueError(f"Unsupported resolution: {resolution}")
+        fields = list(fields) if fields else list(self.rollup_service.ROLLUP_FIELDS)
+        unknown = [name for name in fields if name not in self.rollup_service.ROLLUP_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        return self.rollup_repository.find(vehicle_id, resolution, fields, start, end)
+
+    @staticmethod
+    def encode_cursor(recorded_at: datetime, record_id: int) -> str:
+        """
+        Encode a keyset pagination position as an opaque cursor.
+
+        Args:
+            recorded_at (datetime): Timestamp of the last returned record.
+            record_id (int): ID of the last returned record.
+
+        Returns:
+            str: The cursor.
+        """
+        return base64.urlsafe_b64encode(f"{recorded_at.isoformat()}|{record_id}".encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+        """
+        Decode a cursor produced by encode_cursor.
+
+        Args:
+            cursor (str): The cursor.
+
+        Returns:
+            Tuple[datetime, int]: The (recorded_at, id) position.
+
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        try:
+            recorded_at, record_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+            return datetime.fromisoformat(recorded_at), int(record_id)
+        except (ValueError, UnicodeError):
+            raise ValueError("Invalid cursor")
+
+    def query_vehicle_metric_records(self, vehicle_id: int, start: Optional[datetime] = None,
+                                     end: Optional[datetime] = None, fields: Optional[Sequence[str]] = None,
+                                     cursor: Optional[str] = None, limit: Optional[int] = None) -> Iterator[dict]:
+        """
+        Stream a vehicle's metric records in time order, one page at a time.
+
+        Args:
+            vehicle_id (int): Identifier of the vehicle.
+            start (datetime, optional): Inclusive lower bound on recorded_at (UTC).
+            end (datetime, optional): Exclusive upper bound on recorded_at (UTC).
+            fields (Sequence[str], optional): Attributes to include besides id and recorded_at.
+                Defaults to every queryable field.
+            cursor (str, optional): Cursor of the previous page, from encode_cursor.
+            limit (int, optional): Maximum number of records.
+
+        Returns:
+            Iterator[dict]: One dictionary per record, holding id, recorded_at and the requested fields.
+
+        Raises:
+            ValueError: If a field is unknown or the cursor is malformed.
+        """
+        fields = list(fields) if fields else list(self.vehicle_metric_service.QUERYABLE_FIELDS)
+        unknown = [name for name in fields if name not in self.vehicle_metric_service.QUERYABLE_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        after = self.decode_cursor(cursor) if cursor else None
+        keys = ['id', 'recorded_at'] + fields
+        rows = self.vehicle_metric_repository.iter_by_vehicle(vehicle_id, fields, start, end, after, limit)
+        return (dict(zip(keys, row)) for row in rows)
+
+    def maintain_partitions(self, now: Optional[datetime] = None) -> List[str]:
+        """
+        Drop the partitions past the retention period, then, while stored records exceed the
+        disk budget, the oldest archived segments and the oldest partitions in the policy's
+        eviction order.
+
+        Finished outbox entries past their retention are pruned before any record is
+        evicted. The budget only covers what eviction can free, the partitions and the
+        archive, so a large outbox or many trips never cause records to be dropped; the
+        partition of the current period is never dropped, even above the budget.
+
+        Args:
+            now (datetime, optional): The current UTC time. Defaults to now.
+
+        Returns:
+            List[str]: Names of the dropped partitions.
+        """
+        policy = self.partition_policy
+        if policy is None:
+            return []
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        budget = policy.disk_budget_bytes
+        dropped = []
+        opened = db.connect(reuse_if_open=True)
+        try:
+            partitions = self.partition_repository.find()
+            for partition in policy.expired(partitions, now):
+                self.partition_repository.drop(partition.name)
+                self.partitions_dropped['retention'] += 1
+                dropped.append(partition.name)
+            if not budget:
+                return dropped
+            self.prune_outbox()
+            used = self.partition_repository.used_bytes()
+            if used is None:
+                logger.warning("Disk budget not enforced: SQLite lacks the dbstat table to measure stored records")
+                return dropped
+            # Archived segments hold the oldest records, all of them forwarded, so they go first
+            while used > budget and self.segment_repository.delete_oldest(self.SEGMENT_EVICTION_BATCH):
+                used = self.partition_repository.used_bytes()
+            if used > budget:
+                remaining = [partition for partition in partitions if partition.name not in dropped]
+                forwarded = {partition.name for partition in remaining
+                             if not self.partition_repository.has_pending_deliveries(partition.name)}
+                for partition in policy.eviction_order(remaining, forwarded, now):
+                    if used <= budget:
+                        break
+                    self.partition_repository.drop(partition.name)
+                    self.partitions_dropped['disk_budget'] += 1
+                    dropped.append(partition.name)
+                    used = self.partition_repository.used_bytes()
+        finally:
+            if opened:
+                db.close()
+        return dropped
+
+    def prune_outbox(self, now: Optional[datetime] = None) -> int:
+        """
+        Delete the outbox entries that will never be sent again once they are older than
+        OUTBOX_RETENTION_DAYS: delivered, failed and superseded ones. Their records stay
+        stored; only their delivery state is forgotten.
+
+        Args:
+            now (datetime, optional): The current UTC time. Defaults to now.
+
+        Returns:
+            int: The number of entries deleted.
+        """
+        if not config.OUTBOX_RETENTION_DAYS:
+            return 0
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        opened = db.connect(reuse_if_open=True)
+        try:
+            return self.outbox_repository.prune_finished(now - timedelta(days=config.OUTBOX_RETENTION_DAYS))
+        finally:
+            if opened:
+                db.close()
+
+    def archive_cold_records(self, now: Optional[datetime] = None) -> int:
+        """
+        Move forwarded records older than METRICS_ARCHIVE_AFTER_DAYS into compressed column
+        segments, then delete archived segments past METRICS_RETENTION_DAYS.
+
+        Each vehicle's cold records are archived oldest first in segments of
+        METRICS_ARCHIVE_SEGMENT_ROWS, one transaction per segment. A shorter segment is only
+        written for the last records of a partition whose period is over, or for records
+        more than a day past the threshold, so a vehicle's trickle of newly cold records
+        does not end up in many tiny segments. Partitions left empty are dropped. Records
+        still waiting to be forwarded stay where they are until they are delivered.
+
+        Args:
+            now (datetime, optional): The current UTC time. Defaults to now.
+
+        Returns:
+            int: The number of records archived.
+        """
+        if not config.METRICS_ARCHIVE_AFTER_DAYS:
+            return 0
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        cutoff = now - timedelta(days=config.METRICS_ARCHIVE_AFTER_DAYS)
+        segment_rows = config.METRICS_ARCHIVE_SEGMENT_ROWS
+        repository = self.vehicle_metric_repository
+        archived = 0
+        opened = db.connect(reuse_if_open=True)
+        try:
+            for table, period_end in repository.archive_sources(cutoff):
+                complete = period_end is not None and period_end <= cutoff
+                vehicle_id = repository.next_vehicle(table)
+                while vehicle_id is not None:
+                    while True:
+                        with db.atomic():
+                            rows = repository.find_archivable(table, vehicle_id, cutoff, segment_rows)
+                            if not rows or (len(rows) < segment_rows and not complete and
+                                            rows[-1][1] >= cutoff - timedelta(days=1)):
+                                break
+                            self.segment_repository.save(rows)
+                            repository.delete(table, [row[0] for row in rows])
+                        archived += len(rows)
+                    vehicle_id = repository.next_vehicle(table, vehicle_id)
+                if complete and repository.is_empty(table):
+                    self.partition_repository.drop(table)
+            if config.METRICS_RETENTION_DAYS:
+                with db.atomic():
+                    self.segment_repository.delete_before(now - timedelta(days=config.METRICS_RETENTION_DAYS))
+        finally:
+            if opened:
+                db.close()
+        self.records_archived += archived
+        return archived
+
+    def get_archive_stats(self) -> dict:
+        """
+        Report the size of the columnar archive.
+
+        Returns:
+            dict: The number of segments, records and compressed bytes, and the records
+                archived by this process.
+        """
+        return dict(self.segment_repository.stats(), archived_by_this_process=self.records_archived)
+
+    def get_partition_stats(self) -> dict:
+        """
+        Report the partitioning settings, the existing partitions and the space in use.
+
+        Returns:
+            dict: The statistics, with one entry per partition, oldest first.
+        """
+        policy = self.partition_policy
+        partitions = self.partition_repository.find()
+        used_bytes = self.partition_repository.used_bytes()
+        database_bytes = self.partition_repository.database_bytes()
+        return {
+            "granularity": policy.granularity if policy else None,
+            "retention_days": policy.retention_days if policy else None,
+            "disk_budget_bytes": policy.disk_budget_bytes if policy else None,
+            "used_bytes": used_bytes,
+            "database_bytes": database_bytes,
+            "dropped": dict(self.partitions_dropped),
+            "partitions": [{
+                "name": partition.name,
+                "period_start": partition.period_start.isoformat(),
+                "period_end": partition.period_end.isoformat(),
+                "pending_deliveries": self.partition_repository.has_pending_deliveries(partition.name)
+            } for partition in partitions]
+        }
+
+    def get_latest_readings(self, vehicle_id: int, history: int = 0) -> Optional[dict]:
+        """
+        Read a vehicle's current state from memory, without touching the database; request
+        workers of a single-writer deployment read the writer's memory.
+
+        Args:
+            vehicle_id (int): Identifier of the vehicle.
+            history (int, optional): Recent readings to include, newest last. Defaults to 0.
+
+        Returns:
+            Optional[dict]: The latest reading, the latest reading of each device, the recent
+                readings and the stream sequence number, or None if no reading of the vehicle
+                was stored since the process that commits readings started.
+
+        Raises:
+            WriterUnavailable: If the writer process cannot be reached.
+        """
+        return self.live_readings.snapshot(vehicle_id, history)
+
+    def stream_latest_readings(self, vehicle_id: int, after: Optional[int],
+                               timeout: float) -> Iterator[Optional[Tuple[int, dict]]]:
+        """
+        Follow the readings of a vehicle as they are stored.
+
+        Without a resume point, the stream starts with the vehicle's latest reading, if any.
+        The stream never ends by itself; the caller closes it when the client goes away.
+
+        Args:
+            vehicle_id (int): Identifier of the vehicle.
+            after (int, optional): Sequence number of the last reading the client received.
+            timeout (float): Seconds after which None is yielded when no reading arrived.
+
+        Returns:
+            Iterator[Optional[Tuple[int, dict]]]: (sequence, reading) pairs, and None on timeouts.
+
+        Raises:
+            WriterUnavailable: If the writer process cannot be reached.
+        """
+        if after is None:
+            snapshot = self.live_readings.snapshot(vehicle_id, 0)
+            if snapshot is None:
+                after = self.live_readings.sequence
+            else:
+                after = snapshot["sequence"]
+                yield after, snapshot["latest"]
+        while True:
+            entries = self.live_readings.wait(vehicle_id, after, timeout)
+            if not entries:
+                yield None
+                continue
+            for entry in entries:
+                yield entry
+            after = entries[-1][0]
+
+    def get_forwarding_state(self, record_id: int) -> Optional[MetricForwardingState]:
+        """
+        Retrieve the upstream delivery state of a vehicle metric record.
+
+        Args:
+            record_id (int): Identifier of the vehicle metric record.
+
+        Returns:
+            Optional[MetricForwardingState]: The delivery state, or None if the record was never
+                queued or its finished delivery was pruned.
+        """
+        return self.outbox_repository.find_by_record_id(record_id)
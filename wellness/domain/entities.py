@@ -1,3 +1,6 @@
+from wellness.domain.schema import METRIC_SCHEMA
+
+
 class VehicleMetricRecord:
     """Entity representing a vehicle metric record.
 
@@ -13,10 +16,15 @@ class VehicleMetricRecord:
         temperatureCelsius (float): Temperature in Celsius.
         pressureHpa (float): Atmospheric pressure in hPa.
         impactDetected (bool): Flag indicating if an impact was detected.
+        recorded_at (datetime): UTC time the reading was taken.
+
+    Slotted so that large batches do not pay for a per-record attribute dictionary.
     """
+    __slots__ = ('id',) + METRIC_SCHEMA.names + ('recorded_at',)
+
     def __init__(self, device_id: str, vehicle_id: int, latitude: float,
                  longitude: float, CO2Ppm: float, NH3Ppm: float, BenzenePpm: float, temperatureCelsius: float,
-                 pressureHpa: float, impactDetected: bool, id: int = None):
+                 pressureHpa: float, impactDetected: bool, id: int = None, recorded_at=None):
         """Initialize a VehicleMetricRecord instance.
 
         Args:
@@ -31,6 +39,8 @@ class VehicleMetricRecord:
             pressureHpa (float): Atmospheric pressure in hPa.
             impactDetected (bool): Flag indicating if an impact was detected.
             id (int, optional): Unique identifier for the vehicle metric record. Defaults to None.
+            recorded_at (datetime, optional): UTC time the reading was taken. Defaults to None,
+                in which case the server assigns the time the record is stored.
         """
         self.id = id
         self.device_id = device_id
@@ -43,3 +53,202 @@ class VehicleMetricRecord:
         self.temperatureCelsius = temperatureCelsius
         self.pressureHpa = pressureHpa
         self.impactDetected = impactDetected
+        self.recorded_at = recorded_at
+
+
+class MetricForwardingState:
+    """Entity representing the upstream delivery state of a vehicle metric record.
+
+    Attributes:
+        outbox_id (int): Unique identifier of the outbox entry.
+        record_id (int): Identifier of the forwarded vehicle metric record.
+        device_id (str): Identifier of the device that produced the record.
+        payload (dict): Body sent to the Bykerz backend.
+        status (str): Delivery status: 'pending', 'sent', 'failed', or 'held' and then
+            'superseded' for a routine reading replaced by its trip.
+        attempts (int): Number of delivery attempts made so far.
+        last_status_code (int): HTTP status of the last attempt, if any.
+        last_error (str): Error of the last failed attempt, if any.
+        forwarded_at (datetime): Timestamp when the backend accepted the record, if any.
+        priority (int): Forwarding lane: 1 for critical events, 0 for routine telemetry.
+        created_at (datetime): Timestamp when the delivery was queued.
+        topic (str): Kind of payload: 'metrics' for records, 'trips' for completed trips,
+            in which case record_id is the trip's ID.
+    """
+    def __init__(self, outbox_id: int, record_id: int, device_id: str, payload: dict, status: str,
+                 attempts: int = 0, last_status_code: int = None, last_error: str = None,
+                 forwarded_at=None, priority: int = 0, created_at=None, topic: str = 'metrics'):
+        """Initialize a MetricForwardingState instance.
+
+        Args:
+            outbox_id (int): Unique identifier of the outbox entry.
+            record_id (int): Identifier of the forwarded vehicle metric record.
+            device_id (str): Identifier of the device that produced the record.
+            payload (dict): Body sent to the Bykerz backend.
+            status (str): Delivery status: 'pending', 'sent', 'failed', or 'held' and then
+            'superseded' for a routine reading replaced by its trip.
+            attempts (int, optional): Number of delivery attempts made so far. Defaults to 0.
+            last_status_code (int, optional): HTTP status of the last attempt. Defaults to None.
+            last_error (str, optional): Error of the last failed attempt. Defaults to None.
+            forwarded_at (datetime, optional): When the backend accepted the record. Defaults to None.
+            priority (int, optional): Forwarding lane, 1 for critical events. Defaults to 0.
+            created_at (datetime, optional): When the delivery was queued. Defaults to None.
+            topic (str, optional): Kind of payload, 'metrics' or 'trips'. Defaults to 'metrics'.
+        """
+        self.outbox_id = outbox_id
+        self.record_id = record_id
+        self.device_id = device_id
+        self.payload = payload
+        self.status = status
+        self.attempts = attempts
+        self.last_status_code = last_status_code
+        self.last_error = last_error
+        self.forwarded_at = forwarded_at
+        self.priority = priority
+        self.created_at = created_at
+        self.topic = topic
+
+
+class MetricAggregate:
+    """Entity representing running statistics of one sensor field over one time bucket.
+
+    Count, minimum, maximum, mean and the sum of squared deviations (m2) are maintained
+    with Welford's algorithm, so values can be added one at a time and partial aggregates
+    of the same bucket can be merged without revisiting raw readings.
+
+    Attributes:
+        vehicle_id (int): Identifier for the vehicle.
+        resolution (str): Bucket width: '1m', '1h' or '1d'.
+        bucket_start (datetime): UTC start of the bucket.
+        field (str): Name of the aggregated record attribute.
+        count (int): Number of readings aggregated.
+        minimum (float): Smallest reading.
+        maximum (float): Largest reading.
+        mean (float): Mean of the readings.
+        m2 (float): Sum of squared deviations from the mean.
+    """
+    def __init__(self, vehicle_id: int, resolution: str, bucket_start, field: str, count: int = 0,
+                 minimum: float = None, maximum: float = None, mean: float = 0.0, m2: float = 0.0):
+        """Initialize a MetricAggregate instance.
+
+        Args:
+            vehicle_id (int): Identifier for the vehicle.
+            resolution (str): Bucket width: '1m', '1h' or '1d'.
+            bucket_start (datetime): UTC start of the bucket.
+            field (str): Name of the aggregated record attribute.
+            count (int, optional): Number of readings aggregated. Defaults to 0.
+            minimum (float, optional): Smallest reading. Defaults to None.
+            maximum (float, optional): Largest reading. Defaults to None.
+            mean (float, optional): Mean of the readings. Defaults to 0.0.
+            m2 (float, optional): Sum of squared deviations from the mean. Defaults to 0.0.
+        """
+        self.vehicle_id = vehicle_id
+        self.resolution = resolution
+        self.bucket_start = bucket_start
+        self.field = field
+        self.count = count
+        self.minimum = minimum
+        self.maximum = maximum
+        self.mean = mean
+        self.m2 = m2
+
+    @property
+    def key(self) -> tuple:
+        """Identity of the aggregate: (vehicle_id, resolution, field, bucket_start)."""
+        return self.vehicle_id, self.resolution, self.field, self.bucket_start
+
+    @property
+    def variance(self):
+        """Sample variance of the readings, or None with fewer than two readings."""
+        return self.m2 / (self.count - 1) if self.count > 1 else None
+
+    def add(self, value: float) -> None:
+        """Add one reading.
+
+        Args:
+            value (float): The reading.
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def merge(self, other: 'MetricAggregate') -> None:
+        """Combine another aggregate of the same bucket into this one.
+
+        Args:
+            other (MetricAggregate): The aggregate to merge.
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.minimum, self.maximum = other.minimum, other.maximum
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+
+class Trip:
+    """Entity representing one continuous movement of a vehicle, bounded by idle gaps.
+
+    Attributes:
+        id (int): Unique identifier of the trip.
+        vehicle_id (int): Identifier for the vehicle.
+        device_id (str): Identifier of the device reporting the vehicle.
+        started_at (datetime): UTC time of the first point.
+        ended_at (datetime): UTC time of the last movement; None while the trip is open.
+        status (str): 'open' while the vehicle keeps moving, 'closed' after an idle gap.
+        raw_points (int): Number of GPS readings folded into the trip.
+        vertices (list): Points of the simplified track as (latitude, longitude, epoch seconds).
+    """
+    def __init__(self, vehicle_id: int, device_id: str, started_at, id: int = None, ended_at=None,
+                 status: str = 'open', raw_points: int = 0, vertices: list = None):
+        """Initialize a Trip instance.
+
+        Args:
+            vehicle_id (int): Identifier for the vehicle.
+            device_id (str): Identifier of the device reporting the vehicle.
+            started_at (datetime): UTC time of the first point.
+            id (int, optional): Unique identifier of the trip. Defaults to None.
+            ended_at (datetime, optional): UTC time of the last movement. Defaults to None.
+            status (str, optional): 'open' or 'closed'. Defaults to 'open'.
+            raw_points (int, optional): Number of GPS readings folded in. Defaults to 0.
+            vertices (list, optional): Simplified track points known so far. Defaults to an empty list.
+        """
+        self.id = id
+        self.vehicle_id = vehicle_id
+        self.device_id = device_id
+        self.started_at = started_at
+        self.ended_at = ended_at
+        self.status = status
+        self.raw_points = raw_points
+        self.vertices = vertices if vertices is not None else []
+
+
+class MetricPartition:
+    """Entity representing one time partition of the stored vehicle metric records.
+
+    Attributes:
+        name (str): Name of the table holding the partition's records.
+        period_start (datetime): Inclusive UTC start of the period covered.
+        period_end (datetime): Exclusive UTC end of the period covered.
+    """
+    def __init__(self, name: str, period_start, period_end):
+        """Initialize a MetricPartition instance.
+
+        Args:
+            name (str): Name of the table holding the partition's records.
+            period_start (datetime): Inclusive UTC start of the period covered.
+            period_end (datetime): Exclusive UTC end of the period covered.
+        """
+        self.name = name
+        self.period_start = period_start
+        self.period_end = period_end
@@ -0,0 +1,244 @@
+"""Geometry helpers for GPS tracks: distances, geohashes, polyline encoding and
+streaming track simplification.
+
+Distances use a local equirectangular projection, which is accurate to well under a
+metre over the few kilometres separating consecutive readings of a vehicle.
+"""
+import math
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+EARTH_RADIUS_M = 6371000.0
+_GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# A track point: (latitude, longitude, epoch seconds)
+TrackPoint = Tuple[float, float, float]
+
+
+def _to_local(origin_latitude: float, origin_longitude: float, latitude: float,
+              longitude: float) -> Tuple[float, float]:
+    """Project a coordinate to metres east and north of an origin."""
+    x = math.radians(longitude - origin_longitude) * math.cos(math.radians(origin_latitude)) * EARTH_RADIUS_M
+    y = math.radians(latitude - origin_latitude) * EARTH_RADIUS_M
+    return x, y
+
+
+def distance_m(latitude1: float, longitude1: float, latitude2: float, longitude2: float) -> float:
+    """Distance between two nearby coordinates.
+
+    Args:
+        latitude1 (float): Latitude of the first point.
+        longitude1 (float): Longitude of the first point.
+        latitude2 (float): Latitude of the second point.
+        longitude2 (float): Longitude of the second point.
+
+    Returns:
+        float: The distance in metres.
+    """
+    mean_latitude = math.radians((latitude1 + latitude2) / 2.0)
+    return EARTH_RADIUS_M * math.hypot(math.radians(longitude2 - longitude1) * math.cos(mean_latitude),
+                                       math.radians(latitude2 - latitude1))
+
+
+def _segment_distance_m(start: TrackPoint, end: TrackPoint, point: TrackPoint) -> float:
+    """Distance from a point to the segment between start and end, in metres."""
+    ex, ey = _to_local(start[0], start[1], end[0], end[1])
+    px, py = _to_local(start[0], start[1], point[0], point[1])
+    length = ex * ex + ey * ey
+    t = 0.0 if length == 0 else max(0.0, min(1.0, (px * ex + py * ey) / length))
+    return math.hypot(px - t * ex, py - t * ey)
+
+
+class StreamingSimplifier:
+    """Opening-window polyline simplification with a hard error bound.
+
+    Points are fed one at a time. The window grows from the last emitted vertex while every
+    point inside it lies within tolerance of the segment from that vertex to the newest
+    point; when a point breaks the bound, the point before it becomes a vertex and a new
+    window opens there. Every dropped point is therefore within tolerance metres of the
+    simplified polyline, and memory is bounded by max_window points.
+    """
+    def __init__(self, tolerance_m: float, max_window: int = 256):
+        """Initialize the simplifier.
+
+        Args:
+            tolerance_m (float): Maximum distance of a dropped point from the simplified line.
+            max_window (int, optional): Points buffered before a vertex is forced. Defaults to 256.
+        """
+        self.tolerance_m = tolerance_m
+        self.max_window = max_window
+        self.anchor: Optional[TrackPoint] = None
+        self._window: List[TrackPoint] = []
+
+    @property
+    def last_point(self) -> Optional[TrackPoint]:
+        """The newest point fed, or None before the first one."""
+        return self._window[-1] if self._window else self.anchor
+
+    def add(self, point: TrackPoint) -> List[TrackPoint]:
+        """Feed the next point of the track.
+
+        Args:
+            point (TrackPoint): The point.
+
+        Returns:
+            List[TrackPoint]: Vertices settled by this point, possibly none.
+        """
+        if self.anchor is None:
+            self.anchor = point
+            return [point]
+        if len(self._window) < self.max_window and all(
+                _segment_distance_m(self.anchor, point, inner) <= self.tolerance_m for inner in self._window):
+            self._window.append(point)
+            return []
+        vertex = self._window[-1]
+        self.anchor = vertex
+        self._window = [point]
+        return [vertex]
+
+    def finish(self) -> List[TrackPoint]:
+        """Settle the last point of the track.
+
+        Returns:
+            List[TrackPoint]: The final vertex, if any point is still buffered.
+        """
+        if not self._window:
+            return []
+        vertex = self._window[-1]
+        self.anchor = vertex
+        self._window = []
+        return [vertex]
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int) -> str:
+    """Encode a coordinate as a geohash.
+
+    Args:
+        latitude (float): Latitude in decimal degrees.
+        longitude (float): Longitude in decimal degrees.
+        precision (int): Number of characters; 7 gives cells of about 150 m.
+
+    Returns:
+        str: The geohash.
+    """
+    latitude_range, longitude_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (longitude_range, longitude) if even else (latitude_range, latitude)
+        middle = (interval[0] + interval[1]) / 2.0
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision: int) -> Tuple[float, float]:
+    """Size of a geohash cell in degrees.
+
+    Args:
+        precision (int): Number of geohash characters.
+
+    Returns:
+        Tuple[float, float]: The (latitude, longitude) extent of a cell.
+    """
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def geohash_cover(min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float,
+                  max_precision: int, max_cells: int = 64) -> List[str]:
+    """Geohash prefixes covering a bounding box.
+
+    The finest precision up to max_precision whose cover has at most max_cells cells is used.
+
+    Args:
+        min_latitude (float): Southern edge.
+        min_longitude (float): Western edge.
+        max_latitude (float): Northern edge.
+        max_longitude (float): Eastern edge.
+        max_precision (int): Precision of the indexed geohashes.
+        max_cells (int, optional): Largest number of prefixes returned. Defaults to 64.
+
+    Returns:
+        List[str]: The covering prefixes.
+    """
+    for precision in range(max_precision, 0, -1):
+        latitude_step, longitude_step = geohash_cell_size(precision)
+        rows = math.floor(max_latitude / latitude_step) - math.floor(min_latitude / latitude_step) + 1
+        columns = math.floor(max_longitude / longitude_step) - math.floor(min_longitude / longitude_step) + 1
+        if rows * columns <= max_cells or precision == 1:
+            break
+    cells = set()
+    latitude = min_latitude
+    while True:
+        longitude = min_longitude
+        while True:
+            cells.add(geohash_encode(min(latitude, max_latitude), min(longitude, max_longitude), precision))
+            if longitude >= max_longitude:
+                break
+            longitude += longitude_step
+        if latitude >= max_latitude:
+            break
+        latitude += latitude_step
+    return sorted(cells)
+
+
+def segment_intersects_box(start: Sequence[float], end: Sequence[float], min_latitude: float,
+                           min_longitude: float, max_latitude: float, max_longitude: float) -> bool:
+    """Check whether a segment between two coordinates crosses a bounding box (Liang-Barsky).
+
+    Args:
+        start (Sequence[float]): (latitude, longitude) of the first end.
+        end (Sequence[float]): (latitude, longitude) of the second end.
+        min_latitude (float): Southern edge.
+        min_longitude (float): Western edge.
+        max_latitude (float): Northern edge.
+        max_longitude (float): Eastern edge.
+
+    Returns:
+        bool: True if any part of the segment lies in the box.
+    """
+    low, high = 0.0, 1.0
+    for origin, delta, lower, upper in ((start[0], end[0] - start[0], min_latitude, max_latitude),
+                                        (start[1], end[1] - start[1], min_longitude, max_longitude)):
+        if delta == 0:
+            if origin < lower or origin > upper:
+                return False
+            continue
+        t1, t2 = (lower - origin) / delta, (upper - origin) / delta
+        low, high = max(low, min(t1, t2)), min(high, max(t1, t2))
+        if low > high:
+            return False
+    return True
+
+
+def encode_polyline(points: Iterable[Sequence[float]], precision: int = 5) -> str:
+    """Encode coordinates with the Encoded Polyline Algorithm Format.
+
+    Args:
+        points (Iterable[Sequence[float]]): (latitude, longitude) pairs.
+        precision (int, optional): Decimal digits kept; 5 is about 1 m. Defaults to 5.
+
+    Returns:
+        str: The encoded polyline.
+    """
+    factor = 10 ** precision
+    output = []
+    previous_latitude = previous_longitude = 0
+    for point in points:
+        latitude, longitude = round(point[0] * factor), round(point[1] * factor)
+        for delta in (latitude - previous_latitude, longitude - previous_longitude):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                output.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            output.append(chr(value + 63))
+        previous_latitude, previous_longitude = latitude, longitude
+    return ''.join(output)
@@ -0,0 +1,151 @@
+"""Field schema of vehicle metric records.
+
+Every place that reads or writes the sensor fields of a record (request parsing,
+coercion, the upstream payload, API responses and the database row) is derived from
+METRIC_SCHEMA, so adding a field means adding one MetricField here and a column to the
+peewee model.
+"""
+from operator import attrgetter
+from typing import Callable, Mapping, Optional, Sequence
+
+
+class MetricField:
+    """Definition of one device-supplied record field.
+
+    Attributes:
+        name (str): Attribute, request key and column name.
+        coerce (Callable): Converts a raw request value to the field's type.
+        upstream_name (str): Key in the Bykerz backend payload, or None if not forwarded.
+    """
+    __slots__ = ('name', 'coerce', 'upstream_name')
+
+    def __init__(self, name: str, coerce: Callable, upstream_name: Optional[str] = None):
+        """Initialize a MetricField instance.
+
+        Args:
+            name (str): Attribute, request key and column name.
+            coerce (Callable): Converts a raw request value to the field's type.
+            upstream_name (str, optional): Key in the upstream payload. Defaults to None,
+                meaning the field is not forwarded.
+        """
+        self.name = name
+        self.coerce = coerce
+        self.upstream_name = upstream_name
+
+
+class MetricSchema:
+    """Ordered field schema with the codecs generated from it."""
+
+    def __init__(self, fields: Sequence[MetricField]):
+        """Build the codecs for an ordered list of fields.
+
+        Args:
+            fields (Sequence[MetricField]): The fields, in constructor argument order.
+        """
+        self.fields = tuple(fields)
+        self.names = tuple(field.name for field in self.fields)
+        self._coercers = tuple(field.coerce for field in self.fields)
+        self._values_of = attrgetter(*self.names)
+        upstream = [field for field in self.fields if field.upstream_name]
+        self._upstream_names = tuple(field.upstream_name for field in upstream)
+        self._upstream_values_of = attrgetter(*(field.name for field in upstream))
+
+    def extract(self, data: Mapping, device_id: Optional[str] = None) -> tuple:
+        """Read the raw field values of a request object, in schema order.
+
+        Args:
+            data (Mapping): The decoded request object.
+            device_id (str, optional): Authenticated device used when the object omits device_id.
+
+        Returns:
+            tuple: The raw values.
+
+        Raises:
+            KeyError: If a field other than device_id is missing.
+        """
+        values = [data[name] if name != 'device_id' else data.get(name, device_id) for name in self.names]
+        if values[0] is None:
+            raise KeyError('device_id')
+        return tuple(values)
+
+    def coerce(self, values: Sequence) -> tuple:
+        """Convert raw values to the field types.
+
+        Args:
+            values (Sequence): Raw values in schema order.
+
+        Returns:
+            tuple: The converted values.
+
+        Raises:
+            ValueError: If a value cannot be converted.
+        """
+        try:
+            return tuple(coerce(value) for coerce, value in zip(self._coercers, values))
+        except (ValueError, TypeError):
+            raise ValueError("Invalid data format")
+
+    def values(self, record) -> tuple:
+        """Read a record's field values in schema order.
+
+        Args:
+            record: A VehicleMetricRecord.
+
+        Returns:
+            tuple: The values.
+        """
+        return self._values_of(record)
+
+    def to_row(self, record) -> dict:
+        """Map a record to the column values of its database row, excluding the ID.
+
+        Args:
+            record: A VehicleMetricRecord whose recorded_at is set.
+
+        Returns:
+            dict: Column name to value.
+        """
+        row = dict(zip(self.names, self._values_of(record)))
+        row['recorded_at'] = record.recorded_at
+        return row
+
+    def to_upstream(self, record) -> dict:
+        """Build the body the Bykerz backend expects for a record.
+
+        Args:
+            record: A VehicleMetricRecord.
+
+        Returns:
+            dict: The upstream payload.
+        """
+        payload = dict(zip(self._upstream_names, self._upstream_values_of(record)))
+        payload['recordedAt'] = record.recorded_at.isoformat() + 'Z' if record.recorded_at else None
+        return payload
+
+    def to_response(self, record) -> dict:
+        """Serialize a stored record for API responses.
+
+        Args:
+            record: A VehicleMetricRecord.
+
+        Returns:
+            dict: The ID, every field and recorded_at in ISO 8601 UTC.
+        """
+        response = {'id': record.id}
+        response.update(zip(self.names, self._values_of(record)))
+        response['recorded_at'] = record.recorded_at.isoformat() + 'Z' if record.recorded_at else None
+        return response
+
+
+METRIC_SCHEMA = MetricSchema([
+    MetricField('device_id', str),
+    MetricField('vehicle_id', int, 'vehicleId'),
+    MetricField('latitude', float, 'latitude'),
+    MetricField('longitude', float, 'longitude'),
+    MetricField('CO2Ppm', float, 'CO2Ppm'),
+    MetricField('NH3Ppm', float, 'NH3Ppm'),
+    MetricField('BenzenePpm', float, 'BenzenePpm'),
+    MetricField('temperatureCelsius', float, 'temperatureCelsius'),
+    MetricField('pressureHpa', float, 'pressureHpa'),
+    MetricField('impactDetected', bool, 'impactDetected'),
+])
@@ -1,15 +1,58 @@
-from wellness.domain.entities import VehicleMetricRecord
+import fnmatch
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from dateutil import parser as date_parser
+
+from wellness.domain import geo
+from wellness.domain.entities import VehicleMetricRecord, MetricAggregate, MetricPartition, Trip
+from wellness.domain.schema import METRIC_SCHEMA
 
 
 class VehicleMetricRecordService:
+    # Record attributes that can be projected by metric queries
+    QUERYABLE_FIELDS = METRIC_SCHEMA.names
+
     def __init__(self):
         """Initialize the vehicle metric record service."""
         pass
 
+    @staticmethod
+    def parse_recorded_at(value) -> datetime:
+        """Normalize a device-supplied timestamp to a naive UTC datetime.
+
+        Args:
+            value: An ISO 8601 string, epoch seconds or milliseconds, or a datetime.
+                Values without a timezone are taken as UTC.
+
+        Returns:
+            datetime: The timestamp in UTC without tzinfo.
+
+        Raises:
+            ValueError: If the value cannot be interpreted as a timestamp.
+        """
+        try:
+            if isinstance(value, datetime):
+                timestamp = value
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                seconds = value / 1000.0 if value > 1e11 else value
+                timestamp = datetime.fromtimestamp(seconds, timezone.utc)
+            elif isinstance(value, str):
+                timestamp = date_parser.isoparse(value)
+            else:
+                raise TypeError(type(value))
+        except (ValueError, TypeError, OverflowError, OSError):
+            raise ValueError("Invalid recorded_at timestamp")
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        return timestamp
+
     @staticmethod
     def create_record(device_id: str, vehicle_id: int, latitude: float, longitude: float,
                       CO2Ppm: float, NH3Ppm: float, BenzenePpm: float, temperatureCelsius: float,
-                      pressureHpa: float, impactDetected: bool) -> VehicleMetricRecord:
+                      pressureHpa: float, impactDetected: bool, recorded_at=None) -> VehicleMetricRecord:
         """Create a vehicle metric record.
 
         Args:
@@ -23,6 +66,8 @@ class VehicleMetricRecordService:
             temperatureCelsius (float): Temperature in Celsius.
             pressureHpa (float): Atmospheric pressure in hPa.
             impactDetected (bool): Whether an impact was detected.
+            recorded_at (optional): Device-supplied reading time; see parse_recorded_at.
+                Defaults to None, leaving the time to be assigned on storage.
 
         Returns:
             VehicleMetricRecord: The created vehicle metric record.
@@ -30,19 +75,765 @@ class VehicleMetricRecordService:
         Raises:
             ValueError: If any of the input values are invalid.
         """
-        try:
-            vehicle_id = int(vehicle_id)
-            latitude = float(latitude)
-            longitude = float(longitude)
-            CO2Ppm = float(CO2Ppm)
-            NH3Ppm = float(NH3Ppm)
-            BenzenePpm = float(BenzenePpm)
-            temperatureCelsius = float(temperatureCelsius)
-            pressureHpa = float(pressureHpa)
-            impactDetected = bool(impactDetected)
-        except (ValueError, TypeError):
-            raise ValueError("Invalid data format")
-
-        return VehicleMetricRecord(device_id, vehicle_id, latitude,
-                                   longitude, CO2Ppm, NH3Ppm, BenzenePpm, temperatureCelsius,
-                                   pressureHpa, impactDetected)
\ No newline at end of file
+        values = METRIC_SCHEMA.coerce((device_id, vehicle_id, latitude, longitude, CO2Ppm, NH3Ppm,
+                                       BenzenePpm, temperatureCelsius, pressureHpa, impactDetected))
+        if recorded_at is not None:
+            recorded_at = VehicleMetricRecordService.parse_recorded_at(recorded_at)
+        return VehicleMetricRecord(*values, recorded_at=recorded_at)
+
+    @staticmethod
+    def to_upstream_payload(record: VehicleMetricRecord) -> dict:
+        """Build the body the Bykerz backend expects for a vehicle metric record.
+
+        Args:
+            record (VehicleMetricRecord): The record to forward.
+
+        Returns:
+            dict: The upstream payload.
+        """
+        return METRIC_SCHEMA.to_upstream(record)
+
+
+class MetricRuleEvaluator:
+    # Forwarding priorities assigned to classified records
+    PRIORITY_ROUTINE = 0
+    PRIORITY_CRITICAL = 1
+
+    def __init__(self, alert_on_impact: bool = True, co2_ppm: float = None, nh3_ppm: float = None,
+                 benzene_ppm: float = None):
+        """Initialize the rule evaluator with its alert thresholds.
+
+        Args:
+            alert_on_impact (bool, optional): Whether impacts are critical. Defaults to True.
+            co2_ppm (float, optional): CO2 concentration above which a reading is critical.
+            nh3_ppm (float, optional): NH3 concentration above which a reading is critical.
+            benzene_ppm (float, optional): Benzene concentration above which a reading is critical.
+                A threshold of None disables the corresponding rule.
+        """
+        self.alert_on_impact = alert_on_impact
+        self.thresholds = {
+            'CO2Ppm': co2_ppm,
+            'NH3Ppm': nh3_ppm,
+            'BenzenePpm': benzene_ppm,
+        }
+
+    def evaluate(self, record: VehicleMetricRecord) -> List[str]:
+        """List the alert rules a record triggers.
+
+        Args:
+            record (VehicleMetricRecord): The record to evaluate.
+
+        Returns:
+            List[str]: Names of the triggered rules, e.g. ['impact', 'CO2Ppm']; empty for routine readings.
+        """
+        alerts = []
+        if self.alert_on_impact and record.impactDetected:
+            alerts.append('impact')
+        for field, threshold in self.thresholds.items():
+            if threshold is not None and getattr(record, field) > threshold:
+                alerts.append(field)
+        return alerts
+
+    def priority(self, record: VehicleMetricRecord) -> int:
+        """Classify a record into a forwarding priority.
+
+        Args:
+            record (VehicleMetricRecord): The record to classify.
+
+        Returns:
+            int: PRIORITY_CRITICAL if any alert rule fires, PRIORITY_ROUTINE otherwise.
+        """
+        return self.PRIORITY_CRITICAL if self.evaluate(record) else self.PRIORITY_ROUTINE
+
+
+class DeadbandFilter:
+    # Deadband modes: absolute units or percent of the last forwarded value
+    MODE_ABSOLUTE = 'abs'
+    MODE_PERCENT = 'pct'
+
+    def __init__(self, bands: Dict[str, Tuple[str, float]], max_silence_seconds: float):
+        """Initialize the per-device change-detection filter.
+
+        Args:
+            bands (Dict[str, Tuple[str, float]]): Deadband per record attribute, as (mode, width).
+            max_silence_seconds (float): Heartbeat; a device's reading always passes once this
+                long has elapsed since its last passed reading.
+        """
+        self.bands = bands
+        self.max_silence_seconds = max_silence_seconds
+        self._last_passed: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+        self.passed = 0
+        self.suppressed = 0
+
+    @classmethod
+    def parse_rules(cls, rules: str) -> Dict[str, Tuple[str, float]]:
+        """Parse deadband rules written as 'field:mode:width,...'.
+
+        Args:
+            rules (str): The rules, e.g. 'CO2Ppm:abs:10,pressureHpa:pct:0.1'.
+
+        Returns:
+            Dict[str, Tuple[str, float]]: The deadband per field.
+
+        Raises:
+            ValueError: If a rule is malformed.
+        """
+        bands = {}
+        for rule in filter(None, (part.strip() for part in rules.split(','))):
+            field, mode, width = rule.split(':')
+            if mode not in (cls.MODE_ABSOLUTE, cls.MODE_PERCENT):
+                raise ValueError(f"Unknown deadband mode: {mode}")
+            bands[field] = (mode, float(width))
+        return bands
+
+    def _changed(self, previous: dict, record: VehicleMetricRecord) -> bool:
+        """Check whether any field moved outside its deadband since the last passed reading."""
+        for field, (mode, width) in self.bands.items():
+            last = previous[field]
+            band = width if mode == self.MODE_ABSOLUTE else abs(last) * width / 100.0
+            if abs(getattr(record, field) - last) > band:
+                return True
+        return False
+
+    def admit(self, record: VehicleMetricRecord, now: datetime, force: bool = False,
+              pending: Optional[dict] = None) -> bool:
+        """Decide whether a reading is worth storing and forwarding.
+
+        A reading passes when it is the device's first, when it reports an impact, when
+        force is set (e.g. for alerts), when any field left its deadband around the last
+        passed value, or when the heartbeat has expired.
+
+        Args:
+            record (VehicleMetricRecord): The reading.
+            now (datetime): Reading time used for the heartbeat.
+            force (bool, optional): Let the reading through unconditionally. Defaults to False.
+            pending (dict, optional): Last passed reading of each device among readings not
+                stored yet, read before the committed state and updated instead of it;
+                commit() applies it once they are. Defaults to None, which updates the
+                committed state directly.
+
+        Returns:
+            bool: True if the reading passes, False if it is suppressed.
+        """
+        key = (record.device_id, record.vehicle_id)
+        with self._lock:
+            if pending is not None and key in pending:
+                state = pending[key]
+            else:
+                state = self._last_passed.get(key)
+            admit = (force or record.impactDetected or state is None or
+                     (now - state[0]).total_seconds() >= self.max_silence_seconds or
+                     self._changed(state[1], record))
+            if admit:
+                target = self._last_passed if pending is None else pending
+                target[key] = (now, {field: getattr(record, field) for field in self.bands})
+                self.passed += 1
+            else:
+                self.suppressed += 1
+        return admit
+
+    def admit_many(self, records: Sequence[VehicleMetricRecord], now: datetime, forced: Sequence[bool],
+                   pending: Optional[dict] = None) -> List[bool]:
+        """Decide which readings of a batch pass, in arrival order, see admit.
+
+        Args:
+            records (Sequence[VehicleMetricRecord]): The readings.
+            now (datetime): Time used for the heartbeat of readings without a device timestamp.
+            forced (Sequence[bool]): Per reading, whether to let it through unconditionally.
+            pending (dict, optional): See admit. Defaults to None.
+
+        Returns:
+            List[bool]: Per reading, True if it passes.
+        """
+        return [self.admit(record, record.recorded_at or now, force, pending)
+                for record, force in zip(records, forced)]
+
+    def commit(self, pending: dict) -> None:
+        """Make the state admit() left in pending the committed one, once its readings are stored.
+
+        Args:
+            pending (dict): The pending state passed to admit().
+        """
+        with self._lock:
+            self._last_passed.update(pending)
+
+    def stats(self) -> dict:
+        """Report how many readings passed and were suppressed.
+
+        Returns:
+            dict: passed, suppressed and suppression_ratio counters plus the tracked device count.
+        """
+        with self._lock:
+            total = self.passed + self.suppressed
+            return {
+                "passed": self.passed,
+                "suppressed": self.suppressed,
+                "suppression_ratio": self.suppressed / total if total else 0.0,
+                "tracked_devices": len(self._last_passed)
+            }
+
+
+class ReadingSmoother:
+    def __init__(self, weights: Dict[str, float]):
+        """Initialize the per-device exponential moving average of noisy sensor fields.
+
+        Args:
+            weights (Dict[str, float]): Weight of each new reading in the average, per record
+                attribute; 1 keeps raw readings, smaller values smooth more.
+        """
+        self.weights = weights
+        self._averages: Dict[tuple, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_rules(rules: str) -> Dict[str, float]:
+        """Parse smoothing rules written as 'field:weight,...'.
+
+        Args:
+            rules (str): The rules, e.g. 'temperatureCelsius:0.3,pressureHpa:0.2'.
+
+        Returns:
+            Dict[str, float]: The weight per field.
+
+        Raises:
+            ValueError: If a rule is malformed, names an unknown field or has a weight outside (0, 1].
+        """
+        weights = {}
+        for rule in filter(None, (part.strip() for part in rules.split(','))):
+            field, weight = rule.split(':')
+            if field not in METRIC_SCHEMA.names or field in ('device_id', 'vehicle_id', 'impactDetected'):
+                raise ValueError(f"Cannot smooth field: {field}")
+            weight = float(weight)
+            if not 0 < weight <= 1:
+                raise ValueError(f"Smoothing weight of {field} must be in (0, 1]")
+            weights[field] = weight
+        return weights
+
+    def smooth(self, record: VehicleMetricRecord, keep_raw: bool = False, pending: Optional[dict] = None) -> None:
+        """Fold a reading into its device's averages and store them in the reading.
+
+        Args:
+            record (VehicleMetricRecord): The reading, updated in place.
+            keep_raw (bool, optional): Update the averages but leave the reading's values
+                untouched, e.g. for alerts. Defaults to False.
+            pending (dict, optional): Averages of each device including readings not stored
+                yet, read before the committed ones and updated instead of them; commit()
+                applies them once the readings are. Defaults to None, which updates the
+                committed averages directly.
+        """
+        key = (record.device_id, record.vehicle_id)
+        target = self._averages if pending is None else pending
+        with self._lock:
+            if pending is not None and key in pending:
+                averages = pending[key]
+            else:
+                averages = self._averages.get(key)
+            if averages is None:
+                target[key] = {field: getattr(record, field) for field in self.weights}
+                return
+            updated = {}
+            for field, weight in self.weights.items():
+                average = averages[field] + weight * (getattr(record, field) - averages[field])
+                updated[field] = average
+                if not keep_raw:
+                    setattr(record, field, average)
+            target[key] = updated
+
+    def smooth_many(self, records: Sequence[VehicleMetricRecord], keep_raw: Sequence[bool],
+                    pending: Optional[dict] = None) -> None:
+        """Smooth the readings of a batch in arrival order, see smooth.
+
+        Args:
+            records (Sequence[VehicleMetricRecord]): The readings, updated in place.
+            keep_raw (Sequence[bool]): Per reading, whether to leave its values untouched.
+            pending (dict, optional): See smooth. Defaults to None.
+        """
+        for record, raw in zip(records, keep_raw):
+            self.smooth(record, raw, pending)
+
+    def commit(self, pending: dict) -> None:
+        """Make the averages smooth() left in pending the committed ones, once their readings are stored.
+
+        Args:
+            pending (dict): The pending averages passed to smooth().
+        """
+        with self._lock:
+            self._averages.update(pending)
+
+
+class ForwardingRetryPolicy:
+    def __init__(self, base_delay: float, max_delay: float, max_attempts: int):
+        """Initialize the retry policy for upstream metric forwarding.
+
+        Args:
+            base_delay (float): Delay in seconds after the first failed attempt.
+            max_delay (float): Upper bound in seconds for any retry delay.
+            max_attempts (int): Attempts after which a delivery is given up.
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+    def next_delay(self, attempts: int) -> float:
+        """Compute the exponential backoff delay before the next attempt.
+
+        Args:
+            attempts (int): Number of attempts made so far, including the failed one.
+
+        Returns:
+            float: Seconds to wait before retrying.
+        """
+        return min(self.base_delay * (2 ** max(attempts - 1, 0)), self.max_delay)
+
+    def should_give_up(self, attempts: int, status_code: int = None) -> bool:
+        """Decide whether a delivery should be marked as permanently failed.
+
+        Client errors other than 408 and 429 will not succeed on retry.
+
+        Args:
+            attempts (int): Number of attempts made so far, including the failed one.
+            status_code (int, optional): HTTP status of the failed attempt. Defaults to None.
+
+        Returns:
+            bool: True if the delivery must not be retried.
+        """
+        if status_code is not None and 400 <= status_code < 500 and status_code not in (408, 429):
+            return True
+        return attempts >= self.max_attempts
+
+
+class IngestDurabilityPolicy:
+    # Acknowledge once queued in memory; the reading may be lost if the process dies
+    FIRE_AND_FORGET = 'fire-and-forget'
+    # Acknowledge once committed to the local database
+    LOCAL_DURABLE = 'local-durable'
+    # Acknowledge once the Bykerz backend accepted the reading
+    UPSTREAM_CONFIRMED = 'upstream-confirmed'
+    MODES = (FIRE_AND_FORGET, LOCAL_DURABLE, UPSTREAM_CONFIRMED)
+
+    def __init__(self, device_modes: Sequence[Tuple[str, str]] = (), default_mode: Optional[str] = None):
+        """Initialize the policy choosing how durably each reading is stored before it is acknowledged.
+
+        Args:
+            device_modes (Sequence[Tuple[str, str]], optional): (device ID pattern, mode) pairs
+                tried in order. Defaults to none.
+            default_mode (str, optional): Mode of devices matching no pattern. Defaults to None,
+                meaning the full record response of local-durable ingestion.
+
+        Raises:
+            ValueError: If a mode is unknown.
+        """
+        for mode in [mode for _, mode in device_modes] + ([default_mode] if default_mode else []):
+            self._check(mode)
+        self.device_modes = tuple(device_modes)
+        self.default_mode = default_mode
+
+    @staticmethod
+    def parse_device_modes(modes: str) -> List[Tuple[str, str]]:
+        """Parse per-device modes written as 'pattern:mode,...'.
+
+        Args:
+            modes (str): The modes, e.g. 'bykerz-env-*:fire-and-forget'.
+
+        Returns:
+            List[Tuple[str, str]]: The (pattern, mode) pairs in order.
+        """
+        return [tuple(rule.rsplit(':', 1)) for rule in filter(None, (part.strip() for part in modes.split(',')))]
+
+    def _check(self, mode: str) -> str:
+        """Reject unknown modes."""
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown durability mode: {mode}")
+        return mode
+
+    def resolve(self, device_id: str, requested: Optional[str] = None, critical: bool = False) -> Optional[str]:
+        """Choose the durability mode of one reading.
+
+        A mode requested with the reading wins over the device's configured mode. Critical
+        readings are never acknowledged before they are durable, so fire-and-forget is
+        raised to local-durable for them.
+
+        Args:
+            device_id (str): The device sending the reading.
+            requested (str, optional): Mode asked for by the request. Defaults to None.
+            critical (bool, optional): Whether the reading triggers an alert rule. Defaults to False.
+
+        Returns:
+            Optional[str]: The mode, or None when neither the request nor the configuration sets one.
+
+        Raises:
+            ValueError: If the requested mode is unknown.
+        """
+        mode = requested
+        if mode is None:
+            mode = next((mode for pattern, mode in self.device_modes
+                         if fnmatch.fnmatchcase(device_id, pattern)), self.default_mode)
+        if mode is None:
+            return None
+        if critical and self._check(mode) == self.FIRE_AND_FORGET:
+            return self.LOCAL_DURABLE
+        return self._check(mode)
+
+
+class MetricPartitionPolicy:
+    # Period covered by each partition
+    GRANULARITIES = ('day', 'week')
+
+    def __init__(self, granularity: str, retention_days: float = 0.0, disk_budget_bytes: int = 0):
+        """Initialize the policy splitting stored records into time partitions and deciding which to drop.
+
+        Args:
+            granularity (str): 'day' or 'week'; weeks start on Monday.
+            retention_days (float, optional): Days after its period ends that a partition is
+                kept; 0 keeps partitions forever. Defaults to 0.
+            disk_budget_bytes (int, optional): Space stored records, partitions and archived
+                segments, should fit in; 0 disables the budget. Defaults to 0.
+
+        Raises:
+            ValueError: If the granularity is unknown.
+        """
+        if granularity not in self.GRANULARITIES:
+            raise ValueError(f"Unknown partition granularity: {granularity}")
+        self.granularity = granularity
+        self.retention_days = retention_days
+        self.disk_budget_bytes = disk_budget_bytes
+
+    def period(self, timestamp: datetime) -> Tuple[datetime, datetime]:
+        """Find the period of the partition a reading belongs to.
+
+        Args:
+            timestamp (datetime): The reading time.
+
+        Returns:
+            Tuple[datetime, datetime]: The inclusive start and exclusive end of the period.
+        """
+        start = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.granularity == 'day':
+            return start, start + timedelta(days=1)
+        start -= timedelta(days=start.weekday())
+        return start, start + timedelta(days=7)
+
+    def expired(self, partitions: Sequence[MetricPartition], now: datetime) -> List[MetricPartition]:
+        """Select the partitions past the retention period.
+
+        Args:
+            partitions (Sequence[MetricPartition]): The existing partitions.
+            now (datetime): The current UTC time.
+
+        Returns:
+            List[MetricPartition]: The partitions to drop, oldest first.
+        """
+        if not self.retention_days:
+            return []
+        cutoff = now - timedelta(days=self.retention_days)
+        return sorted((partition for partition in partitions if partition.period_end <= cutoff),
+                      key=lambda partition: partition.period_start)
+
+    def eviction_order(self, partitions: Sequence[MetricPartition], forwarded: Set[str],
+                       now: datetime) -> List[MetricPartition]:
+        """Order the partitions that may be dropped to stay within the disk budget.
+
+        Partitions whose records were all accepted upstream go first, oldest first, then
+        the others, oldest first; their pending deliveries stay in the outbox, so dropping
+        them only loses local history. The partition of the current period is never dropped.
+
+        Args:
+            partitions (Sequence[MetricPartition]): The existing partitions.
+            forwarded (Set[str]): Names of the partitions without pending deliveries.
+            now (datetime): The current UTC time.
+
+        Returns:
+            List[MetricPartition]: The partitions in eviction order.
+        """
+        current_start, _ = self.period(now)
+        candidates = [partition for partition in partitions if partition.period_start < current_start]
+        return sorted(candidates, key=lambda partition: (partition.name not in forwarded, partition.period_start))
+
+
+class MetricRollupService:
+    # Bucket widths maintained for every vehicle
+    RESOLUTIONS = ('1m', '1h', '1d')
+    # Record attributes aggregated per bucket
+    ROLLUP_FIELDS = ('CO2Ppm', 'NH3Ppm', 'BenzenePpm', 'temperatureCelsius', 'pressureHpa')
+
+    def __init__(self):
+        """Initialize the metric rollup service."""
+        pass
+
+    @staticmethod
+    def bucket_start(timestamp: datetime, resolution: str) -> datetime:
+        """Truncate a timestamp to the start of its bucket.
+
+        Args:
+            timestamp (datetime): The reading time.
+            resolution (str): Bucket width: '1m', '1h' or '1d'.
+
+        Returns:
+            datetime: The start of the bucket containing the timestamp.
+
+        Raises:
+            ValueError: If the resolution is not supported.
+        """
+        if resolution == '1m':
+            return timestamp.replace(second=0, microsecond=0)
+        if resolution == '1h':
+            return timestamp.replace(minute=0, second=0, microsecond=0)
+        if resolution == '1d':
+            return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+        raise ValueError(f"Unsupported resolution: {resolution}")
+
+    def aggregate(self, records: List[VehicleMetricRecord]) -> List[MetricAggregate]:
+        """Fold records into per-vehicle, per-bucket, per-field aggregates.
+
+        Args:
+            records (List[VehicleMetricRecord]): Records with recorded_at assigned.
+
+        Returns:
+            List[MetricAggregate]: One aggregate per (vehicle, resolution, field, bucket) touched.
+        """
+        aggregates = {}
+        for record in records:
+            for resolution in self.RESOLUTIONS:
+                bucket = self.bucket_start(record.recorded_at, resolution)
+                for field in self.ROLLUP_FIELDS:
+                    key = (record.vehicle_id, resolution, field, bucket)
+                    aggregate = aggregates.get(key)
+                    if aggregate is None:
+                        aggregate = aggregates[key] = MetricAggregate(record.vehicle_id, resolution, bucket, field)
+                    aggregate.add(getattr(record, field))
+        return list(aggregates.values())
+
+
+class _OpenTrip:
+    """Tracking state of a trip in progress."""
+    def __init__(self, trip: Trip, simplifier: geo.StreamingSimplifier, last_moved: geo.TrackPoint,
+                 observed_at: Optional[float] = None):
+        self.trip = trip
+        self.simplifier = simplifier
+        self.last_moved = last_moved
+        self.new_vertices: List[geo.TrackPoint] = []
+        self.new_cells: Set[str] = set()
+        self.known_cells: Set[str] = set()
+        self.observed_at = time.time() if observed_at is None else observed_at
+
+
+class TripSegmenter:
+    """Splits each vehicle's GPS stream into trips and simplifies their tracks as points arrive.
+
+    A trip starts when a vehicle moves at least min_move_m from where it was last seen and
+    closes once it has not moved that far for idle_gap_seconds, or when its readings stop
+    for that long. Each trip's track is reduced by a StreamingSimplifier, and the geohash
+    cells its raw path crosses are collected for area queries.
+    """
+    def __init__(self, idle_gap_seconds: float, min_move_m: float, tolerance_m: float,
+                 geohash_precision: int, max_window: int = 256):
+        """Initialize the segmenter.
+
+        Args:
+            idle_gap_seconds (float): Time without movement that ends a trip.
+            min_move_m (float): Displacement that counts as movement, above GPS jitter.
+            tolerance_m (float): Error bound of the simplified tracks.
+            geohash_precision (int): Precision of the indexed geohash cells.
+            max_window (int, optional): Points buffered by a simplifier before a vertex is forced.
+        """
+        self.idle_gap_seconds = idle_gap_seconds
+        self.min_move_m = min_move_m
+        self.tolerance_m = tolerance_m
+        self.geohash_precision = geohash_precision
+        self.max_window = max_window
+        self._cell_step = min(geo.geohash_cell_size(geohash_precision)) / 2.0
+        self._open: Dict[int, _OpenTrip] = {}
+        self._last_seen: Dict[int, Tuple[geo.TrackPoint, str]] = {}
+        self._closed: List[_OpenTrip] = []
+
+    @staticmethod
+    def _epoch(timestamp: datetime) -> float:
+        """Naive UTC datetime to epoch seconds."""
+        return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+    @staticmethod
+    def _datetime(epoch: float) -> datetime:
+        """Epoch seconds to a naive UTC datetime."""
+        return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+    def resume(self, trip: Trip, last_point: geo.TrackPoint, last_moved: geo.TrackPoint,
+               observed_at: Optional[float] = None) -> None:
+        """Continue tracking a trip that was stored open, by an earlier run or another process.
+
+        The simplifier restarts from the trip's last stored vertex; the last raw point,
+        if it differs, becomes a vertex so the stored track stays within tolerance.
+
+        Args:
+            trip (Trip): The open trip, with at least its last vertex.
+            last_point (TrackPoint): The last raw point folded into the trip.
+            last_moved (TrackPoint): The last point at which the vehicle was moving.
+            observed_at (float, optional): Server time the trip last received a point. Defaults to now.
+        """
+        simplifier = geo.StreamingSimplifier(self.tolerance_m, self.max_window)
+        simplifier.anchor = tuple(trip.vertices[-1])
+        state = _OpenTrip(trip, simplifier, last_moved, observed_at)
+        if tuple(last_point) != simplifier.anchor:
+            simplifier.anchor = tuple(last_point)
+            state.new_vertices.append(tuple(last_point))
+        self._open[trip.vehicle_id] = state
+        self._last_seen[trip.vehicle_id] = (tuple(last_point), trip.device_id)
+
+    def restore(self, vehicle_id: int, device_id: Optional[str] = None, last_point: Optional[geo.TrackPoint] = None,
+                open_trip: Optional[tuple] = None) -> None:
+        """Replace a vehicle's tracking state with its stored state.
+
+        Used when another process folded readings of the vehicle since this segmenter last
+        saw it. Changes not drained yet are lost.
+
+        Args:
+            vehicle_id (int): The vehicle.
+            device_id (str, optional): Device of the last point; None if the vehicle was never seen.
+            last_point (TrackPoint, optional): The last point seen.
+            open_trip (tuple, optional): The stored open trip, its last moving point and the
+                server time it last received a point.
+        """
+        self._open.pop(vehicle_id, None)
+        self._last_seen.pop(vehicle_id, None)
+        if open_trip is not None:
+            trip, last_moved, observed_at = open_trip
+            self.resume(trip, last_point, last_moved, observed_at)
+        elif last_point is not None:
+            self._last_seen[vehicle_id] = (tuple(last_point), device_id)
+
+    def track_of(self, vehicle_id: int) -> Optional[Tuple[str, geo.TrackPoint, Optional[int], Optional[float]]]:
+        """Describe a vehicle's tracking state, to be stored after a drain.
+
+        Args:
+            vehicle_id (int): The vehicle.
+
+        Returns:
+            Optional[Tuple[str, TrackPoint, Optional[int], Optional[float]]]: The device and
+                last point seen, and the open trip's ID and the server time it last received a
+                point, both None without an open trip; None if the vehicle was never seen.
+        """
+        seen = self._last_seen.get(vehicle_id)
+        if seen is None:
+            return None
+        state = self._open.get(vehicle_id)
+        if state is None:
+            return seen[1], seen[0], None, None
+        return seen[1], seen[0], state.trip.id, state.observed_at
+
+    def _cells_between(self, start: geo.TrackPoint, end: geo.TrackPoint) -> Set[str]:
+        """Geohash cells along the straight path between two points."""
+        steps = max(1, int(max(abs(end[0] - start[0]), abs(end[1] - start[1])) / self._cell_step))
+        return {geo.geohash_encode(start[0] + (end[0] - start[0]) * i / steps,
+                                   start[1] + (end[1] - start[1]) * i / steps,
+                                   self.geohash_precision) for i in range(steps + 1)}
+
+    def _extend(self, state: _OpenTrip, previous: geo.TrackPoint, point: geo.TrackPoint) -> None:
+        """Fold a point into an open trip."""
+        state.trip.raw_points += 1
+        state.observed_at = time.time()
+        state.new_vertices.extend(state.simplifier.add(point))
+        cells = self._cells_between(previous, point) - state.known_cells
+        state.known_cells |= cells
+        state.new_cells |= cells
+        if geo.distance_m(state.last_moved[0], state.last_moved[1], point[0], point[1]) >= self.min_move_m:
+            state.last_moved = point
+
+    def _close(self, vehicle_id: int) -> None:
+        """Close a vehicle's open trip at its last movement."""
+        state = self._open.pop(vehicle_id)
+        state.new_vertices.extend(state.simplifier.finish())
+        state.trip.status = 'closed'
+        state.trip.ended_at = self._datetime(state.last_moved[2])
+        self._closed.append(state)
+
+    def observe(self, record: VehicleMetricRecord) -> Optional[Trip]:
+        """Fold a stored reading into its vehicle's trips.
+
+        Readings older than the vehicle's last seen point are ignored.
+
+        Args:
+            record (VehicleMetricRecord): The reading, with recorded_at assigned.
+
+        Returns:
+            Optional[Trip]: The trip the reading was folded into, if any; its ID is assigned
+                once the trip is drained and saved.
+        """
+        point = (record.latitude, record.longitude, self._epoch(record.recorded_at))
+        vehicle_id = record.vehicle_id
+        seen = self._last_seen.get(vehicle_id)
+        if seen is not None and point[2] <= seen[0][2]:
+            return None
+        state = self._open.get(vehicle_id)
+        if state is not None and point[2] - state.last_moved[2] > self.idle_gap_seconds:
+            self._close(vehicle_id)
+            state = None
+
+        if state is not None:
+            self._extend(state, seen[0], point)
+        elif (seen is not None and point[2] - seen[0][2] <= self.idle_gap_seconds and
+              geo.distance_m(seen[0][0], seen[0][1], point[0], point[1]) >= self.min_move_m):
+            origin = seen[0]
+            trip = Trip(vehicle_id, record.device_id, self._datetime(origin[2]), raw_points=1)
+            state = self._open[vehicle_id] = _OpenTrip(
+                trip, geo.StreamingSimplifier(self.tolerance_m, self.max_window), origin
+            )
+            state.new_vertices.extend(state.simplifier.add(origin))
+            self._extend(state, origin, point)
+        self._last_seen[vehicle_id] = (point, record.device_id)
+        return state.trip if state is not None else None
+
+    def close_idle(self, vehicle_ids: Optional[Iterable[int]] = None) -> None:
+        """Close the trips of vehicles that stopped reporting for the idle gap.
+
+        Silence is measured on the server clock since each trip last received a point, so
+        replays of old readings are not cut short.
+
+        Args:
+            vehicle_ids (Iterable[int], optional): Only consider these vehicles. Defaults to all.
+        """
+        cutoff = time.time() - self.idle_gap_seconds
+        candidates = self._open if vehicle_ids is None else vehicle_ids
+        for vehicle_id in [vehicle_id for vehicle_id in candidates
+                           if vehicle_id in self._open and self._open[vehicle_id].observed_at < cutoff]:
+            self._close(vehicle_id)
+
+    def drain(self) -> List[Tuple[Trip, List[geo.TrackPoint], Set[str], geo.TrackPoint, geo.TrackPoint]]:
+        """Collect the changes to persist since the last drain.
+
+        Returns:
+            List[Tuple[Trip, List[TrackPoint], Set[str], TrackPoint, TrackPoint]]: For every
+                changed trip, the trip, its new vertices, its new geohash cells, its last raw
+                point and its last moving point. Closed trips are reported once and forgotten.
+        """
+        changes = []
+        for state in self._closed + list(self._open.values()):
+            if state.trip.status == 'closed' or state.new_vertices or state.new_cells or state.trip.id is None:
+                last_point = state.simplifier.last_point
+                changes.append((state.trip, state.new_vertices, state.new_cells, last_point, state.last_moved))
+                state.new_vertices, state.new_cells = [], set()
+        self._closed = []
+        return changes
+
+    @staticmethod
+    def to_upstream_payload(trip: Trip, tolerance_m: float) -> dict:
+        """Build the compact body forwarded to the Bykerz backend for a closed trip.
+
+        The track is sent as an encoded polyline with per-vertex offsets in seconds from the start.
+
+        Args:
+            trip (Trip): The closed trip with all its vertices.
+            tolerance_m (float): Error bound the track was simplified with.
+
+        Returns:
+            dict: The upstream payload.
+        """
+        start = trip.vertices[0][2] if trip.vertices else 0.0
+        return {
+            "vehicleId": trip.vehicle_id,
+            "startedAt": trip.started_at.isoformat() + 'Z',
+            "endedAt": trip.ended_at.isoformat() + 'Z' if trip.ended_at else None,
+            "rawPoints": trip.raw_points,
+            "toleranceMetres": tolerance_m,
+            "polyline": geo.encode_polyline(trip.vertices),
+            "offsetsSeconds": [round(vertex[2] - start) for vertex in trip.vertices]
+        }
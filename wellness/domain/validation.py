@@ -0,0 +1,256 @@
+"""Plausibility checks for incoming vehicle metric readings.
+
+Batches are checked column-wise with NumPy when it is installed; small batches, and
+every batch on devices without NumPy, go through an equivalent pure-Python loop.
+"""
+import math
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy is optional on edge devices
+    np = None
+
+from wellness.domain.entities import VehicleMetricRecord
+
+_EPOCH = datetime(1970, 1, 1)
+_EARTH_RADIUS_KM = 6371.0
+
+
+class MetricPlausibilityValidator:
+    # Physical and sensor limits of each numeric field, inclusive
+    RANGES = {
+        'latitude': (-90.0, 90.0),
+        'longitude': (-180.0, 180.0),
+        'CO2Ppm': (0.0, 100000.0),
+        'NH3Ppm': (0.0, 10000.0),
+        'BenzenePpm': (0.0, 10000.0),
+        'temperatureCelsius': (-40.0, 125.0),
+        'pressureHpa': (300.0, 1100.0),
+    }
+    # Batches smaller than this are checked in pure Python, where NumPy's setup costs more
+    VECTORIZE_MIN_ROWS = 64
+    # Refinement passes of the vectorized jump checks before falling back to the sequential loop
+    MAX_PASSES = 8
+
+    def __init__(self, max_speed_kmh: float, max_rates: Dict[str, float], use_numpy: bool = True):
+        """Initialize the validator.
+
+        Args:
+            max_speed_kmh (float): Fastest plausible movement between consecutive readings.
+            max_rates (Dict[str, float]): Largest plausible change per second of each field.
+            use_numpy (bool, optional): Vectorize large batches when NumPy is available. Defaults to True.
+        """
+        self.max_speed_kmh = max_speed_kmh
+        self.max_rates = max_rates
+        self.use_numpy = use_numpy and np is not None
+        self.fields = tuple(self.RANGES)
+        self._previous: Dict[int, Tuple[float, tuple]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_rates(rates: str) -> Dict[str, float]:
+        """Parse rate-of-change limits written as 'field:max_per_second,...'.
+
+        Args:
+            rates (str): The limits, e.g. 'temperatureCelsius:5,pressureHpa:10'.
+
+        Returns:
+            Dict[str, float]: The limit per field.
+        """
+        limits = {}
+        for rule in filter(None, (part.strip() for part in rates.split(','))):
+            field, limit = rule.split(':')
+            limits[field] = float(limit)
+        return limits
+
+    @staticmethod
+    def _timestamp(record: VehicleMetricRecord) -> float:
+        """Reading time in epoch seconds, NaN when the server will assign it."""
+        if record.recorded_at is None:
+            return math.nan
+        return (record.recorded_at - _EPOCH).total_seconds()
+
+    def validate(self, records: Sequence[VehicleMetricRecord],
+                 pending: Optional[dict] = None) -> Tuple[List[bool], List[Optional[str]]]:
+        """Check a batch of readings in arrival order.
+
+        Each reading must have finite values within RANGES. Readings are also compared
+        with the vehicle's previous accepted reading, from this batch or an earlier one,
+        so a single glitch is rejected without also rejecting the reading after it:
+        movement faster than max_speed_kmh and fields changing faster than their
+        max_rates are rejected. Readings without a device timestamp, or with the same
+        timestamp as the previous one, skip the comparison; the former never become the
+        reference for later readings.
+
+        Args:
+            records (Sequence[VehicleMetricRecord]): The readings.
+            pending (dict, optional): Last accepted reading of each vehicle among readings
+                not stored yet, read before the committed state and updated instead of it;
+                commit() applies it once they are. Defaults to None, which updates the
+                committed state directly.
+
+        Returns:
+            Tuple[List[bool], List[Optional[str]]]: The rejection mask and, per reading,
+                the reason it was rejected or None.
+        """
+        if not records:
+            return [], []
+        with self._lock:
+            if self.use_numpy and len(records) >= self.VECTORIZE_MIN_ROWS:
+                reasons = self._validate_vectorized(records, pending)
+            else:
+                reasons = self._validate_sequential(records, pending)
+        return [reason is not None for reason in reasons], reasons
+
+    def commit(self, pending: dict) -> None:
+        """Make the state validate() left in pending the committed one, once its readings are stored.
+
+        Args:
+            pending (dict): The pending state passed to validate().
+        """
+        with self._lock:
+            self._previous.update(pending)
+
+    def _state(self, vehicle_id: int, pending: Optional[dict]) -> Optional[Tuple[float, tuple]]:
+        """Last accepted reading of a vehicle, pending first; the caller holds the lock."""
+        if pending is not None and vehicle_id in pending:
+            return pending[vehicle_id]
+        return self._previous.get(vehicle_id)
+
+    def _static_reason(self, values: Sequence[float]) -> Optional[str]:
+        """Range and finiteness check of one reading."""
+        for field, value in zip(self.fields, values):
+            if not math.isfinite(value):
+                return f"{field} is not a finite number"
+            low, high = self.RANGES[field]
+            if not low <= value <= high:
+                return f"{field} out of range"
+        return None
+
+    def _jump_reason(self, timestamp: float, values: Sequence[float], previous) -> Optional[str]:
+        """Speed and rate-of-change check of one reading against the previous one."""
+        if previous is None:
+            return None
+        elapsed = timestamp - previous[0]
+        if not elapsed > 0:
+            return None
+        distance = _distance_km(previous[1][0], previous[1][1], values[0], values[1])
+        if distance / (elapsed / 3600.0) > self.max_speed_kmh:
+            return f"GPS jump faster than {self.max_speed_kmh:g} km/h"
+        for index, field in enumerate(self.fields):
+            limit = self.max_rates.get(field)
+            if limit is not None and abs(values[index] - previous[1][index]) / elapsed > limit:
+                return f"{field} changes faster than {limit:g}/s"
+        return None
+
+    def _validate_sequential(self, records: Sequence[VehicleMetricRecord],
+                             pending: Optional[dict]) -> List[Optional[str]]:
+        """Pure-Python implementation of validate; the caller holds the lock."""
+        state = self._previous if pending is None else pending
+        reasons = []
+        for record in records:
+            values = tuple(getattr(record, field) for field in self.fields)
+            reason = self._static_reason(values)
+            if reason is None:
+                timestamp = self._timestamp(record)
+                reason = self._jump_reason(timestamp, values, self._state(record.vehicle_id, pending))
+                if reason is None and not math.isnan(timestamp):
+                    state[record.vehicle_id] = (timestamp, values)
+            reasons.append(reason)
+        return reasons
+
+    def _validate_vectorized(self, records: Sequence[VehicleMetricRecord],
+                             pending: Optional[dict]) -> List[Optional[str]]:
+        """NumPy implementation of validate; the caller holds the lock.
+
+        Jump checks need the previous accepted reading, which depends on earlier jump
+        rejections. They are evaluated against a candidate set of accepted readings that
+        starts as every statically valid one and is refined until it no longer changes;
+        that fixed point is exactly the sequential result. An isolated glitch settles in
+        two or three passes; batches that do not settle fall back to the sequential loop.
+        """
+        count = len(records)
+        values = np.array([[getattr(record, field) for field in self.fields] for record in records], dtype=float)
+        vehicles = np.fromiter((record.vehicle_id for record in records), dtype=np.int64, count=count)
+        timestamps = np.fromiter((self._timestamp(record) for record in records), dtype=float, count=count)
+
+        # Static checks
+        with np.errstate(invalid='ignore'):
+            lows = np.array([self.RANGES[field][0] for field in self.fields])
+            highs = np.array([self.RANGES[field][1] for field in self.fields])
+            static_ok = (np.isfinite(values) & (values >= lows) & (values <= highs)).all(axis=1)
+
+        # Work on rows grouped by vehicle, each group in arrival order
+        order = np.argsort(vehicles, kind='stable')
+        values, vehicles, timestamps, static_ok = values[order], vehicles[order], timestamps[order], static_ok[order]
+        positions = np.arange(count)
+        group_start = np.r_[True, vehicles[1:] != vehicles[:-1]]
+        group_first = np.maximum.accumulate(np.where(group_start, positions, 0))
+        starts = np.flatnonzero(group_start)
+        ends = np.r_[starts[1:], count]
+
+        # Stored previous reading of each row's vehicle, NaN when there is none
+        state_values = np.full((count, len(self.fields)), np.nan)
+        state_times = np.full(count, np.nan)
+        for start, end in zip(starts, ends):
+            state = self._state(int(vehicles[start]), pending)
+            if state is not None:
+                state_times[start:end] = state[0]
+                state_values[start:end] = state[1]
+
+        limits = np.array([self.max_rates.get(field, np.inf) for field in self.fields])
+        timed = ~np.isnan(timestamps)
+        accepted = static_ok
+        for _ in range(self.MAX_PASSES):
+            last = np.maximum.accumulate(np.where(accepted & timed, positions, -1))
+            previous = np.r_[-1, last[:-1]]
+            from_batch = previous >= group_first
+            previous_values = np.where(from_batch[:, None], values[previous], state_values)
+            previous_times = np.where(from_batch, timestamps[previous], state_times)
+
+            elapsed = timestamps - previous_times
+            with np.errstate(invalid='ignore', divide='ignore'):
+                comparable = elapsed > 0
+                mean_latitude = np.radians((values[:, 0] + previous_values[:, 0]) / 2.0)
+                dx = np.radians(values[:, 1] - previous_values[:, 1]) * np.cos(mean_latitude)
+                dy = np.radians(values[:, 0] - previous_values[:, 0])
+                speed = _EARTH_RADIUS_KM * np.hypot(dx, dy) / (elapsed / 3600.0)
+                too_fast = comparable & (speed > self.max_speed_kmh)
+                too_steep = comparable[:, None] & (np.abs(values - previous_values) / elapsed[:, None] > limits)
+            refined = static_ok & ~(too_fast | too_steep.any(axis=1))
+            if np.array_equal(refined, accepted):
+                break
+            accepted = refined
+        else:
+            return self._validate_sequential(records, pending)
+
+        # Remember each vehicle's last accepted reading for the next batch
+        last = np.maximum.accumulate(np.where(accepted & timed, positions, -1))
+        remembered = self._previous if pending is None else pending
+        for start, end in zip(starts, ends):
+            if last[end - 1] >= start:
+                row = last[end - 1]
+                remembered[int(vehicles[row])] = (float(timestamps[row]), tuple(values[row].tolist()))
+
+        reasons: List[Optional[str]] = [None] * count
+        for row in np.flatnonzero(~accepted):
+            if not static_ok[row]:
+                reason = self._static_reason(values[row].tolist())
+            elif too_fast[row]:
+                reason = f"GPS jump faster than {self.max_speed_kmh:g} km/h"
+            else:
+                field = int(np.argmax(too_steep[row]))
+                reason = f"{self.fields[field]} changes faster than {limits[field]:g}/s"
+            reasons[order[row]] = reason
+        return reasons
+
+
+def _distance_km(latitude1: float, longitude1: float, latitude2: float, longitude2: float) -> float:
+    """Equirectangular distance between two nearby coordinates, in kilometres."""
+    mean_latitude = math.radians((latitude1 + latitude2) / 2.0)
+    dx = math.radians(longitude2 - longitude1) * math.cos(mean_latitude)
+    dy = math.radians(latitude2 - latitude1)
+    return _EARTH_RADIUS_KM * math.hypot(dx, dy)
@@ -0,0 +1,92 @@
+"""
+Compact binary encoding of vehicle metric readings for constrained devices.
+
+A frame carries one or more readings from a single device:
+
+    header   '<4sBBH'  magic b'BKZM', format version, flags (reserved, 0), record count
+    device   'B' + n   device_id length followed by its UTF-8 bytes
+    records  count fixed-size little-endian records laid out by the version
+
+Version 1 records ('<QIddfffffB', 49 bytes) hold recorded_at as epoch milliseconds
+(0 means "use the server time"), vehicle_id, latitude, longitude, CO2Ppm, NH3Ppm,
+BenzenePpm, temperatureCelsius, pressureHpa and a flags byte whose bit 0 is impactDetected.
+New layouts are added as new versions; decoders keep accepting the old ones.
+"""
+import struct
+from typing import Iterable, Iterator, Tuple
+
+CONTENT_TYPE = 'application/vnd.bykerz.metrics'
+MAGIC = b'BKZM'
+CURRENT_VERSION = 1
+
+HEADER = struct.Struct('<4sBBH')
+RECORD_LAYOUTS = {
+    1: struct.Struct('<QIddfffffB'),
+}
+# Record fields of every layout, in packing order
+RECORD_FIELDS = (
+    'recorded_at', 'vehicle_id', 'latitude', 'longitude', 'CO2Ppm', 'NH3Ppm', 'BenzenePpm',
+    'temperatureCelsius', 'pressureHpa', 'flags'
+)
+FLAG_IMPACT = 0x01
+MAX_RECORDS = 0xFFFF
+
+
+class BinaryFormatError(ValueError):
+    """Raised when a binary metrics frame is malformed."""
+
+
+def encode_frame(device_id: str, readings: Iterable[dict], version: int = CURRENT_VERSION) -> bytes:
+    """
+    Reference encoder: pack readings, given with the JSON field names, into one frame.
+    :param device_id: The device sending the readings.
+    :param readings: Dictionaries with vehicle_id, latitude, longitude, CO2Ppm, NH3Ppm,
+        BenzenePpm, temperatureCelsius, pressureHpa, impactDetected and an optional
+        recorded_at in epoch milliseconds.
+    :param version: Record layout version.
+    :return: The encoded frame.
+    """
+    layout = RECORD_LAYOUTS[version]
+    device = device_id.encode('utf-8')
+    body = bytearray()
+    count = 0
+    for reading in readings:
+        body += layout.pack(
+            int(reading.get('recorded_at') or 0), reading['vehicle_id'],
+            reading['latitude'], reading['longitude'],
+            reading['CO2Ppm'], reading['NH3Ppm'], reading['BenzenePpm'],
+            reading['temperatureCelsius'], reading['pressureHpa'],
+            FLAG_IMPACT if reading['impactDetected'] else 0
+        )
+        count += 1
+    if count > MAX_RECORDS:
+        raise BinaryFormatError(f"A frame holds at most {MAX_RECORDS} records")
+    return HEADER.pack(MAGIC, version, 0, count) + bytes([len(device)]) + device + bytes(body)
+
+
+def decode_frame(body: bytes) -> Tuple[str, int, Iterator[tuple]]:
+    """
+    Decode a frame without copying its record section.
+    :param body: The raw request body.
+    :return: A tuple of the device_id, the record count and an iterator of raw record
+        tuples in RECORD_FIELDS order.
+    :raises BinaryFormatError: If the header, version or length is invalid.
+    """
+    view = memoryview(body)
+    if len(view) < HEADER.size + 1:
+        raise BinaryFormatError("Truncated header")
+    magic, version, _, count = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise BinaryFormatError("Bad magic")
+    layout = RECORD_LAYOUTS.get(version)
+    if layout is None:
+        raise BinaryFormatError(f"Unsupported version {version}")
+    offset = HEADER.size + 1
+    device_end = offset + view[HEADER.size]
+    try:
+        device_id = str(view[offset:device_end], 'utf-8')
+    except UnicodeDecodeError:
+        raise BinaryFormatError("Invalid device_id")
+    if len(view) - device_end != count * layout.size:
+        raise BinaryFormatError(f"Expected {count} records of {layout.size} bytes")
+    return device_id, count, layout.iter_unpack(view[device_end:])
@@ -0,0 +1,175 @@
+"""
+Compressed column encoding of archived vehicle metric records.
+
+A segment holds up to a few thousand records of one vehicle, stored column by column so
+a query only decompresses the columns it projects. Every column is an array of 8-byte
+little-endian values, except booleans and strings, encoded as follows before zlib:
+
+    delta   integers (IDs, timestamps in epoch microseconds): differences from the
+            previous value, which are small and repetitive for consecutive readings
+    xor     floats: the IEEE 754 bits XORed with the previous value's, which leaves
+            mostly zero bytes for slowly changing sensor readings
+    bool    one byte per value
+    dict    strings: the distinct values as JSON, followed by one uint32 index per value
+
+The bytes of delta and xor arrays are regrouped by position (all first bytes, then all
+second bytes...) so the zero high bytes form long runs zlib compresses well.
+"""
+import json
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Dict, List, Sequence, Tuple
+
+DELTA = 'delta'
+XOR = 'xor'
+BOOL = 'bool'
+DICT = 'dict'
+
+EPOCH = datetime(1970, 1, 1)
+_DICT_HEADER = struct.Struct('<I')
+
+
+def to_micros(timestamp: datetime) -> int:
+    """
+    Convert a naive UTC datetime to epoch microseconds.
+    :param timestamp: The datetime.
+    :return: Microseconds since the epoch.
+    """
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_micros(micros: int) -> datetime:
+    """
+    Convert epoch microseconds back to a naive UTC datetime.
+    :param micros: Microseconds since the epoch.
+    :return: The datetime.
+    """
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def encoding_for(kind: type) -> str:
+    """
+    Choose the encoding of a column from the type of its values.
+    :param kind: int, float, bool or str.
+    :return: The encoding name.
+    """
+    if kind is bool:
+        return BOOL
+    if kind is int:
+        return DELTA
+    if kind is float:
+        return XOR
+    return DICT
+
+
+def _little_endian(values: array) -> array:
+    """Byte-swap an array in place on big-endian hosts."""
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _shuffle(data: bytes, width: int = 8) -> bytes:
+    """Group the bytes of fixed-width values by position."""
+    return b''.join(data[position::width] for position in range(width))
+
+
+def _unshuffle(data: bytes, width: int = 8) -> bytes:
+    """Undo _shuffle."""
+    count = len(data) // width
+    output = bytearray(len(data))
+    for position in range(width):
+        output[position::width] = data[position * count:(position + 1) * count]
+    return bytes(output)
+
+
+def encode_column(values: Sequence, encoding: str) -> bytes:
+    """
+    Encode one column.
+    :param values: The column values, in row order.
+    :param encoding: delta, xor, bool or dict.
+    :return: The compressed column.
+    """
+    if encoding == DELTA:
+        deltas = array('q', (value - previous for previous, value in zip([0] + list(values[:-1]), values)))
+        raw = _shuffle(_little_endian(deltas).tobytes())
+    elif encoding == XOR:
+        bits = array('Q')
+        bits.frombytes(array('d', values).tobytes())
+        xored = array('Q', (value ^ previous for previous, value in zip([0] + list(bits[:-1]), bits)))
+        raw = _shuffle(_little_endian(xored).tobytes())
+    elif encoding == BOOL:
+        raw = bytes(bool(value) for value in values)
+    else:
+        distinct = list(dict.fromkeys(values))
+        positions = {value: index for index, value in enumerate(distinct)}
+        header = json.dumps(distinct).encode('utf-8')
+        indexes = _little_endian(array('I', (positions[value] for value in values)))
+        raw = _DICT_HEADER.pack(len(header)) + header + indexes.tobytes()
+    return zlib.compress(raw)
+
+
+def decode_column(data: bytes, encoding: str) -> list:
+    """
+    Decode one column.
+    :param data: The compressed column.
+    :param encoding: The encoding it was written with.
+    :return: The column values, in row order.
+    """
+    raw = zlib.decompress(data)
+    if encoding == DELTA:
+        deltas = array('q')
+        deltas.frombytes(_unshuffle(raw))
+        return list(accumulate(_little_endian(deltas)))
+    if encoding == XOR:
+        xored = array('Q')
+        xored.frombytes(_unshuffle(raw))
+        bits = array('Q', accumulate(_little_endian(xored), lambda previous, value: previous ^ value))
+        floats = array('d')
+        floats.frombytes(bits.tobytes())
+        return floats.tolist()
+    if encoding == BOOL:
+        return [bool(value) for value in raw]
+    (length,) = _DICT_HEADER.unpack_from(raw)
+    distinct = json.loads(raw[_DICT_HEADER.size:_DICT_HEADER.size + length].decode('utf-8'))
+    indexes = array('I')
+    indexes.frombytes(raw[_DICT_HEADER.size + length:])
+    return [distinct[index] for index in _little_endian(indexes)]
+
+
+def encode_segment(columns: Dict[str, Tuple[str, Sequence]]) -> Tuple[dict, dict, bytes]:
+    """
+    Encode the columns of one segment.
+    :param columns: (encoding, values) of each column, every column having the same length.
+    :return: The layout mapping each column to its (encoding, offset, length) in the data,
+        the [min, max] of every numeric column, and the concatenated compressed columns.
+    """
+    layout, ranges, parts, offset = {}, {}, [], 0
+    for name, (encoding, values) in columns.items():
+        encoded = encode_column(values, encoding)
+        layout[name] = (encoding, offset, len(encoded))
+        if encoding != DICT and values:
+            ranges[name] = [min(values), max(values)]
+        parts.append(encoded)
+        offset += len(encoded)
+    return layout, ranges, b''.join(parts)
+
+
+def decode_segment(layout: dict, data: bytes, names: Sequence[str]) -> List[list]:
+    """
+    Decode selected columns of one segment.
+    :param layout: The layout returned by encode_segment.
+    :param data: The concatenated compressed columns.
+    :param names: The columns to decode.
+    :return: The values of each requested column, in the order requested.
+    """
+    columns = []
+    for name in names:
+        encoding, offset, length = layout[name]
+        columns.append(decode_column(data[offset:offset + length], encoding))
+    return columns
@@ -0,0 +1,374 @@
+"""
+Background delivery of queued vehicle metric records to the Bykerz backend.
+"""
+import gzip
+import json
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, List, Optional
+
+import requests
+
+from iam.infrastructure.repositories import DeviceRepository
+from shared.infrastructure import config
+from shared.infrastructure.backend_client import BackendClient, BackendUnavailable, create_pooled_session
+from shared.infrastructure.database import db
+from wellness.domain.entities import MetricForwardingState
+from wellness.domain.services import ForwardingRetryPolicy
+from wellness.infrastructure.models import utc_now
+from wellness.infrastructure.repositories import MetricOutboxRepository
+
+logger = logging.getLogger(__name__)
+
+
+class ForwardingLatencyTracker:
+    """
+    Tracks how long deliveries wait between being queued and being accepted upstream,
+    against a latency service-level objective.
+    """
+    def __init__(self, slo_seconds: Optional[float] = None, window: int = 1000):
+        """
+        Initialize the tracker.
+        :param slo_seconds: Target end-to-end forwarding latency; None disables SLO accounting.
+        :param window: Number of recent latencies kept for percentiles.
+        """
+        self.slo_seconds = slo_seconds
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.delivered = 0
+        self.slo_violations = 0
+
+    def record(self, latency: float) -> None:
+        """
+        Record the latency of one delivered record.
+        :param latency: Seconds from enqueue to upstream acceptance.
+        :return: None
+        """
+        with self._lock:
+            self._recent.append(latency)
+            self.delivered += 1
+            if self.slo_seconds is not None and latency > self.slo_seconds:
+                self.slo_violations += 1
+
+    def stats(self) -> dict:
+        """
+        Summarize recent latencies.
+        :return: A dictionary with delivered, slo_seconds, slo_violations, p50, p99 and max.
+        """
+        with self._lock:
+            recent = sorted(self._recent)
+            delivered, violations = self.delivered, self.slo_violations
+
+        def percentile(fraction: float) -> Optional[float]:
+            return recent[min(int(fraction * len(recent)), len(recent) - 1)] if recent else None
+
+        return {
+            "delivered": delivered,
+            "slo_seconds": self.slo_seconds,
+            "slo_violations": violations,
+            "p50_seconds": percentile(0.50),
+            "p99_seconds": percentile(0.99),
+            "max_seconds": recent[-1] if recent else None
+        }
+
+
+class OutboxForwarder:
+    """
+    Worker thread that drains the metric outbox and posts records upstream.
+
+    By default every record is posted on its own as a JSON object, as the backend's
+    metrics endpoint expects. With batching enabled, due records are claimed once a full
+    batch is available or the oldest of them has waited long enough, grouped per device
+    token and sent as one JSON array, gzip-compressed if configured, to the batch
+    endpoint; if the backend answers that endpoint with 404 or 415, the forwarder falls
+    back to posting records one by one. Requests go over a pooled keep-alive session.
+    Failed deliveries are rescheduled with
+    exponential backoff until the retry policy gives up, so a slow or unavailable
+    backend never blocks ingestion. While the shared backend circuit breaker is open
+    nothing is claimed, and deliveries turned away by it are deferred without using up
+    an attempt.
+
+    Each forwarder drains a single priority lane of the outbox. The critical lane runs as
+    a separate instance with its own thread, session and shorter timings, and can be woken
+    immediately through notify() instead of waiting for its next poll.
+    """
+    # Answers of a backend without the batch endpoint, or without gzip request bodies
+    BATCH_UNSUPPORTED_STATUSES = (404, 415)
+
+    def __init__(self, api_url: str = None, poll_interval: float = None, claim_size: int = None,
+                 lease_seconds: float = None, retry_policy: ForwardingRetryPolicy = None,
+                 batching: bool = None, batch_size: int = None, batch_max_age: float = None,
+                 compress: bool = None, session: requests.Session = None, priority: int = 0, timeout: float = None,
+                 slo_seconds: float = None, name: str = 'metric-outbox-forwarder'):
+        """
+        Initialize the forwarder.
+        :param api_url: The backend batch metrics endpoint; single records go to
+        FORWARDER_METRICS_PATH and completed trips to FORWARDER_TRIPS_PATH.
+        :param poll_interval: Seconds to sleep when the outbox has nothing due.
+        :param claim_size: Maximum number of deliveries claimed per round.
+        :param lease_seconds: How long a claimed delivery is reserved for this worker.
+        :param retry_policy: Backoff policy for failed deliveries.
+        :param batching: Whether metric records are sent in batches to the batch endpoint.
+        :param batch_size: Records per upstream request; a full batch is flushed immediately.
+        :param batch_max_age: Seconds a due record may wait for its batch to fill.
+        :param compress: Whether batch request bodies are gzip-compressed.
+        :param session: HTTP session used for upstream calls.
+        :param priority: Outbox lane drained by this forwarder.
+        :param timeout: Upper bound for the adaptive timeout of each request.
+        :param slo_seconds: Target enqueue-to-delivery latency tracked for this lane.
+        :param name: Name of the worker thread.
+        """
+        self.api_url = api_url or f"{config.BACKEND_BASE_URL}{config.FORWARDER_BATCH_PATH}"
+        # Endpoint of each topic for payloads posted one by one
+        self.topic_urls = {
+            'metrics': f"{config.BACKEND_BASE_URL}{config.FORWARDER_METRICS_PATH}",
+            'trips': f"{config.BACKEND_BASE_URL}{config.FORWARDER_TRIPS_PATH or '/trips'}"
+        }
+        self.batching = batching if batching is not None else config.FORWARDER_BATCHING
+        self.poll_interval = poll_interval if poll_interval is not None else config.OUTBOX_POLL_INTERVAL_SECONDS
+        self.claim_size = claim_size or config.OUTBOX_CLAIM_SIZE
+        self.lease_seconds = lease_seconds or config.OUTBOX_LEASE_SECONDS
+        self.retry_policy = retry_policy or ForwardingRetryPolicy(
+            config.OUTBOX_RETRY_BASE_SECONDS,
+            config.OUTBOX_RETRY_MAX_SECONDS,
+            config.OUTBOX_MAX_ATTEMPTS
+        )
+        self.batch_size = batch_size or config.FORWARDER_BATCH_SIZE
+        self.batch_max_age = batch_max_age if batch_max_age is not None else config.FORWARDER_BATCH_MAX_AGE_SECONDS
+        self.compress = compress if compress is not None else config.FORWARDER_GZIP
+        self.session = session or create_pooled_session(config.FORWARDER_POOL_SIZE)
+        self.backend = BackendClient(self.session)
+        self.priority = priority
+        self.timeout = timeout or config.BACKEND_TIMEOUT_SECONDS
+        self.name = name
+        self.latency = ForwardingLatencyTracker(slo_seconds)
+        self.outbox_repository = MetricOutboxRepository()
+        self.device_repository = DeviceRepository()
+        self.delivery_listeners: List[Callable[[List[int]], None]] = []
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def for_critical_events(cls) -> 'OutboxForwarder':
+        """
+        Build the forwarder of the critical lane, configured from the PRIORITY_* settings.
+        :return: The critical-lane forwarder.
+        """
+        return cls(
+            poll_interval=config.PRIORITY_FORWARDER_POLL_INTERVAL_SECONDS,
+            retry_policy=ForwardingRetryPolicy(
+                config.PRIORITY_RETRY_BASE_SECONDS,
+                config.PRIORITY_RETRY_MAX_SECONDS,
+                config.OUTBOX_MAX_ATTEMPTS
+            ),
+            batch_size=config.PRIORITY_FORWARDER_BATCH_SIZE,
+            batch_max_age=0.0,
+            session=create_pooled_session(1),
+            priority=1,
+            timeout=config.PRIORITY_FORWARDER_TIMEOUT_SECONDS,
+            slo_seconds=config.PRIORITY_FORWARDING_SLO_SECONDS,
+            name='metric-priority-forwarder'
+        )
+
+    def start(self) -> None:
+        """
+        Start the background worker thread if it is not already running.
+        :return: None
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Signal the worker to stop and wait for it to finish its current round.
+        :param timeout: Seconds to wait for the thread to exit.
+        :return: None
+        """
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.session.close()
+
+    def add_delivery_listener(self, listener: Callable[[List[int]], None]) -> None:
+        """
+        Register a callback run with the record IDs of every metric batch the backend accepted.
+        :param listener: The callback.
+        :return: None
+        """
+        self.delivery_listeners.append(listener)
+
+    def notify(self) -> None:
+        """
+        Wake the worker so it drains its lane without waiting for the next poll.
+        :return: None
+        """
+        self._wake_event.set()
+
+    def stats(self) -> dict:
+        """
+        Report the lane served by this forwarder and its delivery latency.
+        :return: A dictionary with the lane's name, priority and latency statistics.
+        """
+        return dict(self.latency.stats(), name=self.name, priority=self.priority)
+
+    def _run(self) -> None:
+        """
+        Worker loop: drain due deliveries, then sleep until the next poll.
+        :return: None
+        """
+        while not self._stop_event.is_set():
+            try:
+                delivered = self.drain_once()
+            except Exception:
+                logger.exception("Metric outbox drain failed")
+                delivered = 0
+            if delivered == 0:
+                self._wake_event.wait(self.poll_interval)
+                self._wake_event.clear()
+
+    def drain_once(self, force: bool = False) -> int:
+        """
+        Claim one round of due deliveries and send them in per-device, per-topic batches.
+        :param force: Flush whatever is due without waiting for a full batch.
+        :return: The number of deliveries attempted.
+        """
+        if self.backend.breaker.retry_after() > 0:
+            return 0
+        with db.connection_context():
+            accumulate = self.batching and not force
+            entries = self.outbox_repository.claim_due(
+                self.claim_size, self.lease_seconds,
+                min_count=self.batch_size if accumulate else 1,
+                max_wait_seconds=self.batch_max_age if accumulate else 0.0,
+                priority=self.priority
+            )
+            by_device = OrderedDict()
+            for entry in entries:
+                by_device.setdefault((entry.device_id, entry.topic), []).append(entry)
+            for (device_id, topic), device_entries in by_device.items():
+                for start in range(0, len(device_entries), self.batch_size):
+                    self._deliver(device_id, device_entries[start:start + self.batch_size], topic)
+        return len(entries)
+
+    def _encode(self, entries: List[MetricForwardingState], batch: bool) -> tuple:
+        """
+        Serialize deliveries into an upstream request body.
+        :param entries: The deliveries; a single one unless batched.
+        :param batch: Send them as a JSON array to the batch endpoint, rather than one JSON object.
+        :return: A tuple of the body bytes and the request headers.
+        """
+        payload = [entry.payload for entry in entries] if batch else entries[0].payload
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        headers = {"Content-Type": "application/json"}
+        if batch and self.compress:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        return body, headers
+
+    def _deliver(self, device_id: str, entries: List[MetricForwardingState], topic: str = 'metrics') -> None:
+        """
+        Post queued records of one device to the backend, in a batch or one by one, and
+        record the outcomes.
+        :param device_id: The device whose token authenticates the requests.
+        :param entries: The claimed deliveries for that device.
+        :param topic: Kind of the deliveries, which selects the backend endpoint.
+        :return: None
+        """
+        device = self.device_repository.find_by_id(device_id)
+        if device is None:
+            self._reschedule(entries, None, "Device not registered", give_up=True)
+            return
+
+        unsent = entries
+        try:
+            if self.batching and topic == 'metrics':
+                status_code = self._send(device.api_key, entries, topic, batch=True)
+                if status_code not in self.BATCH_UNSUPPORTED_STATUSES:
+                    return
+                logger.warning("Backend answered %s to a metric batch; forwarding records one by one",
+                               status_code)
+                self.batching = False
+            for index, entry in enumerate(entries):
+                unsent = entries[index:]
+                self._send(device.api_key, [entry], topic, batch=False)
+        except BackendUnavailable as e:
+            self._defer(unsent, e.retry_after, str(e))
+
+    def _send(self, api_key: str, entries: List[MetricForwardingState], topic: str,
+              batch: bool) -> Optional[int]:
+        """
+        Post one request and record its outcome, except for a batch the backend does not
+        accept, which is left claimed for the caller to resend.
+        :param api_key: The device token authenticating the request.
+        :param entries: The deliveries in the request.
+        :param topic: Kind of the deliveries, which selects the backend endpoint.
+        :param batch: Send them as one batch to the batch endpoint.
+        :return: The HTTP status of the answer, or None if none was received.
+        :raises BackendUnavailable: If the circuit breaker is open; nothing is recorded.
+        """
+        body, headers = self._encode(entries, batch)
+        headers["Authorization"] = f"Bearer {api_key}"
+        url = self.api_url if batch else self.topic_urls[topic]
+        try:
+            response = self.backend.post(f"{topic}_batch" if batch else topic, url, timeout=self.timeout,
+                                         data=body, headers=headers)
+        except BackendUnavailable:
+            raise
+        except requests.RequestException as e:
+            self._reschedule(entries, None, str(e))
+            return None
+
+        if batch and response.status_code in self.BATCH_UNSUPPORTED_STATUSES:
+            return response.status_code
+        if 200 <= response.status_code < 300:
+            self.outbox_repository.mark_sent([entry.outbox_id for entry in entries], response.status_code)
+            now = utc_now()
+            for entry in entries:
+                self.latency.record((now - entry.created_at).total_seconds())
+            if topic == 'metrics':
+                record_ids = [entry.record_id for entry in entries]
+                for listener in self.delivery_listeners:
+                    listener(record_ids)
+        else:
+            self._reschedule(entries, response.status_code, response.text[:500])
+        return response.status_code
+
+    def _defer(self, entries: List[MetricForwardingState], delay: float, error: str) -> None:
+        """
+        Postpone a batch that was not sent, keeping its attempt count.
+        :param entries: The deliveries in the batch.
+        :param delay: Seconds until they are due again.
+        :param error: Why they were not sent.
+        :return: None
+        """
+        with db.atomic():
+            for entry in entries:
+                self.outbox_repository.mark_failed_attempt(entry.outbox_id, entry.attempts, None, error, delay)
+
+    def _reschedule(self, entries: List[MetricForwardingState], status_code: Optional[int], error: str,
+                    give_up: bool = False) -> None:
+        """
+        Schedule retries for a failed batch, or give up according to the retry policy.
+        :param entries: The deliveries in the failed batch.
+        :param status_code: HTTP status returned by the backend, if any.
+        :param error: Description of the failure.
+        :param give_up: Mark the deliveries as failed without consulting the retry policy.
+        :return: None
+        """
+        with db.atomic():
+            for entry in entries:
+                attempts = entry.attempts + 1
+                if give_up or self.retry_policy.should_give_up(attempts, status_code):
+                    retry_delay = None
+                    logger.warning("Giving up forwarding record %s after %s attempts: %s",
+                                   entry.record_id, attempts, error)
+                else:
+                    retry_delay = self.retry_policy.next_delay(attempts)
+                self.outbox_repository.mark_failed_attempt(entry.outbox_id, attempts, status_code,
+                                                           error, retry_delay)
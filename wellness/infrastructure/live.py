@@ -0,0 +1,254 @@
+"""
+In-memory latest readings of every vehicle, for dashboards and live streams.
+
+Stored records are published here after their transaction commits; reads are served
+from memory only. In single-writer deployments the cache lives in the writer process, which
+commits every reading, and request workers query it through WriterReadingsCache.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from shared.infrastructure.writer_process import WriterClient
+from wellness.domain.entities import VehicleMetricRecord
+from wellness.domain.schema import METRIC_SCHEMA
+
+
+class _VehicleReadings:
+    """Recent readings of one vehicle and the latest reading of each of its devices."""
+    __slots__ = ('recent', 'latest', 'devices')
+
+    def __init__(self, history: int):
+        self.recent = deque(maxlen=history)
+        self.latest: Optional[Tuple[datetime, dict]] = None
+        self.devices: Dict[str, Tuple[datetime, dict]] = {}
+
+
+class LatestReadingsCache:
+    """
+    Per-vehicle ring buffer of recent readings with the latest one kept apart.
+
+    Every published reading gets a sequence number, increasing across all vehicles, which
+    live streams use as their event ID to resume without gaps while the reading is still
+    in the ring buffer. The latest reading is the one with the highest recorded_at, so a
+    late upload of old readings does not replace the current state. At most max_vehicles
+    vehicles are tracked, least recently updated first out.
+    """
+    def __init__(self, history: int, max_vehicles: int):
+        """
+        Initialize the cache.
+        :param history: Readings kept per vehicle.
+        :param max_vehicles: Vehicles tracked.
+        """
+        self.history = history
+        self.max_vehicles = max_vehicles
+        self._vehicles: 'OrderedDict[int, _VehicleReadings]' = OrderedDict()
+        self._sequence = 0
+        self._changed = threading.Condition()
+        self.published = 0
+
+    def publish(self, records: List[VehicleMetricRecord], total: Optional[int] = None) -> None:
+        """
+        Add stored records and wake the streams waiting for them.
+        :param records: Records with their IDs and recorded_at assigned.
+        :param total: Records committed, when older ones the cache would not keep were left
+            out of records (see PendingReadings). Defaults to len(records).
+        :return: None
+        """
+        if not records:
+            return
+        readings = [METRIC_SCHEMA.to_response(record) for record in records]
+        with self._changed:
+            for record, reading in zip(records, readings):
+                self._sequence += 1
+                vehicle_id = record.vehicle_id
+                vehicle = self._vehicles.get(vehicle_id)
+                if vehicle is None:
+                    vehicle = self._vehicles[vehicle_id] = _VehicleReadings(self.history)
+                    if len(self._vehicles) > self.max_vehicles:
+                        self._vehicles.popitem(last=False)
+                else:
+                    self._vehicles.move_to_end(vehicle_id)
+                vehicle.recent.append((self._sequence, reading))
+                if vehicle.latest is None or record.recorded_at >= vehicle.latest[0]:
+                    vehicle.latest = (record.recorded_at, reading)
+                device = vehicle.devices.get(record.device_id)
+                if device is None or record.recorded_at >= device[0]:
+                    vehicle.devices[record.device_id] = (record.recorded_at, reading)
+            self.published += len(records) if total is None else total
+            self._changed.notify_all()
+
+    def snapshot(self, vehicle_id: int, count: int) -> Optional[dict]:
+        """
+        Read a vehicle's current state.
+        :param vehicle_id: The vehicle.
+        :param count: Recent readings to include, newest last.
+        :return: The latest reading, the latest reading per device, the recent readings and
+            the sequence number to resume a stream from, or None if the vehicle is unknown.
+        """
+        with self._changed:
+            vehicle = self._vehicles.get(vehicle_id)
+            if vehicle is None:
+                return None
+            recent = list(vehicle.recent)[-count:] if count > 0 else []
+            return {
+                "latest": vehicle.latest[1],
+                "devices": {device_id: reading for device_id, (_, reading) in vehicle.devices.items()},
+                "recent": [reading for _, reading in recent],
+                "sequence": vehicle.recent[-1][0]
+            }
+
+    def wait(self, vehicle_id: int, after: int, timeout: float) -> List[Tuple[int, dict]]:
+        """
+        Wait for readings of a vehicle published after a sequence number.
+        :param vehicle_id: The vehicle.
+        :param after: Sequence number of the last reading already seen.
+        :param timeout: Seconds to wait when there is none yet.
+        :return: The (sequence, reading) pairs still in the ring buffer, oldest first;
+            empty on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                entries = self._after(vehicle_id, after)
+                remaining = deadline - time.monotonic()
+                if entries or remaining <= 0:
+                    return entries
+                self._changed.wait(remaining)
+
+    def _after(self, vehicle_id: int, after: int) -> List[Tuple[int, dict]]:
+        """Readings of a vehicle newer than a sequence number; the caller holds the lock."""
+        vehicle = self._vehicles.get(vehicle_id)
+        if vehicle is None or not vehicle.recent or vehicle.recent[-1][0] <= after:
+            return []
+        return [entry for entry in vehicle.recent if entry[0] > after]
+
+    @property
+    def sequence(self) -> int:
+        """Sequence number of the last published reading."""
+        with self._changed:
+            return self._sequence
+
+    def stats(self) -> dict:
+        """
+        Report the cache size and counters.
+        :return: A dictionary with tracked_vehicles, history, published and sequence.
+        """
+        with self._changed:
+            return {
+                "tracked_vehicles": len(self._vehicles),
+                "history": self.history,
+                "published": self.published,
+                "sequence": self._sequence
+            }
+
+    def answer(self, request: tuple) -> Any:
+        """
+        Answer a WriterReadingsCache query, in the writer process.
+        :param request: The method name, 'snapshot', 'wait', 'sequence' or 'stats', followed by its arguments.
+        :return: The method's result.
+        :raises ValueError: If the request names another method.
+        """
+        name, arguments = request[0], request[1:]
+        if name == 'sequence':
+            return self.sequence
+        if name not in ('snapshot', 'wait', 'stats'):
+            raise ValueError(f"Unknown live readings query: {name}")
+        return getattr(self, name)(*arguments)
+
+
+class PendingReadings:
+    """
+    Records stored by a transaction still open, to publish once it commits.
+
+    Only what a LatestReadingsCache keeps is retained: each vehicle's last history records
+    and the latest record of each device, so memory does not grow with the transaction.
+    """
+    def __init__(self, history: int):
+        """
+        Initialize an empty set of pending records.
+        :param history: Readings the cache keeps per vehicle.
+        """
+        self.history = history
+        self.count = 0
+        self._recent: Dict[int, deque] = {}
+        self._devices: Dict[Tuple[int, str], VehicleMetricRecord] = {}
+
+    def add(self, records: List[VehicleMetricRecord]) -> None:
+        """
+        Retain stored records until the transaction commits.
+        :param records: Records with their IDs and recorded_at assigned.
+        :return: None
+        """
+        for record in records:
+            recent = self._recent.get(record.vehicle_id)
+            if recent is None:
+                recent = self._recent[record.vehicle_id] = deque(maxlen=self.history)
+            recent.append(record)
+            key = (record.vehicle_id, record.device_id)
+            latest = self._devices.get(key)
+            if latest is None or record.recorded_at >= latest.recorded_at:
+                self._devices[key] = record
+        self.count += len(records)
+
+    def records(self) -> List[VehicleMetricRecord]:
+        """
+        List the retained records in the order to publish them: the devices' latest records
+        that fell out of the recent ones first, then each vehicle's recent records.
+        :return: The records.
+        """
+        recent = [record for records in self._recent.values() for record in records]
+        kept = {id(record) for record in recent}
+        return [record for record in self._devices.values() if id(record) not in kept] + recent
+
+
+class WriterReadingsCache:
+    """
+    Request worker's view of the writer process's LatestReadingsCache.
+
+    Each worker only sees the readings it hands to the writer, and not even those when they
+    are fire-and-forget, so every read is answered by the writer instead. Publishing is left
+    to the writer, which commits the readings.
+    """
+    def __init__(self, writer: WriterClient):
+        """
+        Initialize the view.
+        :param writer: Client of the writer process.
+        """
+        self.writer = writer
+
+    def publish(self, records: List[VehicleMetricRecord]) -> None:
+        """
+        Nothing to do: the writer publishes the records it commits.
+        :param records: Records with their IDs and recorded_at assigned.
+        :return: None
+        """
+
+    def snapshot(self, vehicle_id: int, count: int) -> Optional[dict]:
+        """
+        Read a vehicle's current state, see LatestReadingsCache.snapshot.
+        :raises WriterUnavailable: If the writer process cannot be reached.
+        """
+        return self.writer.query(('snapshot', vehicle_id, count))
+
+    def wait(self, vehicle_id: int, after: int, timeout: float) -> List[Tuple[int, dict]]:
+        """
+        Wait for readings of a vehicle, see LatestReadingsCache.wait; this thread's writer
+        connection is busy until the writer answers.
+        :raises WriterUnavailable: If the writer process cannot be reached.
+        """
+        return self.writer.query(('wait', vehicle_id, after, timeout))
+
+    @property
+    def sequence(self) -> int:
+        """Sequence number of the last reading the writer published."""
+        return self.writer.query(('sequence',))
+
+    def stats(self) -> dict:
+        """
+        Report the writer's cache size and counters, see LatestReadingsCache.stats.
+        :raises WriterUnavailable: If the writer process cannot be reached.
+        """
+        return self.writer.query(('stats',))
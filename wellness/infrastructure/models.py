@@ -1,12 +1,20 @@
-from peewee import Model, AutoField, CharField, FloatField, BooleanField
+from datetime import datetime, timezone
+
+from peewee import Model, AutoField, CharField, FloatField, BooleanField, IntegerField, TextField, DateTimeField, SQL, \
+    BlobField
 
 from shared.infrastructure.database import db
 
 
+def utc_now() -> datetime:
+    """Current UTC time as a naive datetime, the form timestamps are stored in."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class VehicleMetricRecord(Model):
     id =AutoField()
     device_id = CharField()
-    vehicle_id = FloatField()
+    vehicle_id = IntegerField()
     latitude = FloatField()
     longitude = FloatField()
     CO2Ppm = FloatField()
@@ -15,7 +23,307 @@ class VehicleMetricRecord(Model):
     temperatureCelsius = FloatField()
     pressureHpa = FloatField()
     impactDetected = BooleanField()
+    recorded_at = DateTimeField(default=utc_now)
+
+    class Meta:
+        database = db
+        table_name = 'vehicle_metric_records'
+        indexes = (
+            (('vehicle_id', 'recorded_at'), False),
+            (('device_id', 'recorded_at'), False),
+        )
+
+
+# Record models bound to partition tables, by table name
+_partition_models = {}
+
+
+def partition_model(table_name: str) -> type:
+    """
+    Model of a partition table, with the columns and indexes of vehicle_metric_records.
+    :param table_name: The partition's table name.
+    :return: The model class, created on first use.
+    """
+    model = _partition_models.get(table_name)
+    if model is None:
+        meta = type('Meta', (), {'table_name': table_name})
+        model = _partition_models.setdefault(table_name, type(
+            f"VehicleMetricRecord_{table_name}", (VehicleMetricRecord,), {'Meta': meta}))
+    return model
+
+
+class MetricPartition(Model):
+    """
+    Registry of the time partitions holding vehicle metric records.
+
+    Attributes:
+        name (str): Name of the partition table.
+        period_start (datetime): Inclusive UTC start of the period covered.
+        period_end (datetime): Exclusive UTC end of the period covered.
+        created_at (datetime): Timestamp when the partition was created.
+    """
+    name = CharField(primary_key=True)
+    period_start = DateTimeField(index=True)
+    period_end = DateTimeField()
+    created_at = DateTimeField(default=utc_now)
+
+    class Meta:
+        """Metadata for the MetricPartition model."""
+        database = db
+        table_name = 'metric_partitions'
+
+
+class MetricRecordSequence(Model):
+    """
+    Last vehicle metric record ID handed out, so IDs stay unique across partitions.
+
+    Attributes:
+        id (int): Always 1; the table holds a single row.
+        last_id (int): The highest ID allocated so far.
+    """
+    id = IntegerField(primary_key=True)
+    last_id = IntegerField()
+
+    class Meta:
+        """Metadata for the MetricRecordSequence model."""
+        database = db
+        table_name = 'metric_record_sequence'
+
+
+class MetricSegment(Model):
+    """
+    Compressed column segment of archived vehicle metric records of one vehicle.
+
+    Attributes:
+        vehicle_id (int): The vehicle whose records the segment holds.
+        row_count (int): Number of records in the segment.
+        first_recorded_at (datetime): Earliest recorded_at in the segment.
+        last_recorded_at (datetime): Latest recorded_at in the segment.
+        last_id (int): ID of the record at last_recorded_at with the highest ID.
+        layout (str): JSON mapping each column to its (encoding, offset, length) in data.
+        column_ranges (str): JSON mapping each numeric column to its [min, max].
+        data (bytes): The concatenated compressed columns.
+        created_at (datetime): Timestamp when the segment was archived.
+    """
+    id = AutoField()
+    vehicle_id = IntegerField()
+    row_count = IntegerField()
+    first_recorded_at = DateTimeField()
+    last_recorded_at = DateTimeField()
+    last_id = IntegerField()
+    layout = TextField()
+    column_ranges = TextField()
+    data = BlobField()
+    created_at = DateTimeField(default=utc_now)
+
+    class Meta:
+        """Metadata for the MetricSegment model."""
+        database = db
+        table_name = 'metric_segments'
+        indexes = (
+            (('vehicle_id', 'last_recorded_at'), False),
+        )
+
+
+class MetricOutbox(Model):
+    """
+    Represents a pending upstream delivery of a vehicle metric record.
+
+    Rows are written in the same transaction as the metric record and drained by the
+    background forwarder, so ingestion never waits on the Bykerz backend.
+
+    Attributes:
+        record_id (int): ID of the vehicle metric record being forwarded.
+        device_id (str): Device whose current token authenticates the upstream call.
+        payload (str): JSON body sent to the backend.
+        status (str): One of 'pending', 'sent' or 'failed'; 'held' while the record's trip is
+            open and 'superseded' once the closed trip is forwarded instead
+            (TRIPS_REPLACE_RAW_FORWARDING).
+        attempts (int): Number of delivery attempts made so far.
+        next_attempt_at (datetime): Earliest UTC time the row may be claimed again.
+        last_status_code (int): HTTP status of the last attempt, if any.
+        last_error (str): Error of the last failed attempt, if any.
+        created_at (datetime): UTC timestamp when the row was enqueued.
+        forwarded_at (datetime): UTC timestamp when the backend accepted the record.
+        priority (int): Forwarding lane: 1 for critical events, 0 for routine telemetry.
+        topic (str): Kind of payload: 'metrics' for records, 'trips' for completed trips.
+        trip_id (int): Trip whose track replaces a held record, if any.
+    """
+    id = AutoField()
+    record_id = IntegerField(index=True)
+    device_id = CharField()
+    payload = TextField()
+    status = CharField(default='pending')
+    attempts = IntegerField(default=0)
+    next_attempt_at = DateTimeField(default=utc_now)
+    last_status_code = IntegerField(null=True)
+    last_error = TextField(null=True)
+    created_at = DateTimeField(default=utc_now)
+    forwarded_at = DateTimeField(null=True)
+    priority = IntegerField(default=0, constraints=[SQL('DEFAULT 0')])
+    topic = CharField(default='metrics', constraints=[SQL("DEFAULT 'metrics'")])
+    trip_id = IntegerField(null=True, index=True)
+
+    class Meta:
+        """Metadata for the MetricOutbox model."""
+        database = db
+        table_name = 'metric_outbox'
+        indexes = (
+            (('status', 'next_attempt_at'), False),
+            (('status', 'priority', 'next_attempt_at'), False),
+        )
+
+
+class MetricRollup(Model):
+    """
+    Represents running statistics of one sensor field of a vehicle over one time bucket.
+
+    Attributes:
+        vehicle_id (int): Identifier for the vehicle.
+        resolution (str): Bucket width: '1m', '1h' or '1d'.
+        bucket_start (datetime): UTC start of the bucket.
+        field (str): Name of the aggregated record attribute.
+        count (int): Number of readings aggregated.
+        minimum (float): Smallest reading.
+        maximum (float): Largest reading.
+        mean (float): Mean of the readings.
+        m2 (float): Sum of squared deviations from the mean (Welford).
+    """
+    id = AutoField()
+    vehicle_id = IntegerField()
+    resolution = CharField()
+    bucket_start = DateTimeField()
+    field = CharField()
+    count = IntegerField()
+    minimum = FloatField()
+    maximum = FloatField()
+    mean = FloatField()
+    m2 = FloatField()
+
+    class Meta:
+        """Metadata for the MetricRollup model."""
+        database = db
+        table_name = 'metric_rollups'
+        indexes = (
+            (('vehicle_id', 'resolution', 'bucket_start', 'field'), True),
+        )
+
+
+class Trip(Model):
+    """
+    Represents one continuous movement of a vehicle, bounded by idle gaps.
+
+    Attributes:
+        vehicle_id (int): Identifier for the vehicle.
+        device_id (str): Device reporting the vehicle.
+        status (str): 'open' or 'closed'.
+        started_at (datetime): UTC time of the first point.
+        ended_at (datetime): UTC time of the last movement, once closed.
+        raw_points (int): Number of GPS readings folded into the trip.
+        vertex_count (int): Number of points of the simplified track.
+        last_latitude, last_longitude, last_at: Last raw point, to resume an open trip.
+        last_moved_latitude, last_moved_longitude, last_moved_at: Last point where the vehicle was moving.
+    """
+    id = AutoField()
+    vehicle_id = IntegerField()
+    device_id = CharField()
+    status = CharField(default='open')
+    started_at = DateTimeField()
+    ended_at = DateTimeField(null=True)
+    raw_points = IntegerField(default=0)
+    vertex_count = IntegerField(default=0)
+    last_latitude = FloatField()
+    last_longitude = FloatField()
+    last_at = FloatField()
+    last_moved_latitude = FloatField()
+    last_moved_longitude = FloatField()
+    last_moved_at = FloatField()
+
+    class Meta:
+        """Metadata for the Trip model."""
+        database = db
+        table_name = 'trips'
+        indexes = (
+            (('vehicle_id', 'started_at'), False),
+            (('status',), False),
+        )
+
+
+class TripPoint(Model):
+    """
+    Represents a vertex of a trip's simplified track.
+
+    Attributes:
+        trip_id (int): The trip.
+        sequence (int): Position of the vertex in the track.
+        latitude (float): Latitude in decimal degrees.
+        longitude (float): Longitude in decimal degrees.
+        recorded_at (float): Reading time in epoch seconds.
+    """
+    id = AutoField()
+    trip_id = IntegerField()
+    sequence = IntegerField()
+    latitude = FloatField()
+    longitude = FloatField()
+    recorded_at = FloatField()
+
+    class Meta:
+        """Metadata for the TripPoint model."""
+        database = db
+        table_name = 'trip_points'
+        indexes = (
+            (('trip_id', 'sequence'), True),
+        )
+
+
+class TripCell(Model):
+    """
+    Geohash index of the cells crossed by each trip, for area queries.
+
+    Attributes:
+        geohash (str): Geohash of a cell crossed by the trip.
+        trip_id (int): The trip.
+        vehicle_id (int): The trip's vehicle.
+    """
+    id = AutoField()
+    geohash = CharField()
+    trip_id = IntegerField()
+    vehicle_id = IntegerField()
+
+    class Meta:
+        """Metadata for the TripCell model."""
+        database = db
+        table_name = 'trip_cells'
+        indexes = (
+            (('geohash', 'trip_id'), True),
+        )
+
+
+class VehicleTrack(Model):
+    """
+    Segmentation state of each vehicle, shared by every process that commits its readings.
+
+    Attributes:
+        vehicle_id (int): The vehicle.
+        device_id (str): Device that reported the last point.
+        latitude, longitude, recorded_at: Last point seen, recorded_at in epoch seconds.
+        trip_id (int): The vehicle's open trip, if any.
+        observed_at (float): Server time, in epoch seconds, when the open trip last received a point.
+        version (int): Random stamp of the last save, so a process can tell its own copy is stale.
+    """
+    vehicle_id = IntegerField(primary_key=True)
+    device_id = CharField()
+    latitude = FloatField()
+    longitude = FloatField()
+    recorded_at = FloatField()
+    trip_id = IntegerField(null=True)
+    observed_at = FloatField(null=True)
+    version = IntegerField(default=0)
 
     class Meta:
+        """Metadata for the VehicleTrack model."""
         database = db
-        table_name = 'vehicle_metric_records'
\ No newline at end of file
+        table_name = 'vehicle_tracks'
+        indexes = (
+            (('trip_id', 'observed_at'), False),
+        )
@@ -0,0 +1,106 @@
+"""
+Request workers' views of the reading state the writer process holds.
+
+The validate, filter and smooth stages compare each reading with the last stored ones of
+its vehicle or device. Like the live readings, that state belongs to the process that
+commits readings and only changes once their transaction commits; until then a request's
+changes are kept apart as its pending state. In single-writer deployments every check is
+therefore answered by the writer, against its state and the pending state the request sends
+along, and the pending state travels back to the writer with the readings it stores.
+"""
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from shared.infrastructure.writer_process import WriterClient
+from wellness.domain.entities import VehicleMetricRecord
+from wellness.domain.schema import METRIC_SCHEMA
+
+
+def to_writer_rows(records: Sequence[VehicleMetricRecord]) -> List[tuple]:
+    """
+    Encode records for the writer process.
+    :param records: The records.
+    :return: Per record, its schema values followed by recorded_at.
+    """
+    return [METRIC_SCHEMA.values(record) + (record.recorded_at,) for record in records]
+
+
+def from_writer_rows(rows: Sequence[tuple]) -> List[VehicleMetricRecord]:
+    """
+    Decode records encoded by to_writer_rows.
+    :param rows: The encoded records.
+    :return: The records, without IDs.
+    """
+    return [VehicleMetricRecord(*row[:-1], recorded_at=row[-1]) for row in rows]
+
+
+class _WriterView:
+    """Forwards a component's checks to the writer process; committing is left to the writer."""
+
+    def __init__(self, writer: WriterClient):
+        """
+        Initialize the view.
+        :param writer: Client of the writer process.
+        """
+        self.writer = writer
+
+    def commit(self, pending: dict) -> None:
+        """
+        Nothing to do: the writer commits the pending state sent with the readings it stores.
+        :param pending: The pending state.
+        :return: None
+        """
+
+
+class WriterPlausibilityValidator(_WriterView):
+    """Request worker's view of the writer's MetricPlausibilityValidator."""
+
+    def validate(self, records: Sequence[VehicleMetricRecord],
+                 pending: Optional[dict] = None) -> Tuple[List[bool], List[Optional[str]]]:
+        """
+        Check a batch of readings, see MetricPlausibilityValidator.validate.
+        :raises WriterUnavailable: If the writer process cannot be reached.
+        """
+        reasons, state = self.writer.query(('validate', to_writer_rows(records), pending))
+        if pending is not None:
+            pending.update(state)
+        return [reason is not None for reason in reasons], reasons
+
+
+class WriterDeadbandFilter(_WriterView):
+    """Request worker's view of the writer's DeadbandFilter."""
+
+    def admit_many(self, records: Sequence[VehicleMetricRecord], now: datetime, forced: Sequence[bool],
+                   pending: Optional[dict] = None) -> List[bool]:
+        """
+        Decide which readings of a batch pass, see DeadbandFilter.admit_many.
+        :raises WriterUnavailable: If the writer process cannot be reached.
+        """
+        mask, state = self.writer.query(('filter', to_writer_rows(records), now, list(forced), pending))
+        if pending is not None:
+            pending.update(state)
+        return mask
+
+    def stats(self) -> dict:
+        """
+        Report the writer's pass and suppression counters, see DeadbandFilter.stats.
+        :raises WriterUnavailable: If the writer process cannot be reached.
+        """
+        return self.writer.query(('deadband_stats',))
+
+
+class WriterReadingSmoother(_WriterView):
+    """Request worker's view of the writer's ReadingSmoother."""
+
+    def smooth_many(self, records: Sequence[VehicleMetricRecord], keep_raw: Sequence[bool],
+                    pending: Optional[dict] = None) -> None:
+        """
+        Smooth the readings of a batch, see ReadingSmoother.smooth_many.
+        :raises WriterUnavailable: If the writer process cannot be reached.
+        """
+        smoothed, state = self.writer.query(('smooth', to_writer_rows(records), list(keep_raw), pending))
+        for record, values in zip(records, smoothed):
+            for field, value in values.items():
+                setattr(record, field, value)
+        if pending is not None:
+            pending.update(state)
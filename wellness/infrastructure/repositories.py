@@ -1,41 +1,1074 @@
-from wellness.domain.entities import VehicleMetricRecord
-from wellness.infrastructure.models import VehicleMetricRecord as VehicleMetricRecordModel
+import heapq
+import json
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from typing import Iterator, List, Optional, Sequence, Set, Tuple
+
+from peewee import EXCLUDED, OperationalError, fn, Tuple as SqlTuple
+
+from shared.infrastructure.database import db, insert_many_returning_ids, INSERT_CHUNK_SIZE
+from wellness.infrastructure import columnar
+from wellness.domain import geo
+from wellness.domain.entities import VehicleMetricRecord, MetricForwardingState, MetricAggregate, \
+    MetricPartition, Trip
+from wellness.domain.schema import METRIC_SCHEMA
+from wellness.domain.services import MetricPartitionPolicy
+from wellness.infrastructure.models import VehicleMetricRecord as VehicleMetricRecordModel, utc_now, partition_model
+from wellness.infrastructure.models import MetricPartition as MetricPartitionModel
+from wellness.infrastructure.models import MetricRecordSequence as MetricRecordSequenceModel
+from wellness.infrastructure.models import MetricSegment as MetricSegmentModel
+from wellness.infrastructure.models import MetricOutbox as MetricOutboxModel
+from wellness.infrastructure.models import MetricRollup as MetricRollupModel
+from wellness.infrastructure.models import Trip as TripModel, TripPoint as TripPointModel, \
+    TripCell as TripCellModel, VehicleTrack as VehicleTrackModel
+
+class MetricPartitionRepository:
+    def __init__(self, policy: Optional[MetricPartitionPolicy] = None):
+        """Initialize the repository of time partitions.
+
+        Args:
+            policy (MetricPartitionPolicy, optional): How records are split into partitions.
+                Without one, partitions are only listed and dropped, never created. Defaults to None.
+        """
+        self.policy = policy
+        self._created: Set[str] = set()
+
+    @staticmethod
+    def table_name(period_start: datetime) -> str:
+        """Name the table of the partition starting at a given time."""
+        return f"{VehicleMetricRecordModel._meta.table_name}_{period_start:%Y%m%d}"
+
+    def model_for(self, recorded_at: datetime):
+        """Find the model of the partition a reading belongs to, creating the partition if needed.
+
+        The table and its registry row are created inside the caller's transaction, so a
+        partition exists exactly when the first records of its period are committed.
+
+        Args:
+            recorded_at (datetime): The reading time.
+
+        Returns:
+            The partition's peewee model.
+        """
+        period_start, period_end = self.policy.period(recorded_at)
+        name = self.table_name(period_start)
+        model = partition_model(name)
+        if name not in self._created:
+            model.create_table(safe=True)
+            (MetricPartitionModel
+             .insert(name=name, period_start=period_start, period_end=period_end)
+             .on_conflict_ignore()
+             .execute())
+            self._created.add(name)
+        return model
+
+    def forget(self, name: str) -> None:
+        """Forget that a partition was created, after another process dropped it."""
+        self._created.discard(name)
+
+    @staticmethod
+    def find(start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[MetricPartition]:
+        """Find the partitions overlapping a time window.
+
+        Args:
+            start (datetime, optional): Inclusive lower bound of the window.
+            end (datetime, optional): Exclusive upper bound of the window.
+
+        Returns:
+            List[MetricPartition]: The partitions, oldest first.
+        """
+        model = MetricPartitionModel
+        query = model.select()
+        if start is not None:
+            query = query.where(model.period_end > start)
+        if end is not None:
+            query = query.where(model.period_start < end)
+        return [MetricPartition(row.name, row.period_start, row.period_end)
+                for row in query.order_by(model.period_start)]
+
+    @staticmethod
+    def has_pending_deliveries(name: str) -> bool:
+        """Check whether any record of a partition is still waiting to be forwarded.
+
+        Args:
+            name (str): The partition's table name.
+
+        Returns:
+            bool: True if the outbox holds a pending delivery of one of its records.
+        """
+        model = partition_model(name)
+        return (MetricOutboxModel
+                .select()
+                .where((MetricOutboxModel.status == 'pending') &
+                       (MetricOutboxModel.topic == 'metrics') &
+                       MetricOutboxModel.record_id.in_(model.select(model.id)))
+                .exists())
+
+    def drop(self, name: str) -> None:
+        """Drop a partition with all its records.
+
+        Args:
+            name (str): The partition's table name.
+        """
+        with db.atomic():
+            partition_model(name).drop_table(safe=True)
+            MetricPartitionModel.delete().where(MetricPartitionModel.name == name).execute()
+        self._created.discard(name)
+
+    @staticmethod
+    def used_bytes() -> Optional[int]:
+        """Measure the space stored records take: the partition tables, the archive of
+        column segments and their indexes.
+
+        The outbox, rollups and trips are left out, since dropping partitions does not
+        shrink them, and so are pages freed by dropped partitions: SQLite keeps the file at
+        its size and reuses them for new records.
+
+        Returns:
+            Optional[int]: Bytes in use, or None if SQLite was built without the dbstat table.
+        """
+        tables = [partition.name for partition in MetricPartitionRepository.find()]
+        tables.append(MetricSegmentModel._meta.table_name)
+        try:
+            cursor = db.execute_sql(
+                'SELECT COALESCE(SUM(stat.pgsize), 0) FROM dbstat AS stat '
+                'JOIN sqlite_master AS master ON master.name = stat.name '
+                f'WHERE master.tbl_name IN ({", ".join("?" * len(tables))})', tables)
+        except OperationalError:
+            return None
+        return cursor.fetchone()[0]
+
+    @staticmethod
+    def database_bytes() -> int:
+        """Measure the space the database's live pages take, whatever table they belong to.
+
+        Returns:
+            int: Bytes in use.
+        """
+        return db.pragma('page_size') * (db.pragma('page_count') - db.pragma('freelist_count'))
+
+
+class MetricSegmentRepository:
+    @staticmethod
+    def save(rows: List[tuple]) -> None:
+        """Archive records of one vehicle as a compressed column segment.
+
+        Args:
+            rows (List[tuple]): The records as (id, recorded_at, *METRIC_SCHEMA.names) tuples,
+                in (recorded_at, id) order.
+        """
+        columns = {
+            'id': (columnar.DELTA, [row[0] for row in rows]),
+            'recorded_at': (columnar.DELTA, [columnar.to_micros(row[1]) for row in rows])
+        }
+        for index, field in enumerate(METRIC_SCHEMA.fields, start=2):
+            columns[field.name] = (columnar.encoding_for(field.coerce), [row[index] for row in rows])
+        layout, ranges, data = columnar.encode_segment(columns)
+        MetricSegmentModel.insert(
+            vehicle_id=rows[0][2 + METRIC_SCHEMA.names.index('vehicle_id')],
+            row_count=len(rows),
+            first_recorded_at=rows[0][1],
+            last_recorded_at=rows[-1][1],
+            last_id=rows[-1][0],
+            layout=json.dumps(layout),
+            column_ranges=json.dumps(ranges),
+            data=data
+        ).execute()
+
+    @staticmethod
+    def iter_by_vehicle(vehicle_id: int, fields: Sequence[str], start: Optional[datetime] = None,
+                        end: Optional[datetime] = None,
+                        after: Optional[Tuple[datetime, int]] = None) -> Iterator[tuple]:
+        """Stream a vehicle's archived records in (recorded_at, id) order.
+
+        Segments whose recorded_at range lies outside the window or before the cursor are
+        skipped without being read, and only the projected columns of the others are
+        decompressed, one segment at a time. Segments usually follow each other; those
+        that overlap, from records archived late, are merged.
+
+        Args:
+            vehicle_id (int): The vehicle whose records are read.
+            fields (Sequence[str]): Columns to project after id and recorded_at.
+            start (datetime, optional): Inclusive lower bound on recorded_at.
+            end (datetime, optional): Exclusive upper bound on recorded_at.
+            after (Tuple[datetime, int], optional): Keyset cursor; only rows after this
+                (recorded_at, id) position are returned.
+
+        Returns:
+            Iterator[tuple]: The projected rows, shaped as in VehicleMetricRepository.iter_by_vehicle.
+        """
+        model = MetricSegmentModel
+        query = model.select(model.first_recorded_at, model.layout, model.data).where(model.vehicle_id == vehicle_id)
+        if start is not None:
+            query = query.where(model.last_recorded_at >= start)
+        if end is not None:
+            query = query.where(model.first_recorded_at < end)
+        if after is not None:
+            after_recorded_at, after_id = after
+            query = query.where((model.last_recorded_at > after_recorded_at) |
+                                ((model.last_recorded_at == after_recorded_at) & (model.last_id > after_id)))
+        names = ['id', 'recorded_at'] + list(fields)
+
+        def segment_rows(segment):
+            ids, micros, *values = columnar.decode_segment(json.loads(segment.layout), segment.data, names)
+            for row in zip(ids, map(columnar.from_micros, micros), *values):
+                recorded_at = row[1]
+                if end is not None and recorded_at >= end:
+                    return
+                if start is not None and recorded_at < start:
+                    continue
+                if after is not None and (recorded_at, row[0]) <= after:
+                    continue
+                yield row
+
+        segments = query.order_by(model.first_recorded_at).iterator()
+        upcoming = next(segments, None)
+        heap, opened = [], 0
+        while True:
+            # Open the next segment once the merged rows reach its first timestamp
+            while upcoming is not None and (not heap or upcoming.first_recorded_at <= heap[0][0][0]):
+                rows = segment_rows(upcoming)
+                row = next(rows, None)
+                if row is not None:
+                    heapq.heappush(heap, ((row[1], row[0]), opened, row, rows))
+                    opened += 1
+                upcoming = next(segments, None)
+            if not heap:
+                return
+            _, order, row, rows = heapq.heappop(heap)
+            yield row
+            row = next(rows, None)
+            if row is not None:
+                heapq.heappush(heap, ((row[1], row[0]), order, row, rows))
+
+    @staticmethod
+    def delete_before(cutoff: datetime) -> int:
+        """Delete the segments whose records are all older than a cutoff.
+
+        Args:
+            cutoff (datetime): The cutoff.
+
+        Returns:
+            int: The number of segments deleted.
+        """
+        return MetricSegmentModel.delete().where(MetricSegmentModel.last_recorded_at < cutoff).execute()
 
-class VehicleMetricRepository:
     @staticmethod
-    def save(vehicle_metric_record) -> VehicleMetricRecord:
+    def delete_oldest(count: int) -> int:
+        """Delete the segments holding the oldest records.
+
+        Args:
+            count (int): Maximum number of segments to delete.
+
+        Returns:
+            int: The number of segments deleted.
+        """
+        model = MetricSegmentModel
+        oldest = model.select(model.id).order_by(model.last_recorded_at).limit(count)
+        return model.delete().where(model.id.in_(oldest)).execute()
+
+    @staticmethod
+    def stats() -> dict:
+        """Report the size of the archive.
+
+        Returns:
+            dict: segments, records and compressed_bytes.
+        """
+        model = MetricSegmentModel
+        segments, records, compressed = model.select(
+            fn.COUNT(model.id), fn.IFNULL(fn.SUM(model.row_count), 0), fn.IFNULL(fn.SUM(fn.LENGTH(model.data)), 0)
+        ).tuples().get()
+        return {"segments": segments, "records": records, "compressed_bytes": compressed}
+
+
+class VehicleMetricRepository:
+    def __init__(self, partitions: Optional[MetricPartitionRepository] = None,
+                 segments: Optional[MetricSegmentRepository] = None):
+        """Initialize the repository.
+
+        Args:
+            partitions (MetricPartitionRepository, optional): Time partitions new records are
+                stored in; when it has no policy, or is omitted, records go to the
+                vehicle_metric_records table. Defaults to None.
+            segments (MetricSegmentRepository, optional): Archive of cold records read
+                alongside the tables. Defaults to a new one.
+        """
+        self.partitions = partitions or MetricPartitionRepository()
+        self.segments = segments or MetricSegmentRepository()
+
+    def save(self, vehicle_metric_record) -> VehicleMetricRecord:
         """Save a vehicle metric record to the database.
 
+        Must be called inside a transaction when records are partitioned.
+
         Args:
             vehicle_metric_record (VehicleMetricRecord): The vehicle metric record to save.
 
         Returns:
-            VehicleMetricRecord: The saved vehicle metric record including its ID.
+            VehicleMetricRecord: The same record with its ID and recorded_at assigned.
+        """
+
+        if vehicle_metric_record.recorded_at is None:
+            vehicle_metric_record.recorded_at = utc_now()
+        if self.partitions.policy is not None:
+            return self.save_many([vehicle_metric_record])[0]
+        vehicle_metric_record.id = VehicleMetricRecordModel.insert(METRIC_SCHEMA.to_row(vehicle_metric_record)).execute()
+        return vehicle_metric_record
+
+    def save_many(self, vehicle_metric_records: List[VehicleMetricRecord]) -> List[VehicleMetricRecord]:
+        """Save several vehicle metric records with one multi-row INSERT.
+
+        Must be called inside a transaction, with at most INSERT_CHUNK_SIZE records.
+        Records without a device-supplied recorded_at are stamped with the current time.
+        When records are partitioned, their IDs come from a shared sequence and each
+        partition they fall in gets one INSERT.
+
+        Args:
+            vehicle_metric_records (List[VehicleMetricRecord]): The vehicle metric records to save.
+
+        Returns:
+            List[VehicleMetricRecord]: The same records with their IDs assigned.
+        """
+        now = utc_now()
+        for record in vehicle_metric_records:
+            if record.recorded_at is None:
+                record.recorded_at = now
+        if self.partitions.policy is not None:
+            self._save_partitioned(vehicle_metric_records)
+            return vehicle_metric_records
+        rows = [METRIC_SCHEMA.to_row(record) for record in vehicle_metric_records]
+        ids = insert_many_returning_ids(VehicleMetricRecordModel, rows)
+        for record, record_id in zip(vehicle_metric_records, ids):
+            record.id = record_id
+        return vehicle_metric_records
+
+    def _save_partitioned(self, records: List[VehicleMetricRecord]) -> None:
+        """Insert records into their partitions, assigning IDs from the shared sequence."""
+        if not records:
+            return
+        first_id = self._allocate_ids(len(records))
+        by_model = {}
+        for offset, record in enumerate(records):
+            record.id = first_id + offset
+            model = self.partitions.model_for(record.recorded_at)
+            by_model.setdefault(model, []).append(dict(METRIC_SCHEMA.to_row(record), id=record.id))
+        for model, rows in by_model.items():
+            try:
+                model.insert_many(rows).execute()
+            except OperationalError as e:
+                # Another process dropped the partition since this one created it
+                if 'no such table' not in str(e):
+                    raise
+                self.partitions.forget(model._meta.table_name)
+                self.partitions.model_for(rows[0]['recorded_at']).insert_many(rows).execute()
+
+    @staticmethod
+    def _allocate_ids(count: int) -> int:
+        """Reserve consecutive record IDs; must be called inside a transaction.
+
+        The sequence never falls behind the vehicle_metric_records table, which keeps
+        assigning its own IDs while records are not partitioned.
+
+        Args:
+            count (int): Number of IDs to reserve.
+
+        Returns:
+            int: The first reserved ID.
+        """
+        sequence = MetricRecordSequenceModel
+        legacy_max = fn.IFNULL(VehicleMetricRecordModel.select(fn.MAX(VehicleMetricRecordModel.id)), 0)
+        (sequence
+         .insert(id=1, last_id=legacy_max + count)
+         .on_conflict(conflict_target=[sequence.id],
+                      update={sequence.last_id: fn.MAX(sequence.last_id + count, EXCLUDED.last_id)})
+         .execute())
+        return sequence.get_by_id(1).last_id - count + 1
+
+    def iter_by_vehicle(self, vehicle_id: int, fields: Sequence[str], start: Optional[datetime] = None,
+                        end: Optional[datetime] = None, after: Optional[Tuple[datetime, int]] = None,
+                        limit: Optional[int] = None) -> Iterator[tuple]:
+        """Stream a vehicle's records in (recorded_at, id) order.
+
+        Only the requested columns are selected and rows are read lazily from the cursor
+        as plain tuples, so memory use does not grow with the result size. The iterator
+        opens its own connection if none is open when it starts, so it can be consumed
+        after the request that created it has released its connection.
+
+        Only the partitions overlapping the window are read, one after the other since
+        their periods do not overlap, merged with the vehicle_metric_records table, which
+        holds the records stored before partitioning, and with the archived segments.
+
+        Args:
+            vehicle_id (int): The vehicle whose records are read.
+            fields (Sequence[str]): Columns to project; each tuple starts with id and recorded_at,
+                followed by these columns in order.
+            start (datetime, optional): Inclusive lower bound on recorded_at.
+            end (datetime, optional): Exclusive upper bound on recorded_at.
+            after (Tuple[datetime, int], optional): Keyset cursor; only rows after this
+                (recorded_at, id) position are returned.
+            limit (int, optional): Maximum number of rows.
+
+        Returns:
+            Iterator[tuple]: The projected rows.
+        """
+        opened = db.connect(reuse_if_open=True)
+        try:
+            lower = start
+            if after is not None and (lower is None or after[0] > lower):
+                lower = after[0]
+            sources = [self._select_by_vehicle(VehicleMetricRecordModel, vehicle_id, fields, start, end, after, limit),
+                       self.segments.iter_by_vehicle(vehicle_id, fields, start, end, after)]
+            partitions = self.partitions.find(lower, end)
+            if partitions:
+                sources.append(chain.from_iterable(
+                    self._select_by_vehicle(partition_model(partition.name), vehicle_id, fields,
+                                            start, end, after, limit)
+                    for partition in partitions))
+            yield from islice(heapq.merge(*sources, key=lambda row: (row[1], row[0])), limit)
+        finally:
+            if opened:
+                db.close()
+
+    @staticmethod
+    def _select_by_vehicle(model, vehicle_id: int, fields: Sequence[str], start: Optional[datetime],
+                           end: Optional[datetime], after: Optional[Tuple[datetime, int]],
+                           limit: Optional[int]) -> Iterator[tuple]:
+        """Stream a vehicle's records from one table, see iter_by_vehicle."""
+        columns = [model.id, model.recorded_at] + [getattr(model, name) for name in fields]
+        query = model.select(*columns).where(model.vehicle_id == vehicle_id)
+        if start is not None:
+            query = query.where(model.recorded_at >= start)
+        if end is not None:
+            query = query.where(model.recorded_at < end)
+        if after is not None:
+            after_recorded_at, after_id = after
+            query = query.where((model.recorded_at > after_recorded_at) |
+                                ((model.recorded_at == after_recorded_at) & (model.id > after_id)))
+        query = query.order_by(model.recorded_at, model.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.tuples().iterator()
+
+    @staticmethod
+    def _table(name: str):
+        """Model of the table holding records, either vehicle_metric_records or a partition."""
+        if name == VehicleMetricRecordModel._meta.table_name:
+            return VehicleMetricRecordModel
+        return partition_model(name)
+
+    def archive_sources(self, before: datetime) -> List[Tuple[str, Optional[datetime]]]:
+        """List the tables that may hold records older than a cutoff.
+
+        Args:
+            before (datetime): The cutoff.
+
+        Returns:
+            List[Tuple[str, Optional[datetime]]]: Each table with the end of its period,
+                None for vehicle_metric_records.
+        """
+        return [(VehicleMetricRecordModel._meta.table_name, None)] + [
+            (partition.name, partition.period_end) for partition in self.partitions.find(end=before)]
+
+    def next_vehicle(self, table: str, after_vehicle_id: Optional[int] = None) -> Optional[int]:
+        """Find the vehicle with the next higher ID having records in a table.
+
+        Args:
+            table (str): The table.
+            after_vehicle_id (int, optional): The previous vehicle. Defaults to None, for the first one.
+
+        Returns:
+            Optional[int]: The vehicle, or None after the last one.
+        """
+        model = self._table(table)
+        query = model.select(model.vehicle_id).order_by(model.vehicle_id).limit(1)
+        if after_vehicle_id is not None:
+            query = query.where(model.vehicle_id > after_vehicle_id)
+        row = query.tuples().first()
+        return row[0] if row else None
+
+    def find_archivable(self, table: str, vehicle_id: int, before: datetime, limit: int) -> List[tuple]:
+        """Find a vehicle's oldest records that were recorded before a cutoff and have no pending delivery.
+
+        Args:
+            table (str): The table holding the records.
+            vehicle_id (int): The vehicle.
+            before (datetime): The cutoff.
+            limit (int): Maximum number of records.
+
+        Returns:
+            List[tuple]: (id, recorded_at, *METRIC_SCHEMA.names) tuples in (recorded_at, id) order.
+        """
+        model = self._table(table)
+        pending = (MetricOutboxModel
+                   .select(MetricOutboxModel.record_id)
+                   .where((MetricOutboxModel.status == 'pending') & (MetricOutboxModel.topic == 'metrics')))
+        columns = [model.id, model.recorded_at] + [getattr(model, name) for name in METRIC_SCHEMA.names]
+        return list(model
+                    .select(*columns)
+                    .where((model.vehicle_id == vehicle_id) & (model.recorded_at < before) &
+                           model.id.not_in(pending))
+                    .order_by(model.recorded_at, model.id)
+                    .limit(limit)
+                    .tuples())
+
+    def delete(self, table: str, record_ids: List[int]) -> None:
+        """Delete records from a table.
+
+        Args:
+            table (str): The table holding the records.
+            record_ids (List[int]): IDs of the records.
+        """
+        model = self._table(table)
+        for start in range(0, len(record_ids), INSERT_CHUNK_SIZE):
+            model.delete().where(model.id.in_(record_ids[start:start + INSERT_CHUNK_SIZE])).execute()
+
+    def is_empty(self, table: str) -> bool:
+        """Check whether a table holds no record.
+
+        Args:
+            table (str): The table.
+
+        Returns:
+            bool: True if it is empty.
+        """
+        return not self._table(table).select().exists()
+
+
+class MetricOutboxRepository:
+    @staticmethod
+    def _to_entity(row: MetricOutboxModel) -> MetricForwardingState:
+        """Map an outbox row to its domain entity."""
+        return MetricForwardingState(
+            outbox_id=row.id,
+            record_id=row.record_id,
+            device_id=row.device_id,
+            payload=json.loads(row.payload),
+            status=row.status,
+            attempts=row.attempts,
+            last_status_code=row.last_status_code,
+            last_error=row.last_error,
+            forwarded_at=row.forwarded_at,
+            priority=row.priority,
+            created_at=row.created_at,
+            topic=row.topic
+        )
+
+    @staticmethod
+    def enqueue(record: VehicleMetricRecord, payload: dict, priority: int = 0) -> MetricForwardingState:
+        """Queue a saved vehicle metric record for upstream delivery.
+
+        Args:
+            record (VehicleMetricRecord): The persisted record, including its ID.
+            payload (dict): The body to send to the backend.
+            priority (int, optional): Forwarding lane, 1 for critical events. Defaults to 0.
+
+        Returns:
+            MetricForwardingState: The pending delivery.
+        """
+        row = MetricOutboxModel.create(
+            record_id=record.id,
+            device_id=record.device_id,
+            payload=json.dumps(payload),
+            priority=priority
+        )
+        return MetricOutboxRepository._to_entity(row)
+
+    @staticmethod
+    def enqueue_many(records: List[VehicleMetricRecord], payloads: List[dict], priorities: List[int],
+                     trips: Optional[List[Optional[Trip]]] = None) -> None:
+        """Queue several saved vehicle metric records with one multi-row INSERT.
+
+        Args:
+            records (List[VehicleMetricRecord]): The persisted records, including their IDs.
+            payloads (List[dict]): The body to send to the backend for each record.
+            priorities (List[int]): The forwarding lane of each record.
+            trips (List[Optional[Trip]], optional): For each record, the saved trip whose track
+                replaces it, if any: the record is held while the trip is open and superseded
+                once it is closed. Defaults to forwarding every record.
+        """
+        if not records:
+            return
+        trips = trips or [None] * len(records)
+        MetricOutboxModel.insert_many([{
+            'record_id': record.id,
+            'device_id': record.device_id,
+            'payload': json.dumps(payload),
+            'priority': priority,
+            'status': 'pending' if trip is None else 'superseded' if trip.status == 'closed' else 'held',
+            'trip_id': trip.id if trip is not None else None
+        } for record, payload, priority, trip in zip(records, payloads, priorities, trips)]).execute()
+
+    @staticmethod
+    def supersede_held(trip_id: int) -> None:
+        """Stop holding the records of a closed trip, whose track is forwarded instead.
+
+        Args:
+            trip_id (int): The closed trip.
+        """
+        (MetricOutboxModel
+         .update(status='superseded')
+         .where((MetricOutboxModel.trip_id == trip_id) & (MetricOutboxModel.status == 'held'))
+         .execute())
+
+    @staticmethod
+    def enqueue_trip(trip: Trip, payload: dict) -> None:
+        """Queue a closed trip for upstream delivery on the bulk lane.
+
+        Args:
+            trip (Trip): The persisted trip, including its ID.
+            payload (dict): The body to send to the backend.
+        """
+        MetricOutboxModel.insert(
+            record_id=trip.id,
+            device_id=trip.device_id,
+            payload=json.dumps(payload),
+            topic='trips'
+        ).execute()
+
+    @staticmethod
+    def claim_due(limit: int, lease_seconds: float, min_count: int = 1,
+                  max_wait_seconds: float = 0.0, priority: int = 0) -> List[MetricForwardingState]:
+        """Claim pending deliveries whose retry time has come.
+
+        Claimed rows have their next attempt pushed back by the lease, so concurrent
+        forwarders (one per worker process) do not send the same record twice. Nothing is
+        claimed while fewer than min_count rows are due and the oldest of them has waited
+        less than max_wait_seconds, which lets the caller accumulate full batches.
+
+        Args:
+            limit (int): Maximum number of deliveries to claim.
+            lease_seconds (float): How long the claim is held before the row is due again.
+            min_count (int, optional): Due rows needed to claim before max_wait_seconds. Defaults to 1.
+            max_wait_seconds (float, optional): Age of the oldest due row that forces a claim. Defaults to 0.
+            priority (int, optional): Forwarding lane to claim from. Defaults to 0.
+
+        Returns:
+            List[MetricForwardingState]: The claimed deliveries, oldest first.
+        """
+        now = utc_now()
+        with db.atomic('IMMEDIATE'):
+            rows = list(MetricOutboxModel
+                        .select()
+                        .where((MetricOutboxModel.status == 'pending') &
+                               (MetricOutboxModel.priority == priority) &
+                               (MetricOutboxModel.next_attempt_at <= now))
+                        .order_by(MetricOutboxModel.id)
+                        .limit(limit))
+            if not rows:
+                return []
+            if len(rows) < min_count and rows[0].created_at > now - timedelta(seconds=max_wait_seconds):
+                return []
+            (MetricOutboxModel
+             .update(next_attempt_at=now + timedelta(seconds=lease_seconds))
+             .where(MetricOutboxModel.id.in_([row.id for row in rows]))
+             .execute())
+        return [MetricOutboxRepository._to_entity(row) for row in rows]
+
+    @staticmethod
+    def mark_sent(outbox_ids: List[int], status_code: int) -> None:
+        """Record a successful delivery.
+
+        Args:
+            outbox_ids (List[int]): IDs of the outbox entries delivered together.
+            status_code (int): HTTP status returned by the backend.
+        """
+        (MetricOutboxModel
+         .update(status='sent',
+                 attempts=MetricOutboxModel.attempts + 1,
+                 last_status_code=status_code,
+                 last_error=None,
+                 forwarded_at=utc_now())
+         .where(MetricOutboxModel.id.in_(outbox_ids))
+         .execute())
+
+    @staticmethod
+    def mark_failed_attempt(outbox_id: int, attempts: int, status_code: Optional[int], error: str,
+                            retry_delay: Optional[float]) -> None:
+        """Record a failed delivery attempt.
+
+        Args:
+            outbox_id (int): ID of the outbox entry.
+            attempts (int): Attempts made so far, including this one.
+            status_code (int, optional): HTTP status returned by the backend, if any.
+            error (str): Description of the failure.
+            retry_delay (float, optional): Seconds until the next attempt, or None to give up.
+        """
+        fields = {
+            'attempts': attempts,
+            'last_status_code': status_code,
+            'last_error': error
+        }
+        if retry_delay is None:
+            fields['status'] = 'failed'
+        else:
+            fields['next_attempt_at'] = utc_now() + timedelta(seconds=retry_delay)
+        MetricOutboxModel.update(**fields).where(MetricOutboxModel.id == outbox_id).execute()
+
+    @staticmethod
+    def prune_finished(older_than: datetime, batch_size: int = INSERT_CHUNK_SIZE) -> int:
+        """Delete the entries that will never be sent again, once they are old enough.
+
+        Sent, failed and superseded entries are deleted in batches, one transaction per
+        batch, so forwarders and ingestion are never locked out for long. Pending and
+        held entries are kept whatever their age.
+
+        Args:
+            older_than (datetime): Entries queued before this time are deleted.
+            batch_size (int, optional): Entries deleted per transaction. Defaults to INSERT_CHUNK_SIZE.
+
+        Returns:
+            int: The number of entries deleted.
+        """
+        model = MetricOutboxModel
+        deleted = 0
+        while True:
+            with db.atomic():
+                ids = [row.id for row in (model
+                                          .select(model.id)
+                                          .where(model.status.in_(('sent', 'failed', 'superseded')) &
+                                                 (model.created_at < older_than))
+                                          .order_by(model.id)
+                                          .limit(batch_size))]
+                if ids:
+                    deleted += model.delete().where(model.id.in_(ids)).execute()
+            if len(ids) < batch_size:
+                return deleted
+
+    @staticmethod
+    def find_by_record_id(record_id: int) -> Optional[MetricForwardingState]:
+        """Find the delivery state of a vehicle metric record.
+
+        Args:
+            record_id (int): ID of the vehicle metric record.
+
+        Returns:
+            Optional[MetricForwardingState]: The delivery state if the record was queued, None otherwise.
         """
+        row = (MetricOutboxModel
+               .select()
+               .where((MetricOutboxModel.record_id == record_id) & (MetricOutboxModel.topic == 'metrics'))
+               .order_by(MetricOutboxModel.id.desc())
+               .first())
+        return MetricOutboxRepository._to_entity(row) if row else None
 
-        record = VehicleMetricRecordModel.create(
-            device_id=vehicle_metric_record.device_id,
-            vehicle_id=vehicle_metric_record.vehicle_id,
-            latitude=vehicle_metric_record.latitude,
-            longitude=vehicle_metric_record.longitude,
-            CO2Ppm=vehicle_metric_record.CO2Ppm,
-            NH3Ppm=vehicle_metric_record.NH3Ppm,
-            BenzenePpm=vehicle_metric_record.BenzenePpm,
-            temperatureCelsius=vehicle_metric_record.temperatureCelsius,
-            pressureHpa=vehicle_metric_record.pressureHpa,
-            impactDetected=vehicle_metric_record.impactDetected
+
+class MetricRollupRepository:
+    @staticmethod
+    def _to_entity(row: MetricRollupModel) -> MetricAggregate:
+        """Map a rollup row to its domain entity."""
+        return MetricAggregate(
+            vehicle_id=row.vehicle_id,
+            resolution=row.resolution,
+            bucket_start=row.bucket_start,
+            field=row.field,
+            count=row.count,
+            minimum=row.minimum,
+            maximum=row.maximum,
+            mean=row.mean,
+            m2=row.m2
+        )
+
+    @staticmethod
+    def merge(aggregates: List[MetricAggregate]) -> None:
+        """Merge partial aggregates into the stored ones.
+
+        Must be called inside a transaction. Existing buckets are read with one query per
+        chunk, combined in memory and written back with a single upsert.
+
+        Args:
+            aggregates (List[MetricAggregate]): Aggregates of newly saved readings.
+        """
+        model = MetricRollupModel
+        step = INSERT_CHUNK_SIZE // 10
+        for start in range(0, len(aggregates), step):
+            chunk = {aggregate.key: aggregate for aggregate in aggregates[start:start + step]}
+            existing = (model
+                        .select()
+                        .where(SqlTuple(model.vehicle_id, model.resolution, model.field, model.bucket_start)
+                               .in_(list(chunk.keys()))))
+            for row in existing:
+                stored = MetricRollupRepository._to_entity(row)
+                stored.merge(chunk[stored.key])
+                chunk[stored.key] = stored
+            (model
+             .insert_many([{
+                 'vehicle_id': aggregate.vehicle_id,
+                 'resolution': aggregate.resolution,
+                 'bucket_start': aggregate.bucket_start,
+                 'field': aggregate.field,
+                 'count': aggregate.count,
+                 'minimum': aggregate.minimum,
+                 'maximum': aggregate.maximum,
+                 'mean': aggregate.mean,
+                 'm2': aggregate.m2
+             } for aggregate in chunk.values()])
+             .on_conflict(conflict_target=[model.vehicle_id, model.resolution, model.bucket_start, model.field],
+                          preserve=[model.count, model.minimum, model.maximum, model.mean, model.m2])
+             .execute())
+
+    @staticmethod
+    def find(vehicle_id: int, resolution: str, fields: Sequence[str], start: Optional[datetime] = None,
+             end: Optional[datetime] = None) -> List[MetricAggregate]:
+        """Find a vehicle's aggregates in a time window.
+
+        Args:
+            vehicle_id (int): Identifier for the vehicle.
+            resolution (str): Bucket width: '1m', '1h' or '1d'.
+            fields (Sequence[str]): Aggregated attributes to return.
+            start (datetime, optional): Inclusive lower bound on bucket_start.
+            end (datetime, optional): Exclusive upper bound on bucket_start.
+
+        Returns:
+            List[MetricAggregate]: The aggregates ordered by bucket_start.
+        """
+        model = MetricRollupModel
+        query = model.select().where((model.vehicle_id == vehicle_id) &
+                                     (model.resolution == resolution) &
+                                     (model.field.in_(list(fields))))
+        if start is not None:
+            query = query.where(model.bucket_start >= start)
+        if end is not None:
+            query = query.where(model.bucket_start < end)
+        return [MetricRollupRepository._to_entity(row) for row in query.order_by(model.bucket_start, model.field)]
+
+
+class TripRepository:
+    @staticmethod
+    def _to_entity(row: TripModel, vertices: list = None) -> Trip:
+        """Map a trip row to its domain entity.
+
+        The track of an open trip ends at its last raw point, which may not be a settled vertex yet.
+        """
+        if vertices is not None and row.status == 'open':
+            last_point = (row.last_latitude, row.last_longitude, row.last_at)
+            if not vertices or vertices[-1] != last_point:
+                vertices = vertices + [last_point]
+        return Trip(
+            vehicle_id=row.vehicle_id,
+            device_id=row.device_id,
+            started_at=row.started_at,
+            id=row.id,
+            ended_at=row.ended_at,
+            status=row.status,
+            raw_points=row.raw_points,
+            vertices=vertices
         )
 
-        return VehicleMetricRecord(
-            device_id=vehicle_metric_record.device_id,
-            vehicle_id=vehicle_metric_record.vehicle_id,
-            latitude=vehicle_metric_record.latitude,
-            longitude=vehicle_metric_record.longitude,
-            CO2Ppm=vehicle_metric_record.CO2Ppm,
-            NH3Ppm=vehicle_metric_record.NH3Ppm,
-            BenzenePpm=vehicle_metric_record.BenzenePpm,
-            temperatureCelsius=vehicle_metric_record.temperatureCelsius,
-            pressureHpa=vehicle_metric_record.pressureHpa,
-            impactDetected=vehicle_metric_record.impactDetected,
-            id=record.id
-        )
\ No newline at end of file
+    @staticmethod
+    def save_progress(trip: Trip, new_vertices: List[geo.TrackPoint], new_cells: set,
+                      last_point: geo.TrackPoint, last_moved: geo.TrackPoint) -> Trip:
+        """Persist a trip's state and append its new vertices and geohash cells.
+
+        Args:
+            trip (Trip): The trip; its ID is assigned on first save.
+            new_vertices (List[TrackPoint]): Vertices settled since the last save.
+            new_cells (set): Geohash cells crossed since the last save.
+            last_point (TrackPoint): The last raw point folded into the trip.
+            last_moved (TrackPoint): The last point where the vehicle was moving.
+
+        Returns:
+            Trip: The same trip with its ID assigned.
+        """
+        fields = {
+            'status': trip.status,
+            'ended_at': trip.ended_at,
+            'raw_points': trip.raw_points,
+            'last_latitude': last_point[0],
+            'last_longitude': last_point[1],
+            'last_at': last_point[2],
+            'last_moved_latitude': last_moved[0],
+            'last_moved_longitude': last_moved[1],
+            'last_moved_at': last_moved[2]
+        }
+        if trip.id is None:
+            trip.id = TripModel.insert(vehicle_id=trip.vehicle_id, device_id=trip.device_id,
+                                       started_at=trip.started_at, vertex_count=0, **fields).execute()
+            first_sequence = 0
+        else:
+            first_sequence = TripModel.get_by_id(trip.id).vertex_count
+        fields['vertex_count'] = first_sequence + len(new_vertices)
+        TripModel.update(**fields).where(TripModel.id == trip.id).execute()
+        for start in range(0, len(new_vertices), INSERT_CHUNK_SIZE):
+            TripPointModel.insert_many([{
+                'trip_id': trip.id,
+                'sequence': first_sequence + start + offset,
+                'latitude': vertex[0],
+                'longitude': vertex[1],
+                'recorded_at': vertex[2]
+            } for offset, vertex in enumerate(new_vertices[start:start + INSERT_CHUNK_SIZE])]).execute()
+        cells = sorted(new_cells)
+        for start in range(0, len(cells), INSERT_CHUNK_SIZE):
+            TripCellModel.insert_many([{
+                'geohash': cell,
+                'trip_id': trip.id,
+                'vehicle_id': trip.vehicle_id
+            } for cell in cells[start:start + INSERT_CHUNK_SIZE]]).on_conflict_ignore().execute()
+        return trip
+
+    @staticmethod
+    def find_vertices(trip_ids: Sequence[int]) -> dict:
+        """Load the simplified tracks of several trips.
+
+        Args:
+            trip_ids (Sequence[int]): The trips.
+
+        Returns:
+            dict: Trip ID to its list of (latitude, longitude, epoch seconds) vertices.
+        """
+        vertices = {trip_id: [] for trip_id in trip_ids}
+        for start in range(0, len(trip_ids), INSERT_CHUNK_SIZE):
+            rows = (TripPointModel
+                    .select(TripPointModel.trip_id, TripPointModel.latitude, TripPointModel.longitude,
+                            TripPointModel.recorded_at)
+                    .where(TripPointModel.trip_id.in_(trip_ids[start:start + INSERT_CHUNK_SIZE]))
+                    .order_by(TripPointModel.trip_id, TripPointModel.sequence)
+                    .tuples())
+            for trip_id, latitude, longitude, recorded_at in rows:
+                vertices[trip_id].append((latitude, longitude, recorded_at))
+        return vertices
+
+    @staticmethod
+    def find_tracks(vehicle_ids: Sequence[int]) -> dict:
+        """Load the stored segmentation state of several vehicles.
+
+        Open trips are loaded with their last vertex only, which is all tracking resumes from.
+
+        Args:
+            vehicle_ids (Sequence[int]): The vehicles.
+
+        Returns:
+            dict: Vehicle ID to a (version, device ID, last point, open trip) tuple, where the
+                open trip is None or a (trip, last moving point, observed_at) tuple. Vehicles
+                never seen are missing.
+        """
+        vehicle_ids = list(vehicle_ids)
+        rows = []
+        for start in range(0, len(vehicle_ids), INSERT_CHUNK_SIZE):
+            rows.extend(VehicleTrackModel.select().where(
+                VehicleTrackModel.vehicle_id.in_(vehicle_ids[start:start + INSERT_CHUNK_SIZE])
+            ))
+        trip_ids = [row.trip_id for row in rows if row.trip_id is not None]
+        trips = {}
+        for start in range(0, len(trip_ids), INSERT_CHUNK_SIZE):
+            trips.update((trip.id, trip) for trip in TripModel.select().where(
+                TripModel.id.in_(trip_ids[start:start + INSERT_CHUNK_SIZE]) & (TripModel.status == 'open')
+            ))
+        last_vertices = {}
+        keys = [(trip.id, trip.vertex_count - 1) for trip in trips.values()]
+        for start in range(0, len(keys), INSERT_CHUNK_SIZE):
+            for trip_id, latitude, longitude, recorded_at in (TripPointModel
+                    .select(TripPointModel.trip_id, TripPointModel.latitude, TripPointModel.longitude,
+                            TripPointModel.recorded_at)
+                    .where(SqlTuple(TripPointModel.trip_id, TripPointModel.sequence)
+                           .in_(keys[start:start + INSERT_CHUNK_SIZE]))
+                    .tuples()):
+                last_vertices[trip_id] = [(latitude, longitude, recorded_at)]
+        tracks = {}
+        for row in rows:
+            last_point = (row.latitude, row.longitude, row.recorded_at)
+            trip = trips.get(row.trip_id)
+            open_trip = None
+            if trip is not None:
+                open_trip = (Trip(trip.vehicle_id, trip.device_id, trip.started_at, id=trip.id,
+                                  raw_points=trip.raw_points, vertices=last_vertices.get(trip.id, [last_point])),
+                             (trip.last_moved_latitude, trip.last_moved_longitude, trip.last_moved_at),
+                             row.observed_at)
+            tracks[row.vehicle_id] = (row.version, row.device_id, last_point, open_trip)
+        return tracks
+
+    @staticmethod
+    def save_tracks(tracks: Sequence[tuple], version: int) -> None:
+        """Persist the segmentation state of several vehicles.
+
+        Args:
+            tracks (Sequence[tuple]): (vehicle ID, device ID, last point, open trip ID or None,
+                observed_at or None) tuples.
+            version (int): Version stamped on the saved states; unique to each save.
+        """
+        for start in range(0, len(tracks), INSERT_CHUNK_SIZE):
+            (VehicleTrackModel
+             .insert_many([{
+                 'vehicle_id': vehicle_id,
+                 'device_id': device_id,
+                 'latitude': last_point[0],
+                 'longitude': last_point[1],
+                 'recorded_at': last_point[2],
+                 'trip_id': trip_id,
+                 'observed_at': observed_at,
+                 'version': version
+             } for vehicle_id, device_id, last_point, trip_id, observed_at in tracks[start:start + INSERT_CHUNK_SIZE]])
+             .on_conflict(conflict_target=[VehicleTrackModel.vehicle_id],
+                          preserve=[VehicleTrackModel.device_id, VehicleTrackModel.latitude,
+                                    VehicleTrackModel.longitude, VehicleTrackModel.recorded_at,
+                                    VehicleTrackModel.trip_id, VehicleTrackModel.observed_at,
+                                    VehicleTrackModel.version])
+             .execute())
+
+    @staticmethod
+    def find_idle_tracks(cutoff: float) -> List[int]:
+        """Find the vehicles whose open trip received no point since a given time.
+
+        Args:
+            cutoff (float): Server time in epoch seconds.
+
+        Returns:
+            List[int]: The vehicles.
+        """
+        return [vehicle_id for vehicle_id, in (VehicleTrackModel
+                                               .select(VehicleTrackModel.vehicle_id)
+                                               .where(VehicleTrackModel.trip_id.is_null(False) &
+                                                      (VehicleTrackModel.observed_at < cutoff))
+                                               .tuples())]
+
+    @staticmethod
+    def find_by_vehicle(vehicle_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        limit: int = 100) -> List[Trip]:
+        """Find a vehicle's trips that overlap a time window, with their tracks.
+
+        Args:
+            vehicle_id (int): The vehicle.
+            start (datetime, optional): Only trips still going at or after this time.
+            end (datetime, optional): Only trips started before this time.
+            limit (int, optional): Maximum number of trips, most recent first. Defaults to 100.
+
+        Returns:
+            List[Trip]: The trips.
+        """
+        query = TripModel.select().where(TripModel.vehicle_id == vehicle_id)
+        if start is not None:
+            query = query.where(TripModel.ended_at.is_null() | (TripModel.ended_at >= start))
+        if end is not None:
+            query = query.where(TripModel.started_at < end)
+        rows = list(query.order_by(TripModel.started_at.desc()).limit(limit))
+        vertices = TripRepository.find_vertices([row.id for row in rows])
+        return [TripRepository._to_entity(row, vertices[row.id]) for row in rows]
+
+    @staticmethod
+    def find_in_cells(prefixes: Sequence[str], start: Optional[datetime] = None,
+                      end: Optional[datetime] = None) -> List[Trip]:
+        """Find trips that crossed any geohash cell under the given prefixes, with their tracks.
+
+        Args:
+            prefixes (Sequence[str]): Geohash prefixes, each matching its cell and the cells inside it.
+            start (datetime, optional): Only trips still going at or after this time.
+            end (datetime, optional): Only trips started before this time.
+
+        Returns:
+            List[Trip]: The candidate trips.
+        """
+        if not prefixes:
+            return []
+        condition = None
+        for prefix in prefixes:
+            # Range scans on the (geohash, trip_id) index instead of LIKE
+            match = (TripCellModel.geohash >= prefix) & (TripCellModel.geohash < prefix + '~')
+            condition = match if condition is None else condition | match
+        trip_ids = TripCellModel.select(TripCellModel.trip_id).where(condition).distinct()
+        query = TripModel.select().where(TripModel.id.in_(trip_ids))
+        if start is not None:
+            query = query.where(TripModel.ended_at.is_null() | (TripModel.ended_at >= start))
+        if end is not None:
+            query = query.where(TripModel.started_at < end)
+        rows = list(query.order_by(TripModel.vehicle_id, TripModel.started_at))
+        vertices = TripRepository.find_vertices([row.id for row in rows])
+        return [TripRepository._to_entity(row, vertices[row.id]) for row in rows]
@@ -1,23 +1,178 @@
-from flask import Blueprint, request, jsonify
-import requests
+import json
+import math
+import threading
+from functools import wraps
+from itertools import chain
+
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from iam.application.services import AuthApplicationService
 from iam.interfaces.services import authenticate_request
+from shared.infrastructure import config
+from shared.infrastructure.admission import DeviceRateLimiter, LoadShedder
+from shared.infrastructure.database import without_database
+from shared.infrastructure.periodic import PeriodicTask
+from shared.infrastructure.write_behind import WriteBehindQueueFull
+from shared.infrastructure.writer_process import WriterUnavailable
 from wellness.application.services import VehicleMetricRecordApplicationService
+from wellness.domain import geo
+from wellness.domain.schema import METRIC_SCHEMA
+from wellness.domain.services import IngestDurabilityPolicy
+from wellness.infrastructure import binary_format
+from wellness.infrastructure.forwarder import OutboxForwarder
 
 wellness_api = Blueprint('wellness', __name__, url_prefix='/api/v1')
 
 vehicle_metric_service = VehicleMetricRecordApplicationService()
+auth_service = AuthApplicationService()
+# Stages every ingested reading goes through, composed by METRICS_PIPELINE_STAGES
+ingest_pipeline = vehicle_metric_service.pipeline
+
+# Upstream forwarding lanes: bulk telemetry and critical events (impacts, gas alerts)
+outbox_forwarder = OutboxForwarder()
+priority_forwarder = OutboxForwarder.for_critical_events()
+vehicle_metric_service.add_critical_listener(priority_forwarder.notify)
+for forwarder in (outbox_forwarder, priority_forwarder):
+    forwarder.add_delivery_listener(vehicle_metric_service.notify_delivered)
+
+# Deletion of finished outbox entries past OUTBOX_RETENTION_DAYS
+outbox_pruner = PeriodicTask(
+    vehicle_metric_service.prune_outbox,
+    config.OUTBOX_PRUNE_INTERVAL_SECONDS,
+    name='metric-outbox-pruner'
+)
+# Retention and disk budget enforcement over the time partitions of stored records
+partition_maintainer = PeriodicTask(
+    vehicle_metric_service.maintain_partitions,
+    config.METRICS_PARTITION_MAINTENANCE_INTERVAL_SECONDS,
+    name='metric-partition-maintainer'
+)
+# Compression of cold, forwarded records into the columnar archive
+record_archiver = PeriodicTask(
+    vehicle_metric_service.archive_cold_records,
+    config.METRICS_ARCHIVE_INTERVAL_SECONDS,
+    name='metric-archiver'
+)
+# Closing of the trips of vehicles that stopped reporting
+trip_closer = PeriodicTask(
+    vehicle_metric_service.close_idle_trips,
+    config.TRIPS_CLOSE_INTERVAL_SECONDS,
+    name='trip-closer'
+)
+
+# Admission control of the ingestion endpoints: per-device token buckets, and a global
+# gate on concurrent requests and background write queue depth protecting the database writer
+device_limiter = None
+load_shedder = None
+if config.ADMISSION_ENABLED:
+    device_limiter = DeviceRateLimiter(
+        DeviceRateLimiter.parse_limits(config.ADMISSION_DEVICE_LIMITS),
+        DeviceRateLimiter.parse_patterns(config.ADMISSION_DEVICE_CLASSES),
+        max_devices=config.ADMISSION_MAX_DEVICES
+    )
+    load_shedder = LoadShedder(
+        config.ADMISSION_MAX_IN_FLIGHT,
+        int(config.METRICS_WRITE_BEHIND_MAX_QUEUE * config.ADMISSION_MAX_QUEUE_FRACTION),
+        lambda: vehicle_metric_service.background_writes.depth,
+        config.ADMISSION_SHED_RETRY_AFTER_SECONDS
+    )
+
+# Open live streams; each holds a server thread for as long as the client stays connected
+_live_streams_lock = threading.Lock()
+_live_streams = 0
+
+
+def _retry_later(message: str, retry_after: float, status_code: int):
+    """
+    Build a rejection telling the client when to try again.
+
+    :param message: The error message.
+    :param retry_after: Seconds until the request may succeed.
+    :param status_code: 429 for a device over its limit, 503 for an overloaded service.
+    :return: A JSON response with a Retry-After header.
+    """
+    seconds = max(1, math.ceil(retry_after))
+    response = jsonify({"error": message, "retry_after_seconds": seconds})
+    response.headers['Retry-After'] = str(seconds)
+    return response, status_code
+
+
+def _shed_load(view):
+    """
+    Decorate an ingestion endpoint so it is rejected with 503 while the service is saturated.
+
+    :param view: The endpoint function.
+    :return: The decorated endpoint.
+    """
+    @wraps(view)
+    def guarded(*args, **kwargs):
+        if load_shedder is None:
+            return view(*args, **kwargs)
+        if load_shedder.enter() is not None:
+            return _retry_later("Servicio saturado", load_shedder.retry_after, 503)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            load_shedder.leave()
+    return guarded
+
+
+def _admit_device(device_id: str, api_key: str):
+    """
+    Take a token from a device's rate limit bucket, then authenticate the device.
+
+    The bucket of the claimed device ID is charged first, so a flood of requests with bad
+    credentials is turned away without a credential lookup each; it only uses up the
+    budget of the device it claims to be. Both steps run before the request body is
+    parsed whenever the device is known from a header.
+
+    :param device_id: The device the request claims to come from.
+    :param api_key: The Bearer token of the request.
+    :return: None if the request may proceed, else a 401 or 429 JSON response.
+    """
+    if device_limiter is not None:
+        retry_after = device_limiter.acquire(device_id)
+        if retry_after > 0:
+            return _retry_later("Límite de solicitudes excedido", retry_after, 429)
+    if not auth_service.authenticate_device(device_id, api_key):
+        return jsonify({'error': 'Autenticación fallida'}), 401
+    return None
+
 
 @wellness_api.route('/metrics', methods=["POST"])
+@_shed_load
 def create_vehicle_metric_record():
     """
-    Endpoint to create a new vehicle metric record and forward to external API.
+    Endpoint to create a new vehicle metric record and queue it for the external API.
     Expects a JSON payload with device_id, vehicle_id, latitude, longitude,
     CO2Ppm, NH3Ppm, BenzenePpm, temperatureCelsius, humidityPercentage,
-    pressureHpa, impactDetected.
+    pressureHpa, impactDetected and an optional recorded_at (ISO 8601 or epoch).
     Requires an Authorization header with Bearer token.
 
-    :return: A JSON response with the created vehicle metric record.
-    201 if successful, 400 for invalid request, 401 for authentication failure.
+    Constrained devices may instead send a binary frame with one or more readings
+    (Content-Type application/vnd.bykerz.metrics, see wellness.infrastructure.binary_format);
+    it is answered like POST /metrics/batch.
+
+    The response is returned as soon as the record is stored locally; delivery to the
+    Bykerz backend is reported by GET /metrics/<id>/forwarding.
+
+    With ADMISSION_ENABLED, each device is rate limited by its class (ADMISSION_DEVICE_LIMITS);
+    sending the X-Device-Id header lets a request over the limit be rejected before its body
+    is parsed.
+
+    A durability mode may be chosen per request with the X-Durability header or the
+    durability query parameter, or per device with INGEST_DEVICE_DURABILITY. The reading
+    is then acknowledged with a minimal {"ack", "id"} body:
+    - fire-and-forget: 202 once queued for the next background commit, without an ID;
+      readings triggering an alert rule are stored as local-durable instead
+    - local-durable: 201 once committed locally
+    - upstream-confirmed: 201 once the Bykerz backend accepted it, or 202 with ack
+      local-durable if it did not within INGEST_UPSTREAM_ACK_TIMEOUT_SECONDS
+
+    :return: A JSON response with the created vehicle metric record and its forwarding status,
+    or the ack of the durability mode.
+    201 if successful, 202 if acknowledged before the requested durability, 400 for invalid
+    request, 401 for authentication failure, 429 if the device is over its rate limit,
+    503 if the service is saturated.
     """
     try:
         # Validate Authorization header
@@ -26,83 +181,611 @@ def create_vehicle_metric_record():
             return jsonify({'error': 'Token no proporcionado'}), 401
 
         api_key = auth_header.split(' ')[1]
-        data = request.json
-
-        device_id = data["device_id"]
-
-        # Authenticate device using AuthApplicationService
-        from iam.application.services import AuthApplicationService
-        auth_service = AuthApplicationService()
-
-        if not auth_service.authenticate_device(device_id, api_key):
-            return jsonify({'error': 'Autenticación fallida'}), 401
-
-        # Extract data from request
-        vehicle_id = data["vehicle_id"]
-        latitude = data["latitude"]
-        longitude = data["longitude"]
-        CO2Ppm = data["CO2Ppm"]
-        NH3Ppm = data["NH3Ppm"]
-        BenzenePpm = data["BenzenePpm"]
-        temperatureCelsius = data["temperatureCelsius"]
-        pressureHpa = data["pressureHpa"]
-        impactDetected = data["impactDetected"]
-
-        # Create local vehicle metric record
-        record = vehicle_metric_service.create_vehicle_metric_record(
-            device_id, vehicle_id, latitude, longitude, CO2Ppm, NH3Ppm,
-            BenzenePpm, temperatureCelsius, pressureHpa,
-            impactDetected
+        if request.mimetype == binary_format.CONTENT_TYPE:
+            return _create_from_binary_frame(api_key)
+        device_id = request.headers.get('X-Device-Id')
+        data = None
+        if not device_id:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return jsonify({"error": "Se esperaba un objeto JSON"}), 400
+            device_id = data["device_id"]
+
+        # Rate limit and authenticate the device, before parsing the body when possible
+        rejected = _admit_device(device_id, api_key)
+        if rejected is not None:
+            return rejected
+        if data is None:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return jsonify({"error": "Se esperaba un objeto JSON"}), 400
+            if data.get("device_id", device_id) != device_id:
+                return jsonify({"error": "device_id no coincide con el dispositivo autenticado"}), 400
+
+        # Run the reading through the ingestion pipeline, which stores it and queues it for the external API
+        record = vehicle_metric_service.build_vehicle_metric_record(
+            *METRIC_SCHEMA.extract(data, device_id), data.get("recorded_at")
+        )
+        durability = vehicle_metric_service.resolve_durability(
+            record, request.headers.get('X-Durability') or request.args.get('durability')
         )
+        result = ingest_pipeline.process([(0, record)], durability or IngestDurabilityPolicy.LOCAL_DURABLE)
+        if result.rejections:
+            return jsonify({"error": result.rejections[0][1]}), 400
+        if not result.records:
+            return jsonify({"forwarding_status": "suppressed"}), 200
+        record = result.records[0]
 
-        # Assemble payload for external API
-        import requests
+        if durability == IngestDurabilityPolicy.FIRE_AND_FORGET:
+            return jsonify({"ack": durability}), 202
+        if durability == IngestDurabilityPolicy.UPSTREAM_CONFIRMED and not \
+                vehicle_metric_service.wait_for_upstream_ack(record.id, config.INGEST_UPSTREAM_ACK_TIMEOUT_SECONDS):
+            return jsonify({"ack": IngestDurabilityPolicy.LOCAL_DURABLE, "id": record.id}), 202
+        if durability is not None:
+            return jsonify({"ack": durability, "id": record.id}), 201
+
+        response = METRIC_SCHEMA.to_response(record)
+        response["alerts"] = vehicle_metric_service.evaluate_alerts(record)
+        response["forwarding_status"] = "pending"
+        return jsonify(response), 201
+
+    except (WriteBehindQueueFull, WriterUnavailable):
+        return _retry_later("Servicio saturado", config.ADMISSION_SHED_RETRY_AFTER_SECONDS, 503)
+    except KeyError as e:
+        return jsonify({"error": f"Campo faltante: {str(e)}"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error interno: {str(e)}"}), 500
+
+
+def _iter_binary_records(rows, device_id: str, errors: list):
+    """
+    Build records from the raw tuples of a binary frame, collecting per-record errors.
+
+    :param rows: An iterator of raw record tuples in binary_format.RECORD_FIELDS order.
+    :param device_id: The device named in the frame header.
+    :param errors: A list that receives an {"index", "error"} entry for every rejected record.
+    :return: A generator of (index, record) tuples of validated, unsaved vehicle metric records.
+    """
+    for index, (recorded_at, vehicle_id, latitude, longitude, CO2Ppm, NH3Ppm, BenzenePpm,
+                temperatureCelsius, pressureHpa, flags) in enumerate(rows):
+        try:
+            yield index, vehicle_metric_service.build_vehicle_metric_record(
+                device_id, vehicle_id, latitude, longitude, CO2Ppm, NH3Ppm, BenzenePpm,
+                temperatureCelsius, pressureHpa, bool(flags & binary_format.FLAG_IMPACT),
+                recorded_at or None
+            )
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+
+
+def _create_from_binary_frame(api_key: str):
+    """
+    Store every reading of a binary metrics frame in one transaction.
+
+    :param api_key: The Bearer token of the request.
+    :return: A JSON response with the stored IDs and a per-record error list.
+    201 if at least one record was stored, 200 if every valid record was suppressed,
+    400 for a malformed frame, 401 for authentication failure, 429 if the device is over its rate limit.
+    """
+    try:
+        device_id, count, rows = binary_format.decode_frame(request.get_data(cache=False))
+    except binary_format.BinaryFormatError as e:
+        return jsonify({"error": f"Trama binaria inválida: {str(e)}"}), 400
+    if not device_id or count == 0:
+        return jsonify({"error": "Trama binaria vacía"}), 400
+
+    rejected = _admit_device(device_id, api_key)
+    if rejected is not None:
+        return rejected
+
+    errors = []
+    return _store_batch(_iter_binary_records(rows, device_id, errors), errors)
+
+
+def _store_batch(indexed_records, errors: list):
+    """
+    Run a stream of validated records through the ingestion pipeline, storing them in one
+    transaction a micro-batch at a time, and summarize the outcome.
+
+    Records failing the plausibility checks are added to the per-row errors; valid records
+    dropped by the deadband filter are counted as suppressed.
+
+    :param indexed_records: An iterator of (index, record) tuples, index being the row's position in the request.
+    :param errors: The per-row errors collected so far while parsing.
+    :return: A JSON response with the stored IDs and the per-row error list.
+    201 if at least one row was stored, 200 if every valid row was suppressed, 400 if no row was valid.
+    """
+    result = ingest_pipeline.process(indexed_records, keep_records=False)
+    errors.extend({"index": index, "error": reason} for index, reason in result.rejections)
+    errors.sort(key=lambda error: error["index"])
+    return jsonify({
+        "accepted": len(result.ids),
+        "rejected": len(errors),
+        "suppressed": result.suppressed,
+        "ids": result.ids,
+        "errors": errors,
+        "forwarding_status": "pending"
+    }), 201 if result.ids else 200 if result.suppressed else 400
+
+
+@wellness_api.route('/metrics', methods=["GET"])
+def query_vehicle_metric_records():
+    """
+    Endpoint to read a vehicle's metric records from the local store.
+    Query parameters: vehicle_id (required), from and to (ISO 8601 or epoch, UTC),
+    fields (comma-separated attributes to include), limit and cursor (from next_cursor
+    of the previous page).
+    Rows are streamed to the client as they are read, ordered by recorded_at and id.
+
+    :return: A streamed JSON object {"data": [...], "next_cursor": str|null}.
+    200 if successful, 400 for invalid parameters.
+    """
+    try:
+        vehicle_id = int(request.args["vehicle_id"])
+        start = request.args.get("from")
+        end = request.args.get("to")
+        start = vehicle_metric_service.vehicle_metric_service.parse_recorded_at(start) if start else None
+        end = vehicle_metric_service.vehicle_metric_service.parse_recorded_at(end) if end else None
+        fields = [name.strip() for name in request.args.get("fields", "").split(",") if name.strip()]
+        limit = int(request.args.get("limit", config.METRICS_QUERY_DEFAULT_LIMIT))
+        if limit <= 0 or limit > config.METRICS_QUERY_MAX_LIMIT:
+            raise ValueError(f"limit debe estar entre 1 y {config.METRICS_QUERY_MAX_LIMIT}")
+        rows = vehicle_metric_service.query_vehicle_metric_records(
+            vehicle_id, start, end, fields, request.args.get("cursor"), limit
+        )
+    except KeyError as e:
+        return jsonify({"error": f"Parámetro faltante: {e.args[0]}"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def generate():
+        yield '{"data":['
+        count = 0
+        last = None
+        for row in rows:
+            last = row
+            row = dict(row, recorded_at=row['recorded_at'].isoformat() + 'Z')
+            yield (',' if count else '') + json.dumps(row, separators=(',', ':'))
+            count += 1
+        next_cursor = None
+        if count == limit:
+            next_cursor = vehicle_metric_service.encode_cursor(last['recorded_at'], last['id'])
+        yield '],"next_cursor":' + json.dumps(next_cursor) + '}'
+
+    return Response(stream_with_context(generate()), status=200, mimetype='application/json')
 
-        api_url = "https://bykerz-backend.onrender.com/api/v1/metrics"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
 
-        payload = {
-            "vehicleId": vehicle_id,
-            "latitude": latitude,
-            "longitude": longitude,
-            "CO2Ppm": CO2Ppm,
-            "NH3Ppm": NH3Ppm,
-            "BenzenePpm": BenzenePpm,
-            "temperatureCelsius": temperatureCelsius,
-            "pressureHpa": pressureHpa,
-            "impactDetected": impactDetected
+@wellness_api.route('/vehicles/<int:vehicle_id>/rollups', methods=["GET"])
+def get_vehicle_rollups(vehicle_id: int):
+    """
+    Endpoint to read a vehicle's aggregated sensor statistics.
+    Query parameters: resolution (1m, 1h or 1d; default 1h), from and to (bounds on the
+    bucket start, ISO 8601 or epoch, UTC) and fields (comma-separated).
+
+    :param vehicle_id: The ID of the vehicle.
+    :return: A JSON response with one entry per bucket holding count, min, max, mean and
+    sample variance of each field.
+    200 if successful, 400 for invalid parameters.
+    """
+    try:
+        start = request.args.get("from")
+        end = request.args.get("to")
+        start = vehicle_metric_service.vehicle_metric_service.parse_recorded_at(start) if start else None
+        end = vehicle_metric_service.vehicle_metric_service.parse_recorded_at(end) if end else None
+        fields = [name.strip() for name in request.args.get("fields", "").split(",") if name.strip()]
+        resolution = request.args.get("resolution", "1h")
+        aggregates = vehicle_metric_service.get_vehicle_rollups(vehicle_id, resolution, start, end, fields)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    buckets = {}
+    for aggregate in aggregates:
+        bucket = buckets.setdefault(aggregate.bucket_start, {
+            "bucket_start": aggregate.bucket_start.isoformat() + 'Z',
+            "fields": {}
+        })
+        bucket["fields"][aggregate.field] = {
+            "count": aggregate.count,
+            "min": aggregate.minimum,
+            "max": aggregate.maximum,
+            "mean": aggregate.mean,
+            "variance": aggregate.variance
         }
+    return jsonify({
+        "vehicle_id": vehicle_id,
+        "resolution": resolution,
+        "buckets": list(buckets.values())
+    }), 200
+
+
+@wellness_api.route('/vehicles/<int:vehicle_id>/latest', methods=["GET"])
+@without_database
+def get_vehicle_latest(vehicle_id: int):
+    """
+    Endpoint to read a vehicle's latest readings from memory, for dashboards.
+    Query parameters: history (recent readings to include, default 0, at most
+    LIVE_HISTORY_SIZE).
+
+    :param vehicle_id: The ID of the vehicle.
+    :return: A JSON response with the latest reading, the latest reading of each device,
+    the recent readings and the sequence number to resume a live stream from.
+    200 if successful, 400 for invalid parameters, 404 if no reading of the vehicle was
+    stored since the service started, 503 if the writer process cannot be reached.
+    """
+    try:
+        history = int(request.args.get("history", 0))
+        if history < 0 or history > config.LIVE_HISTORY_SIZE:
+            raise ValueError(f"history debe estar entre 0 y {config.LIVE_HISTORY_SIZE}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        snapshot = vehicle_metric_service.get_latest_readings(vehicle_id, history)
+    except WriterUnavailable:
+        return _retry_later("Servicio saturado", config.ADMISSION_SHED_RETRY_AFTER_SECONDS, 503)
+    if snapshot is None:
+        return jsonify({"error": "Sin lecturas recientes"}), 404
+    return jsonify(dict(snapshot, vehicle_id=vehicle_id)), 200
+
+
+@wellness_api.route('/vehicles/<int:vehicle_id>/stream', methods=["GET"])
+@without_database
+def stream_vehicle_readings(vehicle_id: int):
+    """
+    Endpoint to follow a vehicle's readings as Server-Sent Events.
+    Each stored reading is sent as a "reading" event whose id is its sequence number; a
+    reconnecting client sends it back in Last-Event-ID to resume without gaps while the
+    readings are still in memory. A comment line is sent every LIVE_KEEPALIVE_SECONDS
+    when idle. The stream ends if the writer process becomes unreachable; the client then
+    reconnects and resumes.
+
+    :param vehicle_id: The ID of the vehicle.
+    :return: A text/event-stream response.
+    200 if successful, 400 for an invalid Last-Event-ID, 503 when too many streams are open.
+    """
+    try:
+        last_event_id = request.headers.get("Last-Event-ID")
+        after = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID inválido"}), 400
+    global _live_streams
+    with _live_streams_lock:
+        if _live_streams >= config.LIVE_MAX_STREAMS:
+            return _retry_later("Demasiadas transmisiones abiertas", config.LIVE_KEEPALIVE_SECONDS, 503)
+        _live_streams += 1
+
+    def generate():
+        yield 'retry: 3000\n\n'
+        try:
+            for entry in vehicle_metric_service.stream_latest_readings(
+                    vehicle_id, after, config.LIVE_KEEPALIVE_SECONDS):
+                if entry is None:
+                    yield ': keepalive\n\n'
+                    continue
+                sequence, reading = entry
+                yield f'id: {sequence}\nevent: reading\ndata: {json.dumps(reading, separators=(",", ":"))}\n\n'
+        except WriterUnavailable:
+            return
 
-        # Send data to external API
-        external_response = requests.post(api_url, json=payload, headers=headers, timeout=10)
-
-        # Return response including external API status
-        return jsonify({
-            "id": record.id,
-            "device_id": record.device_id,
-            "vehicle_id": record.vehicle_id,
-            "latitude": record.latitude,
-            "longitude": record.longitude,
-            "CO2Ppm": record.CO2Ppm,
-            "NH3Ppm": record.NH3Ppm,
-            "BenzenePpm": record.BenzenePpm,
-            "temperatureCelsius": record.temperatureCelsius,
-            "pressureHpa": record.pressureHpa,
-            "impactDetected": record.impactDetected,
-            "external_api_status": external_response.status_code
-        }), 201
+    def release():
+        global _live_streams
+        with _live_streams_lock:
+            _live_streams -= 1
 
+    # No stream_with_context: the stream needs neither the request nor its database connection
+    response = Response(generate(), status=200, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(release)
+    return response
+
+def _trip_to_json(trip) -> dict:
+    """
+    Serialize a trip with its simplified track as an encoded polyline.
+
+    :param trip: The trip.
+    :return: A JSON-serializable dictionary.
+    """
+    return {
+        "id": trip.id,
+        "vehicle_id": trip.vehicle_id,
+        "status": trip.status,
+        "started_at": trip.started_at.isoformat() + 'Z',
+        "ended_at": trip.ended_at.isoformat() + 'Z' if trip.ended_at else None,
+        "raw_points": trip.raw_points,
+        "vertex_count": len(trip.vertices),
+        "polyline": geo.encode_polyline(trip.vertices)
+    }
+
+
+@wellness_api.route('/vehicles/<int:vehicle_id>/trips', methods=["GET"])
+def get_vehicle_trips(vehicle_id: int):
+    """
+    Endpoint to read a vehicle's trips, segmented by idle gaps, with simplified tracks.
+    Query parameters: from and to (ISO 8601 or epoch, UTC) and limit (default 100).
+
+    :param vehicle_id: The ID of the vehicle.
+    :return: A JSON response with the trips, most recent first.
+    200 if successful, 400 for invalid parameters.
+    """
+    try:
+        start = request.args.get("from")
+        end = request.args.get("to")
+        start = vehicle_metric_service.vehicle_metric_service.parse_recorded_at(start) if start else None
+        end = vehicle_metric_service.vehicle_metric_service.parse_recorded_at(end) if end else None
+        limit = int(request.args.get("limit", 100))
+        if limit <= 0 or limit > config.METRICS_QUERY_MAX_LIMIT:
+            raise ValueError(f"limit debe estar entre 1 y {config.METRICS_QUERY_MAX_LIMIT}")
+        trips = vehicle_metric_service.get_vehicle_trips(vehicle_id, start, end, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "vehicle_id": vehicle_id,
+        "trips": [_trip_to_json(trip) for trip in trips]
+    }), 200
+
+
+@wellness_api.route('/trips/area', methods=["GET"])
+def get_trips_in_area():
+    """
+    Endpoint to find which vehicles passed through an area, using the geohash index of trips.
+    Query parameters: min_lat, min_lon, max_lat and max_lon (required), from and to
+    (ISO 8601 or epoch, UTC).
+
+    :return: A JSON response with, per vehicle, the trips that crossed the area.
+    200 if successful, 400 for invalid parameters.
+    """
+    try:
+        bounds = [float(request.args[name]) for name in ("min_lat", "min_lon", "max_lat", "max_lon")]
+        start = request.args.get("from")
+        end = request.args.get("to")
+        start = vehicle_metric_service.vehicle_metric_service.parse_recorded_at(start) if start else None
+        end = vehicle_metric_service.vehicle_metric_service.parse_recorded_at(end) if end else None
+        trips = vehicle_metric_service.find_trips_in_area(*bounds, start, end)
     except KeyError as e:
-        return jsonify({"error": f"Campo faltante: {str(e)}"}), 400
+        return jsonify({"error": f"Parámetro faltante: {e.args[0]}"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    vehicles = {}
+    for trip in trips:
+        vehicles.setdefault(trip.vehicle_id, []).append(_trip_to_json(trip))
+    return jsonify({
+        "vehicles": [{"vehicle_id": vehicle_id, "trips": vehicle_trips}
+                     for vehicle_id, vehicle_trips in vehicles.items()]
+    }), 200
+
+
+@wellness_api.route('/metrics/forwarding/stats', methods=["GET"])
+def get_forwarding_stats():
+    """
+    Endpoint to report delivery latency of each upstream forwarding lane.
+
+    :return: A JSON response with, per lane, delivered count, p50/p99/max latency and SLO violations.
+    200 always.
+    """
+    return jsonify({
+        "bulk": outbox_forwarder.stats(),
+        "critical": priority_forwarder.stats()
+    }), 200
+
+
+@wellness_api.route('/metrics/admission/stats', methods=["GET"])
+def get_admission_stats():
+    """
+    Endpoint to report the per-device rate limits and the global load shedding gate.
+
+    :return: A JSON response with the device limiter and load shedder counters.
+    200 if admission control is enabled, 404 otherwise.
+    """
+    if device_limiter is None:
+        return jsonify({"error": "Control de admisión deshabilitado"}), 404
+    return jsonify({
+        "devices": device_limiter.stats(),
+        "load": load_shedder.stats()
+    }), 200
+
+
+@wellness_api.route('/metrics/pipeline/stats', methods=["GET"])
+def get_pipeline_stats():
+    """
+    Endpoint to report the stages of the ingestion pipeline and the time spent in each.
+
+    :return: A JSON response with the micro-batch size and, per stage in order, its batch,
+    record and timing counters; the persist stage also reports the background write queue.
+    200 always.
+    """
+    return jsonify(ingest_pipeline.stats()), 200
+
+
+@wellness_api.route('/metrics/live/stats', methods=["GET"])
+@without_database
+def get_live_stats():
+    """
+    Endpoint to report the in-memory cache of latest readings and the open live streams.
+
+    :return: A JSON response with the tracked vehicles, published readings and open streams.
+    200 if successful, 503 if the writer process cannot be reached.
+    """
+    try:
+        stats = vehicle_metric_service.live_readings.stats()
+    except WriterUnavailable:
+        return _retry_later("Servicio saturado", config.ADMISSION_SHED_RETRY_AFTER_SECONDS, 503)
+    stats["max_streams"] = config.LIVE_MAX_STREAMS
+    stats["open_streams"] = _live_streams
+    return jsonify(stats), 200
+
+
+@wellness_api.route('/metrics/partitions', methods=["GET"])
+def get_partition_stats():
+    """
+    Endpoint to report the time partitions of stored records and the database space in use.
+
+    :return: A JSON response with the partitioning settings, used bytes, dropped counters
+    and each partition's period and whether it still has pending deliveries.
+    200 always.
+    """
+    return jsonify(vehicle_metric_service.get_partition_stats()), 200
+
+
+@wellness_api.route('/metrics/archive/stats', methods=["GET"])
+def get_archive_stats():
+    """
+    Endpoint to report the size of the compressed columnar archive of cold records.
+
+    :return: A JSON response with the segment, record and compressed byte counts.
+    200 always.
+    """
+    return jsonify(vehicle_metric_service.get_archive_stats()), 200
+
+
+@wellness_api.route('/metrics/filter/stats', methods=["GET"])
+def get_deadband_stats():
+    """
+    Endpoint to report how many readings the deadband filter passed and suppressed.
+
+    :return: A JSON response with the filter counters and suppression ratio.
+    200 if the filter is enabled, 404 otherwise.
+    """
+    stats = vehicle_metric_service.get_deadband_stats()
+    if stats is None:
+        return jsonify({"error": "Filtro deshabilitado"}), 404
+    return jsonify(stats), 200
+
+
+@wellness_api.route('/metrics/<int:record_id>/forwarding', methods=["GET"])
+def get_vehicle_metric_forwarding(record_id: int):
+    """
+    Endpoint to check whether a vehicle metric record has reached the external API.
+
+    :param record_id: The ID of the vehicle metric record.
+    :return: A JSON response with the delivery status, attempts and last error.
+    200 if the record was queued, 404 otherwise or once its finished delivery was pruned.
+    """
+    state = vehicle_metric_service.get_forwarding_state(record_id)
+    if state is None:
+        return jsonify({"error": "Registro no encontrado"}), 404
+    return jsonify({
+        "record_id": state.record_id,
+        "status": state.status,
+        "attempts": state.attempts,
+        "last_status_code": state.last_status_code,
+        "last_error": state.last_error,
+        "forwarded_at": state.forwarded_at.isoformat() if state.forwarded_at else None
+    }), 200
+
+
+def _iter_batch_rows():
+    """
+    Iterate over the rows of a batch ingestion body.
+
+    Accepts a JSON array (application/json) or newline-delimited JSON
+    (application/x-ndjson), the latter read line by line from the request stream.
+    Malformed NDJSON lines are yielded as ValueError instances so they can be reported per row.
+
+    :return: A generator of (index, row) tuples.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        index = 0
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError:
+                yield index, ValueError("JSON inválido")
+            index += 1
+        return
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        raise ValueError("Se esperaba un arreglo JSON o NDJSON")
+    yield from enumerate(rows)
+
+
+def _iter_batch_records(rows, device_id: str, errors: list):
+    """
+    Validate batch rows, collecting per-row errors and yielding valid records.
+
+    :param rows: An iterator of (index, row) tuples.
+    :param device_id: The authenticated device; every row must belong to it.
+    :param errors: A list that receives an {"index", "error"} entry for every rejected row.
+    :return: A generator of (index, record) tuples of validated, unsaved vehicle metric records.
+    """
+    for index, data in rows:
+        try:
+            if isinstance(data, Exception):
+                raise data
+            if not isinstance(data, dict):
+                raise ValueError("Se esperaba un objeto JSON")
+            if data.get("device_id", device_id) != device_id:
+                raise ValueError("device_id no coincide con el dispositivo autenticado")
+            yield index, vehicle_metric_service.build_vehicle_metric_record(
+                *METRIC_SCHEMA.extract(data, device_id), data.get("recorded_at")
+            )
+        except KeyError as e:
+            errors.append({"index": index, "error": f"Campo faltante: {str(e)}"})
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+
+
+@wellness_api.route('/metrics/batch', methods=["POST"])
+@_shed_load
+def create_vehicle_metric_records_batch():
+    """
+    Endpoint to ingest many vehicle metric records in one request, e.g. when a device
+    replays readings buffered while offline.
+    Accepts a JSON array or an NDJSON stream of objects with the same fields as POST /metrics.
+    The device is taken from the X-Device-Id header or, if absent, from the first row, and
+    is authenticated once with the Bearer token. All valid rows are stored in one transaction.
+
+    Rows failing the plausibility checks (ranges, non-finite values, GPS jumps, rates of
+    change) are reported per row; valid rows dropped by the deadband filter are counted
+    as suppressed.
+
+    Devices are rate limited as in POST /metrics, before the body is parsed when the
+    X-Device-Id header is sent.
+
+    :return: A JSON response with the stored IDs and a per-row error list.
+    201 if at least one row was stored, 200 if every valid row was suppressed,
+    400 if no row was valid, 401 for authentication failure,
+    429 if the device is over its rate limit, 503 if the service is saturated.
+    """
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'error': 'Token no proporcionado'}), 401
+        api_key = auth_header.split(' ')[1]
+
+        # A device named in the header is admitted before any of the body is parsed
+        device_id = request.headers.get('X-Device-Id')
+        if device_id:
+            rejected = _admit_device(device_id, api_key)
+            if rejected is not None:
+                return rejected
+
+        rows = _iter_batch_rows()
+        first = next(rows, None)
+        if first is None:
+            return jsonify({"error": "Lote vacío"}), 400
+        rows = chain([first], rows)
+
+        if not device_id:
+            device_id = first[1].get("device_id") if isinstance(first[1], dict) else None
+            if not device_id:
+                return jsonify({'error': 'Campo faltante: device_id'}), 400
+            rejected = _admit_device(device_id, api_key)
+            if rejected is not None:
+                return rejected
+
+        errors = []
+        return _store_batch(_iter_batch_records(rows, device_id, errors), errors)
+
+    except WriterUnavailable:
+        return _retry_later("Servicio saturado", config.ADMISSION_SHED_RETRY_AFTER_SECONDS, 503)
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
-    except requests.Timeout:
-        return jsonify({"error": "Timeout al conectar con API externa"}), 504
-    except requests.RequestException as e:
-        return jsonify({"error": f"Error al conectar con API externa: {str(e)}"}), 500
     except Exception as e:
         return jsonify({"error": f"Error interno: {str(e)}"}), 500
 
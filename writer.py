@@ -0,0 +1,61 @@
+import logging
+
+from shared.infrastructure import config
+from shared.infrastructure.database import init_db
+from shared.infrastructure.periodic import PeriodicTask
+from shared.infrastructure.writer_process import WriterServer
+from wellness.application.services import VehicleMetricRecordApplicationService
+from wellness.infrastructure.forwarder import OutboxForwarder
+
+
+def main() -> None:
+    """
+    Run the dedicated writer process of a multi-worker deployment.
+
+    Request workers started with the same METRICS_WRITER_ADDRESS parse and authenticate
+    readings, then send them here; this process alone inserts metric records, outbox
+    entries, rollups and trips, in group commits across all workers, holds the latest
+    readings the workers' live endpoints read and the state their validate, filter and smooth
+    stages check readings against, and runs the outbox forwarders, outbox pruning,
+    partition maintenance, archiving and the trip closer.
+
+    Usage: METRICS_WRITER_ADDRESS=127.0.0.1:6010 METRICS_WRITER_AUTHKEY=<secret> python writer.py
+    :return: None
+    """
+    logging.basicConfig(level=logging.INFO)
+    if not config.METRICS_WRITER_ADDRESS:
+        raise SystemExit("METRICS_WRITER_ADDRESS is not set")
+    if not config.METRICS_WRITER_AUTHKEY:
+        raise SystemExit("METRICS_WRITER_AUTHKEY is not set")
+    init_db()
+    service = VehicleMetricRecordApplicationService(use_remote_writer=False)
+    if config.OUTBOX_FORWARDER_ENABLED:
+        outbox_forwarder = OutboxForwarder()
+        priority_forwarder = OutboxForwarder.for_critical_events()
+        service.add_critical_listener(priority_forwarder.notify)
+        for forwarder in (priority_forwarder, outbox_forwarder):
+            forwarder.start()
+    if config.OUTBOX_RETENTION_DAYS:
+        PeriodicTask(service.prune_outbox, config.OUTBOX_PRUNE_INTERVAL_SECONDS, name='metric-outbox-pruner').start()
+    if config.METRICS_PARTITIONING:
+        PeriodicTask(service.maintain_partitions, config.METRICS_PARTITION_MAINTENANCE_INTERVAL_SECONDS,
+                     name='metric-partition-maintainer').start()
+    if config.METRICS_ARCHIVE_AFTER_DAYS:
+        PeriodicTask(service.archive_cold_records, config.METRICS_ARCHIVE_INTERVAL_SECONDS,
+                     name='metric-archiver').start()
+    if config.TRIPS_ENABLED:
+        PeriodicTask(service.close_idle_trips, config.TRIPS_CLOSE_INTERVAL_SECONDS, name='trip-closer').start()
+    WriterServer(
+        config.METRICS_WRITER_ADDRESS,
+        config.METRICS_WRITER_AUTHKEY.encode(),
+        service.persist_writer_batches,
+        max_rows=config.METRICS_WRITE_BEHIND_MAX_ROWS,
+        max_delay=config.METRICS_WRITER_MAX_DELAY_MS / 1000.0,
+        max_queue=config.METRICS_WRITE_BEHIND_MAX_QUEUE,
+        allow_remote=config.METRICS_WRITER_ALLOW_REMOTE,
+        query_handler=service.answer_query
+    ).serve_forever()
+
+
+if __name__ == '__main__':
+    main()